@@ -0,0 +1,282 @@
+#benchmark.py
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from client import TCPClient, ClusterClient
+from config import SERVER_HOST
+from stats import LatencyHistogram, PERCENTILES
+
+OPERATIONS = ('get', 'set', 'set_with_ttl', 'delete', 'publish')
+DEFAULT_MIX = 'get=50,set=40,set_with_ttl=5,delete=4,publish=1'
+
+def parse_mix(text):
+    """Parse 'get=50,set=40,...' into a list of (operation, weight) pairs."""
+    mix = []
+    for part in text.split(','):
+        operation, _, weight = part.partition('=')
+        operation = operation.strip()
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{operation}', expected one of {', '.join(OPERATIONS)}")
+        weight = float(weight) if weight else 1.0
+        if weight > 0:
+            mix.append((operation, weight))
+    if not mix:
+        raise ValueError("The operation mix is empty")
+    return mix
+
+def build_request(client, operation, key, value, ttl):
+    if operation == 'get':
+        return client.build_command('get', key)
+    if operation == 'set':
+        return client.build_command('set', key, value)
+    if operation == 'set_with_ttl':
+        return client.build_command('set_with_ttl', key, value, ttl)
+    if operation == 'delete':
+        return client.build_command('delete', key)
+    return client.build_command('publish', type='pubsub', channel='benchmark', message=value)
+
+def make_client(options, **kw):
+    client_class = ClusterClient if options["cluster"] else TCPClient
+    return client_class(options["host"], options["port"], **kw)
+
+def run_client(options, requests, seed, results):
+    """Send requests operations from one connection and add its histograms to results."""
+    rng = random.Random(seed)
+    operations, weights = zip(*options["mix"])
+    value = 'x' * options["value_size"]
+    client = make_client(options, pool_size=1, timeout=options["timeout"])
+    histograms = {operation: LatencyHistogram() for operation in operations}
+    errors = 0
+    sent = 0
+    try:
+        while sent < requests:
+            batch = rng.choices(operations, weights, k=min(options["pipeline"], requests - sent))
+            commands = [build_request(client, operation, f"key:{rng.randrange(options['keyspace'])}",
+                                      value, options["ttl"]) for operation in batch]
+            started = time.perf_counter_ns()
+            responses = client.send_commands(commands)
+            # With pipelining every command in a batch sees the batch's round trip
+            elapsed = time.perf_counter_ns() - started
+            for operation in batch:
+                histograms[operation].record(elapsed)
+            errors += sum('error' in response for response in responses)
+            sent += len(batch)
+    finally:
+        client.disconnect()
+    results.append((histograms, errors))
+
+def run_process(options, clients, requests, seed):
+    """Run clients threads that share requests between them. Returns the merged results."""
+    results = []
+    threads = []
+    for i in range(clients):
+        share = requests // clients + (i < requests % clients)
+        thread = threading.Thread(target=run_client, args=(options, share, seed + i, results), daemon=True)
+        threads.append(thread)
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    histograms = {}
+    errors = 0
+    for client_histograms, client_errors in results:
+        errors += client_errors
+        for operation, histogram in client_histograms.items():
+            histograms.setdefault(operation, LatencyHistogram()).merge(histogram)
+    return {operation: histogram.to_dict() for operation, histogram in histograms.items()}, errors, len(results)
+
+def populate(options):
+    """Give every key in the keyspace a value so reads hit."""
+    client = make_client(options, pool_size=1, timeout=max(options["timeout"], 30))
+    value = 'x' * options["value_size"]
+    try:
+        for start in range(0, options["keyspace"], 10000):
+            client.mset([(f"key:{i}", value) for i in range(start, min(start + 10000, options["keyspace"]))])
+    finally:
+        client.disconnect()
+
+def run_benchmark(options):
+    """Run one benchmark against a server and return its results as a dict."""
+    if options["populate"]:
+        populate(options)
+    processes = max(1, min(options["processes"], options["clients"]))
+    started = time.perf_counter()
+    if processes == 1:
+        outcomes = [run_process(options, options["clients"], options["requests"], options["seed"])]
+    else:
+        # Client threads share one interpreter lock, so heavy loads are spread over processes
+        jobs = []
+        for i in range(processes):
+            clients = options["clients"] // processes + (i < options["clients"] % processes)
+            requests = options["requests"] // processes + (i < options["requests"] % processes)
+            jobs.append((options, clients, requests, options["seed"] + i * options["clients"]))
+        with multiprocessing.Pool(processes) as pool:
+            outcomes = pool.starmap(run_process, jobs)
+    elapsed = time.perf_counter() - started
+
+    overall = LatencyHistogram()
+    per_operation = {}
+    errors = 0
+    finished = 0
+    for histograms, process_errors, clients in outcomes:
+        errors += process_errors
+        finished += clients
+        for operation, data in histograms.items():
+            histogram = LatencyHistogram.from_dict(data)
+            per_operation.setdefault(operation, LatencyHistogram()).merge(histogram)
+            overall.merge(histogram)
+    if finished < options["clients"]:
+        raise RuntimeError(f"{options['clients'] - finished} clients failed")
+    return {
+        "config": dict({name: options[name] for name in ("clients", "processes", "requests", "pipeline",
+                                                        "value_size", "keyspace", "ttl", "mode",
+                                                        "cluster")},
+                       mix=dict(options["mix"])),
+        "requests": overall.total,
+        "errors": errors,
+        "seconds": elapsed,
+        "ops_per_sec": overall.total / elapsed if elapsed else 0.0,
+        "latency": overall.summary(),
+        "histogram": overall.buckets(),
+        "operations": {operation: histogram.summary() for operation, histogram in per_operation.items()},
+        "timestamp": time.time(),
+    }
+
+def start_server(mode, port, cluster_nodes=None):
+    """Start a TCPServer in a child process with its files in a scratch directory.
+
+    Returns (process, directory). The child has its own interpreter, so the
+    server and the load generator don't compete for one interpreter lock.
+    With cluster_nodes the server is one node of that cluster.
+    """
+    directory = tempfile.mkdtemp(prefix="imdb-benchmark-")
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+    code = f"from network import TCPServer; TCPServer(port={port}, mode={mode!r}, cluster_nodes={cluster_nodes!r}).start()"
+    process = subprocess.Popen([sys.executable, "-c", code], cwd=directory, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection((SERVER_HOST, port), timeout=1).close()
+            return process, directory
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                stop_server(process, directory)
+                raise RuntimeError("The benchmark server did not start")
+            time.sleep(0.05)
+
+def stop_server(process, directory):
+    process.terminate()
+    try:
+        process.wait(5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    shutil.rmtree(directory, ignore_errors=True)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind((SERVER_HOST, 0))
+        return s.getsockname()[1]
+
+def print_report(result, baseline=None):
+    config = result["config"]
+    print(f"====== {', '.join(f'{op}={weight:g}' for op, weight in config['mix'].items())} ======")
+    print(f"  {result['requests']} requests completed in {result['seconds']:.2f} seconds")
+    print(f"  {config['clients']} parallel clients in {config['processes']} process(es), pipeline {config['pipeline']}, "
+          f"{config['value_size']} byte values, {config['keyspace']} keys")
+    if result["errors"]:
+        print(f"  {result['errors']} errors")
+    print(f"  {result['ops_per_sec']:.2f} requests per second")
+    latency = result["latency"]
+    print(f"  latency (ms): mean {latency['mean_ms']:.3f}, "
+          + ", ".join(f"p{p:g} {latency[f'p{p:g}_ms'.replace('.', '')]:.3f}" for p in PERCENTILES)
+          + f", max {latency['max_ms']:.3f}")
+    print("  distribution:")
+    for bound, percent in result["histogram"]:
+        print(f"    {percent:7.3f}% <= {bound:g} ms")
+    print("  per operation (ms):")
+    for operation, summary in result["operations"].items():
+        print(f"    {operation:<13} {summary['count']:>9} ops  p50 {summary['p50_ms']:.3f}  "
+              f"p99 {summary['p99_ms']:.3f}  p99.9 {summary['p999_ms']:.3f}")
+    if baseline:
+        print("  compared to baseline:")
+        for label, old, new in (("requests per second", baseline["ops_per_sec"], result["ops_per_sec"]),
+                                ("p50 latency", baseline["latency"]["p50_ms"], latency["p50_ms"]),
+                                ("p99 latency", baseline["latency"]["p99_ms"], latency["p99_ms"]),
+                                ("p99.9 latency", baseline["latency"]["p999_ms"], latency["p999_ms"])):
+            change = (new - old) / old * 100 if old else 0.0
+            print(f"    {label:<20} {old:12.3f} -> {new:12.3f} ({change:+.1f}%)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure throughput and latency of the in-memory database.")
+    parser.add_argument("-c", "--clients", type=int, default=50, help="parallel connections (default: 50)")
+    parser.add_argument("-n", "--requests", type=int, default=100000, help="total requests (default: 100000)")
+    parser.add_argument("-P", "--pipeline", type=int, default=1, help="requests per round trip (default: 1)")
+    parser.add_argument("-d", "--value-size", type=int, default=64, help="value size in bytes (default: 64)")
+    parser.add_argument("-r", "--keyspace", type=int, default=10000, help="number of distinct keys (default: 10000)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--ttl", type=int, default=60, help="TTL in seconds for set_with_ttl (default: 60)")
+    parser.add_argument("--processes", type=int, default=1, help="processes to spread the clients over (default: 1)")
+    parser.add_argument("--no-populate", dest="populate", action="store_false",
+                        help="don't fill the keyspace before measuring")
+    parser.add_argument("--port", type=int, help="benchmark a running server instead of starting one")
+    parser.add_argument("--host", default=SERVER_HOST, help="host of the running server")
+    parser.add_argument("--mode", choices=("threaded", "eventloop"), default="threaded",
+                        help="server mode of the started server (default: threaded)")
+    parser.add_argument("--cluster", type=int, default=0, metavar="N",
+                        help="start a cluster of N nodes, or with --port route keys as for a cluster node")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the request stream")
+    parser.add_argument("--json", metavar="FILE", help="also write the results as JSON to FILE ('-' for stdout)")
+    parser.add_argument("--compare", metavar="FILE", help="print the change against an earlier --json result")
+    args = parser.parse_args(argv)
+    if (min(args.clients, args.requests, args.pipeline, args.keyspace, args.processes) < 1
+            or min(args.value_size, args.cluster) < 0):
+        parser.error("counts must be positive")
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    options = dict(vars(args), mix=mix, processes=min(args.processes, args.clients))
+    servers = []
+    if args.port is None:
+        ports = [free_port() for _ in range(max(args.cluster, 1))]
+        nodes = [f"{SERVER_HOST}:{port}" for port in ports] if args.cluster else None
+        options["port"] = ports[0]
+    else:
+        options["mode"] = None  # Unknown for an external server
+    try:
+        if args.port is None:
+            for port in ports:
+                servers.append(start_server(args.mode, port, nodes))
+        result = run_benchmark(options)
+    finally:
+        for process, directory in servers:
+            stop_server(process, directory)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    if args.json == '-':
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(result, baseline)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
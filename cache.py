@@ -3,9 +3,10 @@ from collections import OrderedDict
 from config import CACHE_CAPACITY
 
 class LRUCache:
-    def __init__(self, capacity=CACHE_CAPACITY):
+    def __init__(self, capacity=CACHE_CAPACITY, on_evict=None):
         self.cache = OrderedDict()
         self.capacity = capacity
+        self.on_evict = on_evict  # Called with (key, value) for entries pushed out by set()
 
     def get(self, key):
         if key not in self.cache:
@@ -19,4 +20,26 @@ class LRUCache:
             self.cache.move_to_end(key)
         self.cache[key] = value
         if len(self.cache) > self.capacity:
-            self.cache.popitem(last=False)
\ No newline at end of file
+            evicted = self.cache.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(*evicted)
+
+    def touch(self, key):
+        """Mark a key that is in the cache as the most recently used."""
+        self.cache.move_to_end(key)
+
+    def delete(self, key):
+        self.cache.pop(key, None)
+
+    def oldest(self):
+        """Return the least recently used key without touching it."""
+        return next(iter(self.cache), None)
+
+    def clear(self):
+        self.cache.clear()
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __contains__(self, key):
+        return key in self.cache
\ No newline at end of file
@@ -0,0 +1,165 @@
+#cdc.py
+import itertools
+import threading
+import time
+from config import CDC_BUFFER_SIZE, CDC_BATCH_SIZE
+from log import get_logger
+
+logger = get_logger('cdc')
+
+# Batch operations, whose value lists (key, ...) items, or plain keys for mdelete
+BATCH_OPERATIONS = ("mset", "mdelete", "mexpire")
+
+
+class ChangesLost(Exception):
+    """The changes at an offset were overwritten before they were read."""
+
+    def __init__(self, offset, oldest):
+        super().__init__(f"CHANGES_LOST changes before {oldest} are gone, requested {offset}")
+        self.offset = offset
+        self.oldest = oldest
+
+
+class ChangeLog:
+    """The database's recent changes, in a fixed-size ring of sequence-numbered events.
+
+    An event is (seq, timestamp, operation, key, detail), with the same
+    operation and key the observers are called with. Values are not kept,
+    so the ring never holds on to the data: a consumer that needs a value
+    reads the key's current one. A batch operation is one event whose
+    detail lists its keys, clear() is a single "clear" event whose detail
+    is the number of keys removed, and detail is None otherwise. Sequence
+    numbers start at 1 and increase by one per change. A change goes into
+    slot seq % size, so writers on different stripes never wait for each
+    other to fill their slots; a reader checks the slot's sequence number
+    to tell a change not written yet from one that was overwritten.
+    """
+
+    def __init__(self, size=CDC_BUFFER_SIZE):
+        self.size = size
+        self.ring = [None] * size
+        self.sequence = itertools.count(1)
+        self.last = 0  # Highest sequence number handed out, give or take a change in flight
+        self.last_lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.waiting = 0  # Readers blocked in wait()
+
+    def append(self, operation, key, value=None):
+        """Record one change, as given to the observers, and return its sequence number."""
+        if operation in BATCH_OPERATIONS:
+            detail = list(value) if operation == "mdelete" else [item[0] for item in value]
+        elif operation == "clear":
+            detail = value
+        else:
+            detail = None
+        seq = next(self.sequence)
+        self.ring[seq % self.size] = (seq, time.time(), operation, key, detail)
+        with self.last_lock:
+            # Appends on other stripes may finish out of order
+            if seq > self.last:
+                self.last = seq
+        if self.waiting:
+            with self.cond:
+                self.cond.notify_all()
+        return seq
+
+    def next_offset(self):
+        """The offset of the next change to be appended."""
+        return self.last + 1
+
+    def oldest(self):
+        """The offset of the oldest change still in the buffer."""
+        return max(1, self.last - self.size + 1)
+
+    def read(self, offset, limit=CDC_BATCH_SIZE):
+        """Return up to limit events from offset on, stopping at the first change not written yet.
+
+        Raises ChangesLost if the change at offset has been overwritten.
+        """
+        if offset < 1:
+            raise ValueError("Offsets start at 1")
+        events = []
+        ring = self.ring
+        size = self.size
+        for seq in range(offset, offset + limit):
+            event = ring[seq % size]
+            if event is None or event[0] < seq:
+                break
+            if event[0] > seq:
+                if events:
+                    break  # Return what was read; the next read reports the loss
+                raise ChangesLost(offset, self.oldest())
+            events.append(event)
+        return events
+
+    def wait(self, offset, timeout=None):
+        """Block until the change at offset is in the buffer or timeout passes; returns whether it is."""
+        def ready():
+            event = self.ring[offset % self.size]
+            return event is not None and event[0] >= offset
+
+        with self.cond:
+            self.waiting += 1
+            try:
+                return self.cond.wait_for(ready, timeout)
+            finally:
+                self.waiting -= 1
+
+    def stats(self):
+        return {"last_offset": self.last, "oldest_offset": self.oldest(), "buffer_size": self.size}
+
+
+class ChangeConsumer:
+    """Follows a ChangeLog on its own thread, passing each batch of events to handler.
+
+    Starts at offset, by default at the next change. If the consumer falls
+    so far behind that changes are overwritten, on_lost() is called and
+    reading resumes at the oldest change left; handlers that keep derived
+    state should rebuild or drop it there.
+    """
+
+    def __init__(self, changes, handler, on_lost=None, offset=None, batch_size=CDC_BATCH_SIZE, name='cdc'):
+        self.changes = changes
+        self.handler = handler
+        self.on_lost = on_lost
+        self.offset = changes.next_offset() if offset is None else offset
+        self.batch_size = batch_size
+        self.name = name
+        self.running = False
+        self.thread = None
+        self.lost = 0  # Times changes were overwritten before they were read
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        with self.changes.cond:
+            self.changes.cond.notify_all()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+
+    def run(self):
+        while self.running:
+            try:
+                events = self.changes.read(self.offset, self.batch_size)
+            except ChangesLost as e:
+                logger.warning("Consumer %s fell behind: %s", self.name, e)
+                self.lost += 1
+                self.offset = e.oldest
+                if self.on_lost:
+                    self.on_lost()
+                continue
+            if not events:
+                self.changes.wait(self.offset, timeout=0.5)
+                continue
+            try:
+                self.handler(events)
+            except Exception:
+                logger.exception("Consumer %s failed to handle changes", self.name)
+            self.offset = events[-1][0] + 1
+
+    def stats(self):
+        return {"offset": self.offset, "lag": max(0, self.changes.last - self.offset + 1), "lost": self.lost}
\ No newline at end of file
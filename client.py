@@ -1,33 +1,261 @@
 #client.py
+import asyncio
 import socket
 import json
+import itertools
+import queue
+import selectors
 import threading
 import time
-from config import SERVER_HOST, SERVER_PORT
+import uuid
+from collections import defaultdict, deque
+from config import (SERVER_HOST, SERVER_PORT, CLIENT_POOL_SIZE, CLIENT_TIMEOUT,
+                    CLIENT_CONNECT_RETRIES, CLIENT_RETRY_BACKOFF, CLIENT_HEALTH_CHECK_INTERVAL, CLIENT_CACHE_SIZE,
+                    ASYNC_CLIENT_CONNECTIONS)
+from protocol import FrameReader, encode_frame, decode_frame, RECV_SIZE
+from datatypes import COMMANDS, WRITE_COMMANDS
+from cache import LRUCache
+from tracking import invalidation_channel
+from log import get_logger
+import cluster
 
-class TCPClient:
-    def __init__(self, host=SERVER_HOST, port=SERVER_PORT):
+logger = get_logger('client')
+
+# Commands that change nothing on the server, so running them twice is harmless
+READ_ACTIONS = frozenset(["get", "mget", "type", "keys", "scan", "info", "changes",
+                          "list_channels", "list_patterns", "list_subscribers"]
+                         + [name for name in COMMANDS if name not in WRITE_COMMANDS])
+
+class Connection:
+    """One persistent socket to the server plus its frame buffer."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = FrameReader()
+        self.last_used = time.monotonic()
+        self.uses = 0
+        self.written = False  # Whether any part of the current request has reached the socket
+
+    def is_healthy(self):
+        """Check that the server has not closed the connection while it sat idle."""
+        try:
+            self.sock.setblocking(False)
+            try:
+                # An idle connection has nothing to read; EOF means the server hung up
+                return self.sock.recv(1, socket.MSG_PEEK) != b''
+            finally:
+                self.sock.setblocking(True)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionPool:
+    """Thread-safe pool of persistent connections to one server.
+
+    Up to max_size connections are opened on demand and reused LIFO, so a
+    burst of traffic is served by warm sockets. When all connections are busy,
+    callers queue and a released connection is handed to the longest waiting
+    one. Connections that sat idle longer than health_check_interval are
+    probed before being handed out, and connecting is retried with
+    exponential backoff.
+    """
+
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, max_size=CLIENT_POOL_SIZE,
+                 timeout=CLIENT_TIMEOUT, retries=CLIENT_CONNECT_RETRIES,
+                 backoff=CLIENT_RETRY_BACKOFF, health_check_interval=CLIENT_HEALTH_CHECK_INTERVAL):
         self.host = host
         self.port = port
-        self.subscribed = False
-        self.subscriber_thread = None
-        self.running = False
-        
-    def connect(self):
-        """Create a persistent connection to the server."""
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.connect((self.host, self.port))
-        self.running = True
-        return self.socket
-        
-    def disconnect(self):
-        """Close the connection to the server."""
-        self.running = False
-        if hasattr(self, 'socket'):
-            self.socket.close()
-            
-    def send_command(self, action, key=None, value=None, ttl=None, type=None, channel=None, message=None):
-        """Send a command to the server and get the response."""
+        self.max_size = max_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.health_check_interval = health_check_interval
+        self.idle = []
+        self.waiters = deque()  # [event, connection or NEW] per blocked caller
+        self.created = 0
+        self.lock = threading.Lock()
+
+    NEW = object()  # Handed to a waiter that may open a connection itself
+
+    def new_connection(self):
+        """Open a connection, retrying with exponential backoff."""
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                return Connection(sock)
+            except OSError:
+                if attempt == self.retries:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+    def acquire(self, timeout=None):
+        """Take a connection from the pool, opening one if there is room."""
+        conn = None
+        with self.lock:
+            if self.idle:
+                conn = self.idle.pop()
+            elif self.created < self.max_size:
+                self.created += 1
+                conn = self.NEW
+            else:
+                waiter = [threading.Event(), None]
+                self.waiters.append(waiter)
+        if conn is None:
+            waiter[0].wait(self.timeout if timeout is None else timeout)
+            with self.lock:
+                conn = waiter[1]
+                if conn is None:
+                    self.waiters.remove(waiter)
+                    raise TimeoutError("Timed out waiting for a pooled connection")
+
+        if conn is not self.NEW:
+            if time.monotonic() - conn.last_used < self.health_check_interval or conn.is_healthy():
+                return conn
+            conn.close()
+        try:
+            return self.new_connection()
+        except BaseException:
+            self._hand_off(self.NEW)
+            raise
+
+    def _hand_off(self, conn):
+        """Give conn to the longest waiting caller, or park it."""
+        with self.lock:
+            if self.waiters:
+                waiter = self.waiters.popleft()
+                waiter[1] = conn
+                waiter[0].set()
+            elif conn is self.NEW:
+                self.created -= 1
+            else:
+                self.idle.append(conn)
+
+    def release(self, conn):
+        """Return a healthy connection to the pool."""
+        conn.last_used = time.monotonic()
+        conn.uses += 1
+        self._hand_off(conn)
+
+    def discard(self, conn):
+        """Close a connection that is broken or in an unknown state."""
+        conn.close()
+        self._hand_off(self.NEW)
+
+    def close(self):
+        """Close every idle connection."""
+        with self.lock:
+            for conn in self.idle:
+                conn.close()
+            self.created -= len(self.idle)
+            self.idle = []
+
+
+class ClientCache:
+    """Values a client has read, kept until the server reports that they changed.
+
+    Reads that miss are sent with the cache's token, so the server tracks
+    the keys and publishes their invalidations on the token's channel. An
+    invalidation can overtake the reply to the read it concerns, so keys
+    being read are marked, and a reply for a key invalidated in the
+    meantime is not cached. Entries are (value, version, expires); values
+    filled in by mget have no version, and expires is the monotonic time
+    the key's TTL runs out, or None.
+    """
+
+    NO_VERSION = object()
+
+    def __init__(self, capacity=CLIENT_CACHE_SIZE):
+        self.entries = LRUCache(capacity)
+        self.token = uuid.uuid4().hex
+        self.channel = invalidation_channel(self.token)
+        self.lock = threading.Lock()
+        self.reading = defaultdict(int)  # key -> reads in flight
+        self.stale = set()  # Keys invalidated while being read
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def begin_read(self, keys, versioned=False):
+        """Look keys up; returns ({key: entry} for the hits, [keys] to fetch).
+
+        The keys to fetch are marked as being read until finish_read().
+        versioned only accepts entries that carry a version.
+        """
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self.lock:
+            for key in dict.fromkeys(keys):
+                entry = self.entries.get(key)
+                if (entry is None or entry[2] is not None and entry[2] <= now
+                        or versioned and entry[1] is self.NO_VERSION):
+                    self.reading[key] += 1
+                    missing.append(key)
+                else:
+                    found[key] = entry
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def finish_read(self, keys, entries=None):
+        """End the reads of keys, caching their entries unless they were invalidated meanwhile."""
+        with self.lock:
+            for i, key in enumerate(keys):
+                if entries is not None and key not in self.stale:
+                    self.entries.set(key, entries[i])
+                self.reading[key] -= 1
+                if not self.reading[key]:
+                    del self.reading[key]
+                    self.stale.discard(key)
+
+    def invalidate(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.delete(key)
+                if key in self.reading:
+                    self.stale.add(key)
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.stale.update(self.reading)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "capacity": self.entries.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+
+class Commands:
+    """The command methods shared by every client, built on send_command().
+
+    Each method builds its request and returns whatever the class's
+    send_command() returns: the response for TCPClient, an awaitable for
+    AsyncTCPClient and the pipeline itself for Pipeline.
+    """
+
+    def build_command(self, action, key=None, value=None, ttl=None, type=None, channel=None, message=None,
+                      **fields):
+        """Build the request dict for a command; extra fields are copied in as is."""
         command = {}
         
         if type == "pubsub":
@@ -45,100 +273,28 @@ class TCPClient:
                 command["value"] = value
             if ttl is not None:
                 command["ttl"] = ttl
-        
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((self.host, self.port))
-            s.sendall(json.dumps(command).encode('utf-8'))
-            data = s.recv(1024)
-            return json.loads(data.decode('utf-8'))
-            
-    def subscribe(self, channel, callback=None):
-        """Subscribe to a channel and listen for messages."""
-        if self.subscribed:
-            print("Already subscribed to a channel. Unsubscribe first.")
-            return False
-            
-        # Start a new thread to listen for messages
-        self.subscribed = True
-        self.subscriber_thread = threading.Thread(
-            target=self._subscriber_loop, 
-            args=(channel, callback),
-            daemon=True
-        )
-        self.subscriber_thread.start()
-        return True
-        
-    def _subscriber_loop(self, channel, callback):
-        """Background thread to listen for published messages."""
-        try:
-            # Create a dedicated socket for this subscription
-            sub_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sub_socket.connect((self.host, self.port))
-            
-            # Send subscribe command
-            command = {
-                "type": "pubsub",
-                "action": "subscribe",
-                "channel": channel
-            }
-            sub_socket.sendall(json.dumps(command).encode('utf-8'))
-            
-            # Receive subscription confirmation
-            data = sub_socket.recv(1024)
-            response = json.loads(data.decode('utf-8'))
-            print(f"Subscription response: {response}")
-            
-            # Listen for messages
-            sub_socket.settimeout(1.0)  # Use timeout for checking running flag
-            while self.subscribed and self.running:
-                try:
-                    data = sub_socket.recv(1024)
-                    if not data:
-                        break
-                        
-                    message = json.loads(data.decode('utf-8'))
-                    print(f"Received from {channel}: {message}")
-                    
-                    if callback:
-                        callback(message)
-                except socket.timeout:
-                    continue
-                except json.JSONDecodeError:
-                    print("Received invalid JSON data")
-                except Exception as e:
-                    print(f"Error in subscriber loop: {e}")
-                    break
-                    
-        except Exception as e:
-            print(f"Subscription error: {e}")
-        finally:
-            self.subscribed = False
-            try:
-                sub_socket.close()
-            except:
-                pass
-                
-    def unsubscribe(self):
-        """Stop listening for messages."""
-        self.subscribed = False
-        if self.subscriber_thread:
-            self.subscriber_thread.join(timeout=1.0)
-            self.subscriber_thread = None
-        return True
-        
-    def publish(self, channel, message):
+        command.update(fields)
+        return command
+
+    # PubSub
+    def publish(self, channel, message, timeout=None):
         """Publish a message to a channel."""
         return self.send_command(
             action="publish", 
             type="pubsub", 
             channel=channel, 
-            message=message
+            message=message,
+            timeout=timeout
         )
-        
+
     def list_channels(self):
         """List all active channels."""
         return self.send_command(action="list_channels", type="pubsub")
-        
+
+    def list_patterns(self):
+        """List all subscribed patterns."""
+        return self.send_command(action="list_patterns", type="pubsub")
+
     def list_subscribers(self, channel):
         """List number of subscribers for a channel."""
         return self.send_command(
@@ -146,27 +302,1283 @@ class TCPClient:
             type="pubsub", 
             channel=channel
         )
-        
+
     # Database operations
-    def get(self, key):
+    def get(self, key, timeout=None):
         """Get a value from the database."""
-        return self.send_command("get", key)
-        
-    def set(self, key, value):
+        return self.send_command("get", key, timeout=timeout)
+
+    def set(self, key, value, timeout=None):
         """Set a value in the database."""
-        return self.send_command("set", key, value)
-        
-    def set_with_ttl(self, key, value, ttl):
+        return self.send_command("set", key, value, timeout=timeout)
+
+    def set_with_ttl(self, key, value, ttl, timeout=None):
         """Set a value with TTL in the database."""
-        return self.send_command("set_with_ttl", key, value, ttl)
-        
-    def delete(self, key):
+        return self.send_command("set_with_ttl", key, value, ttl, timeout=timeout)
+
+    def delete(self, key, timeout=None):
         """Delete a key from the database."""
-        return self.send_command("delete", key)
-        
-    def keys(self):
+        return self.send_command("delete", key, timeout=timeout)
+
+    def incr(self, key, amount=1, timeout=None):
+        """Atomically add amount to the number at key; the result is the new value."""
+        return self.send_command("incr", key, amount=amount, timeout=timeout)
+
+    def decr(self, key, amount=1, timeout=None):
+        """Atomically subtract amount from the number at key; the result is the new value."""
+        return self.send_command("decr", key, amount=amount, timeout=timeout)
+
+    def append(self, key, value, timeout=None):
+        """Atomically append a string to the value at key; the result is the new length."""
+        return self.send_command("append", key, value, timeout=timeout)
+
+    def getset(self, key, value, timeout=None):
+        """Atomically set key and return its old value."""
+        return self.send_command("getset", key, value, timeout=timeout)
+
+    def setnx(self, key, value, ttl=None, timeout=None):
+        """Set key only if it does not exist; the result tells whether it was set."""
+        return self.send_command("setnx", key, value, ttl, timeout=timeout)
+
+    def cas(self, key, version, value, ttl=None, timeout=None):
+        """Set key only if its version still matches the one returned by get (0: key must not exist).
+
+        The result tells whether the value was set; "version" is the new
+        version on success and the current one on a conflict.
+        """
+        return self.send_command("cas", key, value, ttl, version=version, timeout=timeout)
+
+    def mget(self, keys, timeout=None):
+        """Get several values in one request; the result lists them in the order of keys."""
+        return self.send_command("mget", keys=list(keys), timeout=timeout)
+
+    def mset(self, items, ttl=None, timeout=None):
+        """Set several keys atomically in one request.
+
+        items is a dict or an iterable of (key, value) pairs. With ttl every
+        key expires after ttl seconds.
+        """
+        pairs = items.items() if isinstance(items, dict) else items
+        return self.send_command("mset", ttl=ttl, items=[[key, value] for key, value in pairs], timeout=timeout)
+
+    def mdelete(self, keys, timeout=None):
+        """Delete several keys atomically; the result tells for each key whether it existed."""
+        return self.send_command("mdelete", keys=list(keys), timeout=timeout)
+
+    def unlink(self, keys, timeout=None):
+        """Like mdelete, but large values are always freed in the background."""
+        return self.send_command("unlink", keys=list(keys), timeout=timeout)
+
+    def flushall(self, asynchronous=None, timeout=None):
+        """Delete every key; with asynchronous the old keyspace is freed in the background."""
+        fields = {} if asynchronous is None else {"async": asynchronous}
+        return self.send_command("flushall", timeout=timeout, **fields)
+
+    def mexpire(self, keys, ttl, timeout=None):
+        """Set a TTL on several existing keys; the result tells for each key whether it existed."""
+        return self.send_command("mexpire", ttl=ttl, keys=list(keys), timeout=timeout)
+
+    def type(self, key, timeout=None):
+        """Get the type of a key's value ('string', 'hash', 'list', 'set', 'zset' or 'none') and its encoding."""
+        return self.send_command("type", key, timeout=timeout)
+
+    def _command(self, action, key, *args, timeout=None):
+        """Send a data type command; args are passed through in order."""
+        return self.send_command(action, key, args=list(args), timeout=timeout)
+
+    # Hashes
+    def hset(self, key, mapping, timeout=None):
+        """Set the fields of a hash from a dict; the result is the number of new fields."""
+        args = [item for pair in mapping.items() for item in pair]
+        return self._command("hset", key, *args, timeout=timeout)
+
+    def hget(self, key, field, timeout=None):
+        return self._command("hget", key, field, timeout=timeout)
+
+    def hmget(self, key, fields, timeout=None):
+        return self._command("hmget", key, *fields, timeout=timeout)
+
+    def hdel(self, key, *fields, timeout=None):
+        return self._command("hdel", key, *fields, timeout=timeout)
+
+    def hgetall(self, key, timeout=None):
+        return self._command("hgetall", key, timeout=timeout)
+
+    def hkeys(self, key, timeout=None):
+        return self._command("hkeys", key, timeout=timeout)
+
+    def hvals(self, key, timeout=None):
+        return self._command("hvals", key, timeout=timeout)
+
+    def hlen(self, key, timeout=None):
+        return self._command("hlen", key, timeout=timeout)
+
+    def hexists(self, key, field, timeout=None):
+        return self._command("hexists", key, field, timeout=timeout)
+
+    # Lists
+    def lpush(self, key, *values, timeout=None):
+        return self._command("lpush", key, *values, timeout=timeout)
+
+    def rpush(self, key, *values, timeout=None):
+        return self._command("rpush", key, *values, timeout=timeout)
+
+    def lpop(self, key, count=None, timeout=None):
+        """Pop the first element, or a list of the first count elements."""
+        return self._command("lpop", key, *([] if count is None else [count]), timeout=timeout)
+
+    def rpop(self, key, count=None, timeout=None):
+        """Pop the last element, or a list of the last count elements."""
+        return self._command("rpop", key, *([] if count is None else [count]), timeout=timeout)
+
+    def lrange(self, key, start=0, stop=-1, timeout=None):
+        """Get the elements from start to stop inclusive; negative indexes count from the end."""
+        return self._command("lrange", key, start, stop, timeout=timeout)
+
+    def lindex(self, key, index, timeout=None):
+        return self._command("lindex", key, index, timeout=timeout)
+
+    def lset(self, key, index, value, timeout=None):
+        return self._command("lset", key, index, value, timeout=timeout)
+
+    def ltrim(self, key, start, stop, timeout=None):
+        return self._command("ltrim", key, start, stop, timeout=timeout)
+
+    def llen(self, key, timeout=None):
+        return self._command("llen", key, timeout=timeout)
+
+    # Sets
+    def sadd(self, key, *members, timeout=None):
+        return self._command("sadd", key, *members, timeout=timeout)
+
+    def srem(self, key, *members, timeout=None):
+        return self._command("srem", key, *members, timeout=timeout)
+
+    def smembers(self, key, timeout=None):
+        return self._command("smembers", key, timeout=timeout)
+
+    def sismember(self, key, member, timeout=None):
+        return self._command("sismember", key, member, timeout=timeout)
+
+    def scard(self, key, timeout=None):
+        return self._command("scard", key, timeout=timeout)
+
+    # Sorted sets
+    def zadd(self, key, mapping, timeout=None):
+        """Add members with their scores from a {member: score} dict; the result is the number of new members."""
+        args = [item for member, score in mapping.items() for item in (score, member)]
+        return self._command("zadd", key, *args, timeout=timeout)
+
+    def zincrby(self, key, amount, member, timeout=None):
+        return self._command("zincrby", key, amount, member, timeout=timeout)
+
+    def zrem(self, key, *members, timeout=None):
+        return self._command("zrem", key, *members, timeout=timeout)
+
+    def zscore(self, key, member, timeout=None):
+        return self._command("zscore", key, member, timeout=timeout)
+
+    def zrank(self, key, member, timeout=None):
+        return self._command("zrank", key, member, timeout=timeout)
+
+    def zrange(self, key, start=0, stop=-1, withscores=False, timeout=None):
+        """Get members by rank; with withscores each item is [member, score]."""
+        return self._command("zrange", key, start, stop, withscores, timeout=timeout)
+
+    def zrangebyscore(self, key, min_score, max_score, withscores=False, timeout=None):
+        """Get members with min_score <= score <= max_score; '-inf' and '+inf' are accepted."""
+        return self._command("zrangebyscore", key, min_score, max_score, withscores, timeout=timeout)
+
+    def zcount(self, key, min_score, max_score, timeout=None):
+        return self._command("zcount", key, min_score, max_score, timeout=timeout)
+
+    def zcard(self, key, timeout=None):
+        return self._command("zcard", key, timeout=timeout)
+
+    def keys(self, timeout=None):
         """Get all keys in the database."""
-        return self.send_command("keys")
+        return self.send_command("keys", timeout=timeout)
+
+    def scan(self, cursor=0, match=None, count=None, timeout=None):
+        """Run one SCAN step; the response holds the keys and the next cursor."""
+        fields = {"cursor": cursor}
+        if match is not None:
+            fields["match"] = match
+        if count is not None:
+            fields["count"] = count
+        return self.send_command("scan", timeout=timeout, **fields)
+
+    def info(self, section=None, timeout=None):
+        """Get server statistics, optionally only one section such as "stats" or "commandstats"."""
+        if section is None:
+            return self.send_command("info", timeout=timeout)
+        return self.send_command("info", timeout=timeout, section=section)
+
+    def replicaof(self, host=None, port=None, timeout=None):
+        """Make the server replicate from host:port, or with no host stop replicating."""
+        if host is None:
+            return self.send_command("replicaof", timeout=timeout)
+        return self.send_command("replicaof", timeout=timeout, host=host, port=port)
+
+    def slowlog(self, subcommand="get", count=None, timeout=None):
+        """Run a slowlog subcommand: "get" the newest count entries, "len" or "reset"."""
+        fields = {"subcommand": subcommand}
+        if count is not None:
+            fields["count"] = count
+        return self.send_command("slowlog", timeout=timeout, **fields)
+
+    def changes(self, offset=None, count=100, timeout=None):
+        """Read up to count [seq, timestamp, operation, key, detail] changes from offset on.
+
+        detail lists the keys of a batch operation and is the number of keys
+        removed for "clear". Values are not included. Without offset, starts at the next change. The response's next_offset
+        is where to resume; an error with oldest_offset means changes were
+        missed.
+        """
+        fields = {"count": count}
+        if offset is not None:
+            fields["offset"] = offset
+        return self.send_command("changes", timeout=timeout, **fields)
+
+
+class TCPClient(Commands):
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, pool_size=CLIENT_POOL_SIZE, timeout=CLIENT_TIMEOUT,
+                 cache_size=CLIENT_CACHE_SIZE):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pool = ConnectionPool(host, port, max_size=pool_size, timeout=timeout)
+        self.subscribed = False
+        self.subscriber_socket = None  # Dedicated connection for subscriptions
+        self.subscriber_thread = None
+        self.subscriber_lock = threading.Lock()
+        self.subscriber_acks = None
+        self.channel_callbacks = {}  # channel -> callback
+        self.pattern_callbacks = {}  # pattern -> callback
+        self.running = False
+        self.request_ids = itertools.count(1)
+        self.cache = None  # ClientCache while client-side caching is on
+        if cache_size:
+            self.enable_cache(cache_size)
+
+    def connect(self):
+        """Create a persistent connection to the server."""
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.connect((self.host, self.port))
+        self.running = True
+        return self.socket
+
+    def disconnect(self):
+        """Close the connection to the server."""
+        self.running = False
+        self.cache = None
+        self.unsubscribe()
+        if hasattr(self, 'socket'):
+            self.socket.close()
+        self.pool.close()
+
+    def send_command(self, action, key=None, value=None, ttl=None, type=None, channel=None, message=None,
+                     timeout=None, **fields):
+        """Send a command to the server and get the response."""
+        command = self.build_command(action, key, value, ttl, type, channel, message, **fields)
+        return self.send_commands([command], timeout)[0]
+
+    def send_commands(self, commands, timeout=None):
+        """Send several commands back to back and return their responses in order.
+
+        Commands go over a pooled connection. If a reused connection turns out
+        to have been closed by the server, the commands are retried once on a
+        fresh one, but only if none of the request was written yet or every
+        command is a read: the server may already have run the others.
+        timeout (seconds) bounds the whole exchange and defaults to the
+        client's timeout.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if self.cache is not None:
+            # Our own writes drop the local copies at once, without waiting for the server
+            for command in commands:
+                if command.get("action") not in ("get", "mget"):
+                    self.cache.invalidate(self.written_keys(command))
+        for attempt in range(2):
+            conn = self.pool.acquire(timeout)
+            reused = conn.uses > 0
+            try:
+                responses = self._exchange(conn, commands, timeout)
+            except (ConnectionError, OSError) as e:
+                # The connection's state is unknown after a failure or timeout
+                self.pool.discard(conn)
+                if isinstance(e, TimeoutError) or not reused or attempt:
+                    raise
+                if conn.written and not all(command.get("action") in READ_ACTIONS for command in commands):
+                    raise
+                # The server probably restarted, so the other idle connections are stale too
+                self.pool.close()
+                continue
+            except BaseException:
+                self.pool.discard(conn)
+                raise
+            self.pool.release(conn)
+            return responses
+
+    def _exchange(self, conn, commands, timeout):
+        """Pipeline commands over conn and collect one response per command.
+
+        Requests are written while responses are read, so a long pipeline
+        never deadlocks on full socket buffers. Each request carries an id
+        that the server echoes back, which is checked against the order.
+        """
+        ids = []
+        for command in commands:
+            command["id"] = next(self.request_ids)
+            ids.append(command["id"])
+        payload = memoryview(b''.join(encode_frame(command) for command in commands))
+        sock = conn.sock
+        reader = conn.reader
+        deadline = time.monotonic() + timeout
+        conn.written = False
+
+        if len(commands) == 1:
+            sock.settimeout(timeout)
+            # If sendall() fails the frame is incomplete, and the server never runs it
+            sock.sendall(payload)
+            conn.written = True
+            frame = reader.read_frame(sock)
+            if frame is None:
+                raise ConnectionError("Connection closed by server")
+            responses = [decode_frame(frame)]
+        else:
+            responses = []
+            sock.setblocking(False)
+            try:
+                with selectors.DefaultSelector() as selector:
+                    selector.register(sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+                    while len(responses) < len(commands):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise TimeoutError("Timed out waiting for responses")
+                        for _, events in selector.select(remaining):
+                            if events & selectors.EVENT_WRITE and payload:
+                                sent = sock.send(payload[:RECV_SIZE])
+                                payload = payload[sent:]
+                                conn.written = True
+                                if not payload:
+                                    selector.modify(sock, selectors.EVENT_READ)
+                            if events & selectors.EVENT_READ:
+                                data = sock.recv(RECV_SIZE)
+                                if not data:
+                                    raise ConnectionError("Connection closed by server")
+                                reader.feed(data)
+                                responses.extend(decode_frame(frame) for frame in reader.frames())
+            finally:
+                sock.settimeout(timeout)
+
+        for request_id, response in zip(ids, responses):
+            if response.pop("id", request_id) != request_id:
+                raise ConnectionError("Response does not match its request")
+        return responses
+
+    @staticmethod
+    def written_keys(command):
+        keys = [command["key"]] if "key" in command else []
+        if isinstance(command.get("keys"), list):
+            keys.extend(command["keys"])
+        if isinstance(command.get("items"), list):
+            keys.extend(item[0] for item in command["items"] if isinstance(item, list) and item)
+        return keys
+
+    def pipeline(self):
+        """Return a Pipeline that queues commands and sends them in one go."""
+        return Pipeline(self)
+
+    def subscribe(self, channel, callback=None, timeout=None):
+        """Subscribe to a channel and pass its messages to callback.
+
+        All channel and pattern subscriptions share one dedicated connection,
+        read by a background thread. Returns True once the server has
+        confirmed the subscription.
+        """
+        return self._subscribe("subscribe", channel, callback, self.channel_callbacks, timeout)
+
+    def psubscribe(self, pattern, callback=None, timeout=None):
+        """Subscribe to every channel matching a glob pattern such as 'orders.*'.
+
+        Messages passed to callback carry the matched pattern in "pattern".
+        """
+        return self._subscribe("psubscribe", pattern, callback, self.pattern_callbacks, timeout)
+
+    def _subscribe(self, action, name, callback, callbacks, timeout):
+        field = "pattern" if action == "psubscribe" else "channel"
+        with self.subscriber_lock:
+            try:
+                if self.subscriber_socket is None:
+                    self._open_subscriber()
+                callbacks[name] = callback
+                response = self._subscriber_request({"type": "pubsub", "action": action, field: name}, timeout)
+            except Exception as e:
+                logger.warning("Subscription to %s failed: %s", name, e)
+                callbacks.pop(name, None)
+                return False
+            logger.debug("Subscription response: %s", response)
+            return response.get("result") == "OK"
+
+    def _open_subscriber(self):
+        """Connect the subscriber connection and start its reader thread."""
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.settimeout(1.0)  # Use timeout for checking the subscribed flag
+        self.subscriber_socket = sock
+        self.subscriber_acks = queue.Queue()
+        self.subscribed = True
+        self.subscriber_thread = threading.Thread(target=self._subscriber_loop, args=(sock,), daemon=True)
+        self.subscriber_thread.start()
+
+    def _subscriber_request(self, command, timeout=None):
+        """Send a (un)subscribe command on the subscriber connection and wait for its confirmation."""
+        self.subscriber_socket.sendall(encode_frame(command))
+        try:
+            return self.subscriber_acks.get(timeout=self.timeout if timeout is None else timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No confirmation for {command['action']}") from None
+
+    def _subscriber_loop(self, sub_socket):
+        """Background thread to listen for published messages."""
+        reader = FrameReader()
+        try:
+            while self.subscribed:
+                try:
+                    data = reader.read_frame(sub_socket)
+                    if data is None:
+                        break
+
+                    message = decode_frame(data)
+                    if "action" in message or "error" in message:
+                        # Confirmation of a (un)subscribe request
+                        self.subscriber_acks.put(message)
+                        continue
+                    channel = message.get("channel")
+                    cache = self.cache
+                    if cache is not None and channel == cache.channel:
+                        keys = message["message"]["keys"]
+                        if keys is None:
+                            cache.clear()  # Everything was invalidated, as after a flush
+                        else:
+                            cache.invalidate(keys)
+                        continue
+                    logger.debug("Received from %s: %s", channel, message)
+                    if "pattern" in message:
+                        callback = self.pattern_callbacks.get(message["pattern"])
+                    else:
+                        callback = self.channel_callbacks.get(channel)
+                    if callback:
+                        callback(message)
+                except socket.timeout:
+                    continue
+                except json.JSONDecodeError:
+                    logger.warning("Received invalid JSON data on the subscriber connection")
+                except Exception as e:
+                    if self.subscribed:
+                        logger.error("Error in subscriber loop: %s", e)
+                    break
+        finally:
+            self.subscribed = False
+            if self.cache is not None:
+                # Invalidations sent from now on would be missed
+                self.cache.clear()
+
+    def unsubscribe(self, channel=None, timeout=None):
+        """Unsubscribe from a channel, or stop listening altogether if channel is None."""
+        return self._unsubscribe("unsubscribe", channel, self.channel_callbacks, timeout)
+
+    def punsubscribe(self, pattern=None, timeout=None):
+        """Unsubscribe from a pattern, or from every pattern if pattern is None."""
+        return self._unsubscribe("punsubscribe", pattern, self.pattern_callbacks, timeout)
+
+    def _unsubscribe(self, action, name, callbacks, timeout):
+        with self.subscriber_lock:
+            if self.subscriber_socket is None:
+                return True
+            if name is None and action == "unsubscribe":
+                self._close_subscriber()
+                return True
+            field = "pattern" if action == "punsubscribe" else "channel"
+            names = list(callbacks) if name is None else [name]
+            try:
+                for name in names:
+                    self._subscriber_request({"type": "pubsub", "action": action, field: name}, timeout)
+                    callbacks.pop(name, None)
+            except Exception as e:
+                logger.warning("Unsubscribe from %s failed: %s", name, e)
+                return False
+            if not self.channel_callbacks and not self.pattern_callbacks:
+                self._close_subscriber()
+            return True
+
+    def _close_subscriber(self):
+        """Close the subscriber connection and forget all subscriptions."""
+        self.subscribed = False
+        try:
+            self.subscriber_socket.close()
+        except OSError:
+            pass
+        if self.subscriber_thread and self.subscriber_thread is not threading.current_thread():
+            self.subscriber_thread.join(timeout=1.0)
+        self.subscriber_socket = None
+        self.subscriber_thread = None
+        self.channel_callbacks.clear()
+        self.pattern_callbacks.clear()
+
+    # Client-side caching
+    def enable_cache(self, size=CLIENT_CACHE_SIZE):
+        """Keep up to size values read by get and mget locally, evicting the least recently used.
+
+        The server pushes an invalidation on the subscriber connection when
+        a cached key changes, is deleted, expires or is evicted. If that
+        connection is lost the cache is emptied and reads go to the server
+        until enable_cache() is called again.
+        """
+        if size <= 0:
+            raise ValueError("Cache size must be positive")
+        self.disable_cache()
+        with self.subscriber_lock:
+            if not self.subscribed and self.subscriber_socket is not None:
+                self._close_subscriber()  # The old subscriber connection is gone
+        cache = ClientCache(size)
+        self.cache = cache
+        if not self.subscribe(cache.channel):
+            self.cache = None
+            raise ConnectionError("Could not subscribe to cache invalidations")
+
+    def disable_cache(self):
+        """Stop caching and drop the cached values."""
+        cache, self.cache = self.cache, None
+        if cache is not None:
+            self.unsubscribe(cache.channel)
+
+    def cache_stats(self):
+        """Hit and miss counts of the local cache, or None if caching is off."""
+        return self.cache.stats() if self.cache is not None else None
+
+    def _caching(self):
+        return self.cache if self.cache is not None and self.subscribed else None
+
+    def get(self, key, timeout=None):
+        """Get a value from the database."""
+        cache = self._caching()
+        if cache is None:
+            return super().get(key, timeout)
+        found, missing = cache.begin_read([key], versioned=True)
+        if found:
+            value, version, expires = found[key]
+            ttl_remaining = None if expires is None else max(0, int(expires - time.monotonic()))
+            return {"result": value, "ttl_remaining": ttl_remaining, "version": version}
+        entries = None
+        try:
+            response = self.send_command("get", key, track=cache.token, timeout=timeout)
+            if "error" not in response:
+                ttl_remaining = response.get("ttl_remaining")
+                expires = None if ttl_remaining is None else time.monotonic() + ttl_remaining
+                entries = [(response.get("result"), response.get("version"), expires)]
+        finally:
+            cache.finish_read(missing, entries)
+        return response
+
+    def mget(self, keys, timeout=None):
+        """Get several values in one request; the result lists them in the order of keys."""
+        cache = self._caching()
+        if cache is None:
+            return super().mget(keys, timeout)
+        keys = list(keys)
+        found, missing = cache.begin_read(keys)
+        if missing:
+            entries = None
+            try:
+                response = self.send_command("mget", keys=missing, track=cache.token, timeout=timeout)
+                if "error" in response:
+                    return response
+                entries = [(value, cache.NO_VERSION, None) for value in response["result"]]
+            finally:
+                cache.finish_read(missing, entries)
+            found.update(zip(missing, entries))
+        return {"result": [found[key][0] for key in keys]}
+
+    def scan_iter(self, match=None, count=100, timeout=None):
+        """Yield every key matching the glob pattern, one SCAN step at a time.
+
+        Keys may be yielded more than once if they move while the scan runs.
+        """
+        cursor = 0
+        while True:
+            response = self.scan(cursor, match, count, timeout)
+            if "error" in response:
+                raise RuntimeError(response["error"])
+            yield from response["result"]
+            cursor = response["cursor"]
+            if cursor == 0:
+                return
+
+class Pipeline(Commands):
+    """Collects commands and sends them back to back on a single connection.
+
+    Every command method is available; instead of sending, it queues the
+    command. execute() returns the responses in the order queued.
+
+        pipe = client.pipeline()
+        pipe.set("a", 1)
+        pipe.get("a")
+        results = pipe.execute()
+    """
+
+    def __init__(self, client):
+        # Commands are sent through the parent client's pool; queued reads always go to the server
+        self.client = client
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.commands = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def send_command(self, action, key=None, value=None, ttl=None, type=None, channel=None, message=None,
+                     timeout=None, **fields):
+        """Queue a command instead of sending it."""
+        self.commands.append(self.build_command(action, key, value, ttl, type, channel, message, **fields))
+        return self
+
+    def execute(self, timeout=None):
+        """Send all queued commands and return their responses."""
+        commands, self.commands = self.commands, []
+        if not commands:
+            return []
+        return self.client.send_commands(commands, timeout)
+
+class ClusterClient(TCPClient):
+    """Client for a cluster of servers that sends each command straight to the node owning its keys.
+
+    The slot map is fetched from the node at host:port and cached. A MOVED
+    reply refreshes it and the command is retried on the right node; an ASK
+    reply, during a slot migration, retries on the named node once. Commands
+    on several keys are split by node and their results merged. Commands
+    without keys, and PubSub, go to the node at host:port.
+    """
+
+    MAX_REDIRECTS = 5
+    MIGRATE_CHUNK = 1024  # Slots handed over per migrate request
+    MULTI_KEY_ACTIONS = ("mget", "mset", "mdelete", "unlink", "mexpire")
+
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, pool_size=CLIENT_POOL_SIZE, timeout=CLIENT_TIMEOUT):
+        super().__init__(host, port, pool_size, timeout, cache_size=0)
+        self.pool_size = pool_size
+        self.seed = f"{host}:{port}"
+        self.nodes = {}  # "host:port" -> TCPClient
+        self.nodes_lock = threading.Lock()
+        self.slots = []  # slot -> "host:port" of its owner
+        self.refresh_slots()
+
+    def node(self, address):
+        """The client for one node, connected on first use."""
+        with self.nodes_lock:
+            client = self.nodes.get(address)
+            if client is None:
+                host, _, port = address.rpartition(':')
+                client = self.nodes[address] = TCPClient(host, int(port), self.pool_size, self.timeout, cache_size=0)
+            return client
+
+    def enable_cache(self, size=CLIENT_CACHE_SIZE):
+        # Invalidations would have to be collected from every node
+        raise NotImplementedError("Client-side caching is not supported in cluster mode")
+
+    def refresh_slots(self, address=None):
+        """Fetch the slot map from a node, by default the one the client was created for."""
+        response = self.node(address or self.seed).send_command("cluster", subcommand="slots")
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        slots = [None] * cluster.SLOTS
+        for start, end, owner in response["result"]:
+            slots[start:end + 1] = [owner] * (end - start + 1)
+        self.slots = slots
+
+    def command_keys(self, command):
+        """The keys a command works on, or None if it has none."""
+        if command.get("type") == "pubsub" or command.get("action") == "cluster":
+            return None
+        if command.get("action") == "mset":
+            items = command.get("items")
+            return list(items) if isinstance(items, dict) else [item[0] for item in items or []]
+        if isinstance(command.get("keys"), list):
+            return command["keys"]
+        if "key" in command:
+            return [command["key"]]
+        return None
+
+    def split(self, command):
+        """Divide a command into (node, command, positions) parts, one per node its keys live on.
+
+        positions lists the indexes of the part's keys in the original
+        command, or is None if the command was not divided.
+        """
+        keys = self.command_keys(command)
+        if not keys:
+            return [(self.seed, command, None)]
+        owners = [self.slots[cluster.key_slot(key)] or self.seed for key in keys]
+        if command.get("action") not in self.MULTI_KEY_ACTIONS or len(set(owners)) == 1:
+            return [(owners[0], command, None)]
+        groups = defaultdict(list)
+        for position, owner in enumerate(owners):
+            groups[owner].append(position)
+        items = command.get("items")
+        if isinstance(items, dict):
+            items = list(items.items())
+        parts = []
+        for owner, positions in groups.items():
+            part = {field: value for field, value in command.items() if field != "id"}
+            if command["action"] == "mset":
+                part["items"] = [list(items[position]) for position in positions]
+            else:
+                part["keys"] = [keys[position] for position in positions]
+            parts.append((owner, part, positions))
+        return parts
+
+    def send_commands(self, commands, timeout=None):
+        """Send commands to the nodes owning their keys, pipelined per node, and return the responses in order."""
+        timeout = self.timeout if timeout is None else timeout
+        plans = [self.split(command) for command in commands]
+        batches = defaultdict(list)  # node -> [(command index, part index)]
+        for i, parts in enumerate(plans):
+            for j, (owner, _, _) in enumerate(parts):
+                batches[owner].append((i, j))
+        results = [[None] * len(parts) for parts in plans]
+        for owner, members in batches.items():
+            responses = self.node(owner).send_commands([plans[i][j][1] for i, j in members], timeout)
+            for (i, j), response in zip(members, responses):
+                results[i][j] = response
+        for i, parts in enumerate(plans):
+            for j, (_, part, _) in enumerate(parts):
+                if self.is_redirect(results[i][j]):
+                    results[i][j] = self.follow(part, results[i][j], timeout)
+        return [self.merge(command, parts, responses) for command, parts, responses in zip(commands, plans, results)]
+
+    @staticmethod
+    def is_redirect(response):
+        error = response.get("error")
+        return isinstance(error, str) and error.split(" ", 1)[0] in ("MOVED", "ASK", "TRYAGAIN")
+
+    def follow(self, command, response, timeout):
+        """Retry a command that was answered with a redirect until a node runs it."""
+        for attempt in range(self.MAX_REDIRECTS):
+            if not self.is_redirect(response):
+                return response
+            kind, *args = response["error"].split()
+            if kind == "ASK":
+                response = self.node(args[1]).send_commands([dict(command, asking=True)], timeout)[0]
+                continue
+            if kind == "MOVED":
+                # A slot moved, so others probably did as well
+                self.refresh_slots(args[1])
+            else:
+                time.sleep(0.01 * (attempt + 1))
+            # Retried here rather than through send_commands(), so every redirect counts against the limit
+            owner = self.split(command)[0][0]
+            response = self.node(owner).send_commands([command], timeout)[0]
+        return response
+
+    def merge(self, command, parts, responses):
+        """Combine the responses to the parts of a divided command."""
+        if len(parts) == 1:
+            return responses[0]
+        for response in responses:
+            if "error" in response:
+                return response
+        if command["action"] == "mset":
+            merged = dict(responses[0], count=sum(response.get("count", 0) for response in responses))
+            return merged
+        result = [None] * sum(len(positions) for _, _, positions in parts)
+        for (_, _, positions), response in zip(parts, responses):
+            for position, value in zip(positions, response["result"]):
+                result[position] = value
+        merged = dict(responses[0], result=result)
+        if command["action"] in ("mdelete", "unlink"):
+            merged["deleted"] = sum(result)
+        return merged
+
+    def keys(self, timeout=None):
+        """Get all keys in the cluster."""
+        result = []
+        for address in sorted(set(self.slots) - {None}):
+            response = self.node(address).send_command("keys", timeout=timeout)
+            if "error" in response:
+                return response
+            result.extend(response["result"])
+        return {"result": result}
+
+    def migrate_slots(self, slots, target, timeout=None):
+        """Move hash slots and their keys to the node at target ("host:port") while traffic continues.
+
+        Returns the number of keys moved.
+        """
+        timeout = max(self.timeout, 60) if timeout is None else timeout
+        self.refresh_slots()
+        by_source = defaultdict(list)
+        for slot in slots:
+            if self.slots[slot] != target:
+                by_source[self.slots[slot]].append(slot)
+        nodes = set(self.slots) - {None} | {target}
+        moved = 0
+        for source, source_slots in by_source.items():
+            for i in range(0, len(source_slots), self.MIGRATE_CHUNK):
+                chunk = source_slots[i:i + self.MIGRATE_CHUNK]
+                self.cluster_command(target, timeout, subcommand="setslot", slots=chunk, state="importing", node=source)
+                self.cluster_command(source, timeout, subcommand="setslot", slots=chunk, state="migrating", node=target)
+                # The source moves the keys and hands the slots to the target
+                moved += self.cluster_command(source, timeout, subcommand="migrate", slots=chunk)["moved"]
+                for node in nodes - {source, target}:
+                    self.cluster_command(node, timeout, subcommand="setslot", slots=chunk, state="node", node=target)
+                for slot in chunk:
+                    self.slots[slot] = target
+        return moved
+
+    def cluster_command(self, address, timeout, **fields):
+        response = self.node(address).send_command("cluster", timeout=timeout, **fields)
+        if "error" in response:
+            raise RuntimeError(f"{address}: {response['error']}")
+        return response
+
+    def disconnect(self):
+        super().disconnect()
+        with self.nodes_lock:
+            for client in self.nodes.values():
+                client.disconnect()
+
+class AsyncConnection(asyncio.Protocol):
+    """One connection of an AsyncTCPClient, matching replies to requests in the order they were written.
+
+    On a subscriber connection, frames that are not replies are passed to push.
+    """
+
+    def __init__(self, on_lost, push=None):
+        self.on_lost = on_lost
+        self.push = push
+        self.transport = None
+        self.reader = FrameReader()
+        self.waiting = deque()  # (command, future) per request written and not yet answered
+        self.timers = {}  # id of the last command of a batch -> its timeout handle
+        self.closed = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def send(self, requests, timeout=None):
+        """Write the commands of (command, future) requests in one go.
+
+        With timeout, futures still unanswered after timeout seconds fail with
+        TimeoutError. That is one timer for the whole batch, cancelled by the
+        reply to its last command.
+        """
+        self.waiting.extend(requests)
+        self.transport.write(b''.join([encode_frame(command) for command, _ in requests]))
+        if timeout is not None:
+            timer = asyncio.get_running_loop().call_later(timeout, self._expire, requests)
+            self.timers[requests[-1][0]["id"]] = timer
+
+    @staticmethod
+    def _expire(requests):
+        for _, future in requests:
+            if not future.done():
+                future.set_exception(TimeoutError("Timed out waiting for responses"))
+
+    def data_received(self, data):
+        self.reader.feed(data)
+        try:
+            for payload in self.reader.frames():
+                message = decode_frame(payload)
+                if self.push is not None and "action" not in message and "error" not in message:
+                    self.push(message)
+                    continue
+                if not self.waiting:
+                    raise ConnectionError("Response without a request")
+                command, future = self.waiting.popleft()
+                if message.pop("id", command.get("id")) != command.get("id"):
+                    raise ConnectionError("Response does not match its request")
+                if not future.done():  # Unless the caller gave up on it
+                    future.set_result(message)
+                if self.timers:
+                    timer = self.timers.pop(command.get("id"), None)
+                    if timer is not None:
+                        timer.cancel()
+        except (ValueError, ConnectionError) as e:
+            self.close(e)
+
+    def connection_lost(self, exc):
+        self._fail(exc if isinstance(exc, ConnectionError) else ConnectionError("Connection closed by server"))
+
+    def close(self, error=None):
+        """Close the connection; requests still waiting for replies fail with error, a ConnectionError."""
+        if self.transport is None or self.closed:
+            return
+        self._fail(error if isinstance(error, ConnectionError) else ConnectionError(str(error or "Connection closed")))
+        if error is None:
+            self.transport.close()
+        else:
+            self.transport.abort()
+
+    def _fail(self, error):
+        if self.closed:
+            return
+        self.closed = True
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+        waiting, self.waiting = self.waiting, deque()
+        for _, future in waiting:
+            if not future.done():
+                future.set_exception(error)
+        self.on_lost(self)
+
+
+class Subscription:
+    """Messages from one channel or pattern subscription of an AsyncTCPClient, as an async iterator.
+
+        async with await client.subscribe("news") as news:
+            async for message in news:
+                ...
+
+    Iteration ends once the subscription is cancelled or its connection is
+    lost. While more than BUFFER messages wait to be read, the client stops
+    reading its subscriber connection, so a slow reader is held back by the
+    server's slow consumer policy rather than by unbounded memory here.
+    """
+
+    BUFFER = 1024
+    END = object()
+
+    def __init__(self, client, kind, name):
+        self.client = client
+        self.kind = kind  # "channel" or "pattern"
+        self.name = name
+        self.queue = asyncio.Queue()
+        self.active = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.queue.get()
+        if message is self.END:
+            self.queue.put_nowait(self.END)  # Later reads end as well
+            raise StopAsyncIteration
+        if self.client.subscriber_paused and self.queue.qsize() < self.BUFFER // 2:
+            self.client._resume_subscriber()
+        return message
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.unsubscribe()
+
+    def full(self):
+        return self.queue.qsize() >= self.BUFFER
+
+    def deliver(self, message):
+        self.queue.put_nowait(message)
+
+    def end(self):
+        if self.active:
+            self.active = False
+            self.queue.put_nowait(self.END)
+
+    async def unsubscribe(self, timeout=None):
+        """Cancel this subscription; the server is told once no other subscription needs the channel."""
+        await self.client._remove_subscriptions([self], timeout)
+
+
+class AsyncTCPClient(Commands):
+    """asyncio client that pipelines the commands of concurrent callers automatically.
+
+    Every command method is available and returns an awaitable.
+    Commands issued during one turn of the event loop are queued and
+    written together, in one write on one connection, as soon as the loop
+    gets to the next turn; the replies come back in order on that
+    connection and are handed to their callers. Thousands of coroutines
+    thus share a few sockets, opened on demand up to connections, with one
+    write and a few reads per batch instead of a round trip per command.
+    A connection the server closes is noticed at once and replaced on the
+    next command, so nothing is retried: commands in flight on it fail with
+    ConnectionError. A client belongs to the event loop it is first used on.
+
+        async with AsyncTCPClient() as client:
+            await asyncio.gather(*(client.set(f"k{i}", i) for i in range(1000)))
+            news = await client.subscribe("news")
+            async for message in news:
+                ...
+    """
+
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, connections=ASYNC_CLIENT_CONNECTIONS,
+                 timeout=CLIENT_TIMEOUT, retries=CLIENT_CONNECT_RETRIES, backoff=CLIENT_RETRY_BACKOFF):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_connections = connections
+        self.retries = retries
+        self.backoff = backoff
+        self.request_ids = itertools.count(1)
+        self.connections = []
+        self.connecting = 0
+        self.tasks = set()  # Connection attempts in progress
+        self.queued = []  # (command, future, timeout) not yet written
+        self.flush_handle = None
+        self.closed = False
+        self.subscriber = None  # AsyncConnection for subscriptions
+        self.subscriber_lock = asyncio.Lock()
+        self.subscriber_paused = False
+        self.subscriptions = {}  # ("channel" or "pattern", name) -> set of Subscription
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.disconnect()
+
+    async def connect(self):
+        """Open a connection now rather than on the first command."""
+        if not self.connections:
+            self.connections.append(await self._connect())
+
+    async def disconnect(self):
+        """Close every connection; queued commands and commands in flight fail with ConnectionError."""
+        self.closed = True
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        queued, self.queued = self.queued, []
+        for _, future, _ in queued:
+            if not future.done():
+                future.set_exception(ConnectionError("Client closed"))
+        for task in list(self.tasks):
+            task.cancel()
+        for conn in self.connections + ([self.subscriber] if self.subscriber else []):
+            conn.close()
+
+    async def _connect(self, push=None):
+        """Open a connection, retrying with exponential backoff."""
+        loop = asyncio.get_running_loop()
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                _, conn = await asyncio.wait_for(
+                    loop.create_connection(lambda: AsyncConnection(self._connection_lost, push), self.host, self.port),
+                    self.timeout)
+                return conn
+            except OSError:
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    def _connection_lost(self, conn):
+        if conn in self.connections:
+            self.connections.remove(conn)
+        elif conn is self.subscriber:
+            self.subscriber = None
+            self.subscriber_paused = False
+            for subscriptions in self.subscriptions.values():
+                for subscription in subscriptions:
+                    subscription.end()
+            self.subscriptions.clear()
+
+    async def send_command(self, action, key=None, value=None, ttl=None, type=None, channel=None, message=None,
+                           timeout=None, **fields):
+        """Send a command, in the next batch, and return the response."""
+        command = self.build_command(action, key, value, ttl, type, channel, message, **fields)
+        return (await self.send_commands([command], timeout))[0]
+
+    async def send_commands(self, commands, timeout=None):
+        """Queue several commands for the next batch and return their responses in order.
+
+        timeout (seconds) bounds the wait for the responses once the commands
+        are written, and defaults to the client's timeout. Responses that
+        arrive after it are dropped.
+        """
+        if self.closed:
+            raise ConnectionError("Client closed")
+        loop = asyncio.get_running_loop()
+        timeout = self.timeout if timeout is None else timeout
+        futures = []
+        for command in commands:
+            command["id"] = next(self.request_ids)
+            future = loop.create_future()
+            self.queued.append((command, future, timeout))
+            futures.append(future)
+        if self.flush_handle is None:
+            # Runs after every callback already scheduled for this turn, so their commands join the batch
+            self.flush_handle = loop.call_soon(self._flush)
+        try:
+            return [await future for future in futures]
+        except BaseException:
+            # The outcome of the other commands is of no interest any more
+            for future in futures:
+                if not future.done():
+                    future.cancel()
+                elif not future.cancelled():
+                    future.exception()  # Marks it as retrieved
+            raise
+
+    def _flush(self):
+        """Write the queued commands on the least busy connection, opening another if all are busy."""
+        self.flush_handle = None
+        queued = [request for request in self.queued if not request[1].done()]
+        self.queued = []
+        if not queued:
+            return
+        conn = min(self.connections, key=lambda conn: len(conn.waiting), default=None)
+        if (conn is None or conn.waiting) and len(self.connections) + self.connecting < self.max_connections:
+            self._open_connection()
+        if conn is None:
+            self.queued = queued  # Sent once the connection is up
+            return
+        batches = {}  # timeout -> requests, almost always a single one
+        for command, future, timeout in queued:
+            batches.setdefault(timeout, []).append((command, future))
+        for timeout, requests in batches.items():
+            conn.send(requests, timeout)
+
+    def _open_connection(self):
+        self.connecting += 1
+        task = asyncio.get_running_loop().create_task(self._connect())
+        self.tasks.add(task)
+        task.add_done_callback(self._connected)
+
+    def _connected(self, task):
+        self.tasks.discard(task)
+        self.connecting -= 1
+        error = ConnectionError("Client closed") if task.cancelled() else task.exception()
+        if error is not None:
+            if not self.connections and not self.connecting:
+                # Nothing left to send the queued commands on
+                queued, self.queued = self.queued, []
+                for _, future, _ in queued:
+                    if not future.done():
+                        future.set_exception(error)
+            return
+        conn = task.result()
+        if self.closed:
+            conn.close()
+            return
+        self.connections.append(conn)
+        if self.queued and self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_soon(self._flush)
+
+    async def scan_iter(self, match=None, count=100, timeout=None):
+        """Yield every key matching the glob pattern, one SCAN step at a time."""
+        cursor = 0
+        while True:
+            response = await self.scan(cursor, match, count, timeout)
+            if "error" in response:
+                raise RuntimeError(response["error"])
+            for key in response["result"]:
+                yield key
+            cursor = response["cursor"]
+            if cursor == 0:
+                return
+
+    async def subscribe(self, channel, timeout=None):
+        """Subscribe to a channel and return a Subscription to iterate over its messages.
+
+        All subscriptions share one dedicated connection. Raises RuntimeError
+        if the server refuses the subscription.
+        """
+        return await self._subscribe("subscribe", "channel", channel, timeout)
+
+    async def psubscribe(self, pattern, timeout=None):
+        """Subscribe to every channel matching a glob pattern; messages carry the pattern in "pattern"."""
+        return await self._subscribe("psubscribe", "pattern", pattern, timeout)
+
+    async def _subscribe(self, action, kind, name, timeout):
+        async with self.subscriber_lock:
+            if self.subscriber is None:
+                self.subscriber = await self._connect(push=self._deliver)
+            subscription = Subscription(self, kind, name)
+            subscriptions = self.subscriptions.get((kind, name))
+            if subscriptions:
+                subscriptions.add(subscription)
+                return subscription
+            # Registered first, since messages may follow the confirmation in the same read
+            self.subscriptions[(kind, name)] = {subscription}
+            try:
+                response = await self._subscriber_request({"type": "pubsub", "action": action, kind: name}, timeout)
+            except BaseException:
+                self.subscriptions.pop((kind, name), None)
+                raise
+            if response.get("result") != "OK":
+                self.subscriptions.pop((kind, name), None)
+                raise RuntimeError(response.get("error", f"{action} {name} failed"))
+            return subscription
+
+    async def _subscriber_request(self, command, timeout=None):
+        """Send a (un)subscribe command on the subscriber connection and wait for its confirmation."""
+        future = asyncio.get_running_loop().create_future()
+        self.subscriber.send([(command, future)])
+        return await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+
+    def _deliver(self, message):
+        kind, name = ("pattern", message["pattern"]) if "pattern" in message else ("channel", message.get("channel"))
+        for subscription in self.subscriptions.get((kind, name), ()):
+            subscription.deliver(message)
+            if subscription.full() and not self.subscriber_paused:
+                self.subscriber_paused = True
+                self.subscriber.transport.pause_reading()
+
+    def _resume_subscriber(self):
+        if self.subscriber is None:
+            return
+        if not any(subscription.full() for subscriptions in self.subscriptions.values()
+                   for subscription in subscriptions):
+            self.subscriber_paused = False
+            self.subscriber.transport.resume_reading()
+
+    async def unsubscribe(self, channel=None, timeout=None):
+        """Cancel every subscription to channel, or every subscription at all if channel is None."""
+        await self._remove_subscriptions(self._matching("channel", channel), timeout)
+
+    async def punsubscribe(self, pattern=None, timeout=None):
+        """Cancel every subscription to pattern, or to any pattern if pattern is None."""
+        await self._remove_subscriptions(self._matching("pattern", pattern), timeout)
+
+    def _matching(self, kind, name):
+        if name is not None:
+            return list(self.subscriptions.get((kind, name), ()))
+        if kind == "channel":
+            # Like TCPClient.unsubscribe(), stop listening altogether
+            return [subscription for subscriptions in self.subscriptions.values() for subscription in subscriptions]
+        return [subscription for (other, _), subscriptions in self.subscriptions.items() if other == kind
+                for subscription in subscriptions]
+
+    async def _remove_subscriptions(self, subscriptions, timeout=None):
+        async with self.subscriber_lock:
+            unused = []
+            for subscription in subscriptions:
+                subscription.end()
+                key = (subscription.kind, subscription.name)
+                others = self.subscriptions.get(key)
+                if others and subscription in others:
+                    others.discard(subscription)
+                    if not others:
+                        del self.subscriptions[key]
+                        unused.append(key)
+            if self.subscriber is None or not unused:
+                return
+            if not self.subscriptions:
+                self.subscriber.close()
+                self.subscriber = None
+                self.subscriber_paused = False
+                return
+            for kind, name in unused:
+                action = "punsubscribe" if kind == "pattern" else "unsubscribe"
+                await self._subscriber_request({"type": "pubsub", "action": action, kind: name}, timeout)
+            if self.subscriber_paused:
+                self._resume_subscriber()
 
 def message_handler(message):
     """Default message handler for subscriptions."""
@@ -179,8 +1591,11 @@ def main():
     client = TCPClient()
     print("In-Memory DB Client with PubSub")
     print("Commands:")
-    print("  Database: get <key>, set <key> <value>, set_with_ttl <key> <value> <ttl>, delete <key>, keys")
-    print("  PubSub: subscribe <channel>, unsubscribe, publish <channel> <message>, list_channels, list_subscribers <channel>")
+    print("  Database: get <key>, set <key> <value>, set_with_ttl <key> <value> <ttl>, delete <key>, mget <key>..., mset <key> <value> ..., mdelete <key>..., unlink <key>..., mexpire <ttl> <key>..., keys, scan <cursor> [match] [count], flushall [async]")
+    print("  Atomic: incr <key> [amount], decr <key> [amount], append <key> <value>, getset <key> <value>, setnx <key> <value>, cas <key> <version> <value>")
+    print("  Types: type <key>, <command> <key> [args...] for hset hget hdel hgetall lpush rpush lpop rpop lrange sadd srem smembers zadd zrem zrange zrangebyscore ...")
+    print("  PubSub: subscribe <channel>..., psubscribe <pattern>..., unsubscribe [channel], punsubscribe [pattern], publish <channel> <message>, list_channels, list_patterns, list_subscribers <channel>")
+    print("  Server: info [section], slowlog [get [count] | len | reset], replicaof <host> <port> | replicaof no one, cluster info | slots | keyslot <key>, reshard <first slot> <last slot> <host:port>")
     print("  General: exit, help")
     
     client.running = True
@@ -202,8 +1617,11 @@ def main():
                 # Help command
                 elif action == "help":
                     print("Commands:")
-                    print("  Database: get <key>, set <key> <value>, set_with_ttl <key> <value> <ttl>, delete <key>, keys")
-                    print("  PubSub: subscribe <channel>, unsubscribe, publish <channel> <message>, list_channels, list_subscribers <channel>")
+                    print("  Database: get <key>, set <key> <value>, set_with_ttl <key> <value> <ttl>, delete <key>, mget <key>..., mset <key> <value> ..., mdelete <key>..., unlink <key>..., mexpire <ttl> <key>..., keys, scan <cursor> [match] [count], flushall [async]")
+                    print("  Atomic: incr <key> [amount], decr <key> [amount], append <key> <value>, getset <key> <value>, setnx <key> <value>, cas <key> <version> <value>")
+                    print("  Types: type <key>, <command> <key> [args...] for hset hget hdel hgetall lpush rpush lpop rpop lrange sadd srem smembers zadd zrem zrange zrangebyscore ...")
+                    print("  PubSub: subscribe <channel>..., psubscribe <pattern>..., unsubscribe [channel], punsubscribe [pattern], publish <channel> <message>, list_channels, list_patterns, list_subscribers <channel>")
+                    print("  Server: info [section], slowlog [get [count] | len | reset], replicaof <host> <port> | replicaof no one, cluster info | slots | keyslot <key>, reshard <first slot> <last slot> <host:port>")
                     print("  General: exit, help")
                 
                 # Database commands
@@ -234,20 +1652,111 @@ def main():
                     response = client.delete(key)
                     print(response)
                     
+                elif action == "mget" and len(parts) >= 2:
+                    response = client.mget(parts[1:])
+                    print(response)
+
+                elif action == "mset" and len(parts) >= 3 and len(parts) % 2 == 1:
+                    response = client.mset(list(zip(parts[1::2], parts[2::2])))
+                    print(response)
+
+                elif action == "mdelete" and len(parts) >= 2:
+                    response = client.mdelete(parts[1:])
+                    print(response)
+
+                elif action == "unlink" and len(parts) >= 2:
+                    response = client.unlink(parts[1:])
+                    print(response)
+
+                elif action == "flushall" and len(parts) <= 2:
+                    response = client.flushall(parts[1].lower() == "async" if len(parts) == 2 else None)
+                    print(response)
+
+                elif action == "mexpire" and len(parts) >= 3:
+                    response = client.mexpire(parts[2:], int(parts[1]))
+                    print(response)
+
+                elif action in ("incr", "decr") and 2 <= len(parts) <= 3:
+                    amount = parts[2] if len(parts) == 3 else 1
+                    response = client.incr(parts[1], amount) if action == "incr" else client.decr(parts[1], amount)
+                    print(response)
+
+                elif action in ("append", "getset", "setnx") and len(parts) >= 3:
+                    response = getattr(client, action)(parts[1], " ".join(parts[2:]))
+                    print(response)
+
+                elif action == "cas" and len(parts) >= 4:
+                    response = client.cas(parts[1], int(parts[2]), " ".join(parts[3:]))
+                    print(response)
+
+                elif action == "info" and len(parts) <= 2:
+                    response = client.info(parts[1] if len(parts) == 2 else None)
+                    print(json.dumps(response, indent=2))
+
+                elif action == "slowlog" and len(parts) <= 3:
+                    subcommand = parts[1] if len(parts) >= 2 else "get"
+                    response = client.slowlog(subcommand, int(parts[2]) if len(parts) == 3 else None)
+                    print(response)
+
+                elif action == "replicaof" and len(parts) == 3:
+                    if parts[1].lower() == "no" and parts[2].lower() == "one":
+                        response = client.replicaof()
+                    else:
+                        response = client.replicaof(parts[1], int(parts[2]))
+                    print(response)
+
+                elif action == "cluster" and parts[1:2] in (["info"], ["slots"]) and len(parts) == 2:
+                    print(json.dumps(client.send_command("cluster", subcommand=parts[1]), indent=2))
+
+                elif action == "cluster" and parts[1:2] == ["keyslot"] and len(parts) == 3:
+                    print(client.send_command("cluster", subcommand="keyslot", key=parts[2]))
+
+                elif action == "reshard" and len(parts) == 4:
+                    cluster_client = ClusterClient(client.host, client.port)
+                    try:
+                        moved = cluster_client.migrate_slots(range(int(parts[1]), int(parts[2]) + 1), parts[3])
+                        print(f"Moved {moved} keys")
+                    finally:
+                        cluster_client.disconnect()
+
+                elif action == "type" and len(parts) == 2:
+                    response = client.type(parts[1])
+                    print(response)
+
+                elif action in COMMANDS and len(parts) >= 2:
+                    response = client._command(action, parts[1], *parts[2:])
+                    print(response)
+
                 elif action == "keys" and len(parts) == 1:
                     response = client.keys()
                     print(response)
+
+                elif action == "scan" and 2 <= len(parts) <= 4:
+                    cursor = int(parts[1])
+                    match = parts[2] if len(parts) >= 3 else None
+                    count = int(parts[3]) if len(parts) == 4 else None
+                    response = client.scan(cursor, match, count)
+                    print(response)
                 
                 # PubSub commands
-                elif action == "subscribe" and len(parts) == 2:
-                    channel = parts[1]
-                    if client.subscribe(channel, message_handler):
-                        print(f"Subscribed to channel: {channel}")
-                    else:
-                        print("Failed to subscribe")
+                elif action == "subscribe" and len(parts) >= 2:
+                    for channel in parts[1:]:
+                        if client.subscribe(channel, message_handler):
+                            print(f"Subscribed to channel: {channel}")
+                        else:
+                            print("Failed to subscribe")
+
+                elif action == "psubscribe" and len(parts) >= 2:
+                    for pattern in parts[1:]:
+                        if client.psubscribe(pattern, message_handler):
+                            print(f"Subscribed to pattern: {pattern}")
+                        else:
+                            print("Failed to subscribe")
                         
-                elif action == "unsubscribe" and len(parts) == 1:
-                    if client.unsubscribe():
+                elif action in ("unsubscribe", "punsubscribe") and len(parts) <= 2:
+                    name = parts[1] if len(parts) == 2 else None
+                    unsubscribe = client.unsubscribe if action == "unsubscribe" else client.punsubscribe
+                    if unsubscribe(name):
                         print("Unsubscribed successfully")
                     else:
                         print("Failed to unsubscribe")
@@ -262,6 +1771,10 @@ def main():
                     response = client.list_channels()
                     print(response)
                     
+                elif action == "list_patterns" and len(parts) == 1:
+                    response = client.list_patterns()
+                    print(response)
+
                 elif action == "list_subscribers" and len(parts) == 2:
                     channel = parts[1]
                     response = client.list_subscribers(channel)
@@ -0,0 +1,334 @@
+#cluster.py
+import binascii
+import json
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+import client
+from storage import snapshot_entry
+from config import CLUSTER_CONFIG_FILE
+from log import get_logger
+
+logger = get_logger('cluster')
+
+SLOTS = 16384
+MIGRATE_BATCH = 1000  # Keys sent to the target per round trip while migrating
+
+def key_slot(key):
+    """Hash slot of key: CRC16 of the key modulo 16384, as in Redis Cluster.
+
+    If the key contains a non-empty {hash tag}, only the tag is hashed, so
+    keys such as user:{42}:name and user:{42}:email live in the same slot.
+    """
+    raw = key.encode('utf-8') if isinstance(key, str) else str(key).encode('utf-8')
+    start = raw.find(b'{')
+    if start != -1:
+        end = raw.find(b'}', start + 1)
+        if end > start + 1:
+            raw = raw[start + 1:end]
+    return binascii.crc_hqx(raw, 0) & (SLOTS - 1)
+
+def split_address(address):
+    host, _, port = address.rpartition(':')
+    return host, int(port)
+
+def slot_ranges(owners):
+    """Compress a per-slot list of owners into [start, end, owner] ranges."""
+    ranges = []
+    for slot, owner in enumerate(owners):
+        if ranges and ranges[-1][2] == owner and ranges[-1][1] == slot - 1:
+            ranges[-1][1] = slot
+        else:
+            ranges.append([slot, slot, owner])
+    return ranges
+
+def even_split(nodes):
+    """Owners that give each node an equal, contiguous share of the slots."""
+    return [nodes[slot * len(nodes) // SLOTS] for slot in range(SLOTS)]
+
+
+class ClusterRedirect(Exception):
+    """The command must run elsewhere or later; the message is the error to reply with."""
+
+
+class ClusterState:
+    """One node's view of the cluster: who owns each hash slot, and the slots on the move.
+
+    Commands on keys in slots owned elsewhere are answered with
+    "MOVED <slot> <host:port>". While a slot migrates, the source keeps
+    serving the keys it still has and answers "ASK <slot> <host:port>" for
+    the rest; the target serves them only to requests flagged "asking".
+    Every command on a migrating slot holds the slot's lock, and keys are
+    moved in batches under the same lock, so a key is never written on
+    both nodes and traffic on the slot only waits for one batch at a time.
+    The keys stored here are indexed by slot, kept up to date by a
+    database observer, so finding a slot's keys never scans the keyspace.
+    """
+
+    def __init__(self, db, myself, nodes, apply_entry, join=None, config_file=CLUSTER_CONFIG_FILE):
+        self.db = db
+        self.myself = myself  # "host:port" of this node
+        self.apply_entry = apply_entry  # Applies one log entry, used to import migrated keys
+        self.config_file = config_file
+        self.migrating = {}  # slot -> target node
+        self.importing = {}  # slot -> source node
+        self.slot_locks = {}  # slot -> Lock held by commands on a migrating slot
+        self.lock = threading.Lock()
+        self.slot_keys = {}  # slot -> set of the keys stored here in it
+        db.add_observer(self.track_keys)
+        for key in list(db.data):
+            self._index(key)
+        if os.path.exists(config_file):
+            with open(config_file) as f:
+                config = json.load(f)
+            self.owners = [None] * SLOTS
+            for start, end, owner in config["slots"]:
+                self.owners[start:end + 1] = [owner] * (end - start + 1)
+            logger.info("Loaded the slot map from %s", config_file)
+        elif join:
+            # A new node owns nothing until slots are migrated to it
+            peer = client.TCPClient(*split_address(join), pool_size=1, cache_size=0)
+            try:
+                response = peer.send_command("cluster", subcommand="slots")
+            finally:
+                peer.disconnect()
+            if "error" in response:
+                raise RuntimeError(f"Cannot join the cluster through {join}: {response['error']}")
+            self.owners = [None] * SLOTS
+            for start, end, owner in response["result"]:
+                self.owners[start:end + 1] = [owner] * (end - start + 1)
+            self.save()
+        else:
+            if myself not in nodes:
+                raise ValueError(f"This node ({myself}) is not in the cluster node list")
+            self.owners = even_split(nodes)
+            self.save()
+
+    def save(self):
+        """Keep the slot map so a restarted node knows what it owned."""
+        temp_filename = self.config_file + '.tmp'
+        with open(temp_filename, 'w') as f:
+            json.dump({"myself": self.myself, "slots": slot_ranges(self.owners)}, f)
+        os.replace(temp_filename, self.config_file)
+
+    def nodes(self):
+        return sorted({owner for owner in self.owners if owner} | set(self.migrating.values())
+                      | set(self.importing.values()) | {self.myself})
+
+    @contextmanager
+    def serving(self, keys, asking=False):
+        """Hold while running a command on keys here.
+
+        Raises ClusterRedirect if the command belongs on another node, or has
+        to wait for a migration.
+        """
+        slots = sorted({key_slot(key) for key in keys})
+        migrating = []
+        for slot in slots:
+            if self.owners[slot] != self.myself:
+                if asking and slot in self.importing:
+                    continue
+                self._redirect(slots)
+            if slot in self.migrating:
+                migrating.append(slot)
+        if not migrating:
+            yield
+            return
+        locks = [self.slot_locks[slot] for slot in migrating]
+        for lock in locks:
+            lock.acquire()
+        try:
+            if any(self.owners[slot] != self.myself for slot in migrating):
+                self._redirect(slots)  # The migration finished while we waited
+            missing = [key for key in keys if key_slot(key) in migrating and key not in self.db.data]
+            if missing:
+                if len(slots) == 1 and len(missing) == len(keys):
+                    raise ClusterRedirect(f"ASK {slots[0]} {self.migrating[slots[0]]}")
+                raise ClusterRedirect("TRYAGAIN Multiple keys request during rehashing of slot")
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def _redirect(self, slots):
+        owners = {self.owners[slot] for slot in slots}
+        if len(owners) == 1 and None not in owners:
+            raise ClusterRedirect(f"MOVED {slots[0]} {owners.pop()}")
+        if None in owners:
+            raise ClusterRedirect(f"CLUSTERDOWN Hash slot {slots[0]} not served")
+        raise ClusterRedirect("CROSSSLOT Keys in request don't hash to the same slot")
+
+    def set_slots(self, slots, state, node=None):
+        """Mark slots as migrating to, importing from or owned by node, or as stable."""
+        with self.lock:
+            for slot in slots:
+                if state == "migrating":
+                    if self.owners[slot] != self.myself:
+                        raise ValueError(f"I'm not the owner of hash slot {slot}")
+                    self.slot_locks.setdefault(slot, threading.Lock())
+                    self.migrating[slot] = node
+                elif state == "importing":
+                    if self.owners[slot] == self.myself:
+                        raise ValueError(f"I'm already the owner of hash slot {slot}")
+                    self.importing[slot] = node
+                elif state in ("node", "stable"):
+                    if state == "node":
+                        self.owners[slot] = node
+                    self.migrating.pop(slot, None)
+                    self.importing.pop(slot, None)
+                else:
+                    raise ValueError("state must be 'migrating', 'importing', 'node' or 'stable'")
+            if state == "node":
+                self.save()
+
+    def track_keys(self, operation, key, value=None):
+        """Observer that keeps the slot index in step with the keyspace.
+
+        Called with the keys' stripe locks held, so whether a key is still
+        stored tells if the write created or removed it.
+        """
+        if operation == "clear":
+            self.slot_keys = {}
+        elif operation == "mset":
+            for item in value:
+                self._index(item[0])
+        elif operation == "mdelete":
+            for removed in value:
+                self._index(removed)
+        elif key is not None:
+            self._index(key)
+
+    def _index(self, key):
+        slot = key_slot(key)
+        if key in self.db.data:
+            keys = self.slot_keys.get(slot)
+            if keys is None:
+                keys = self.slot_keys.setdefault(slot, set())
+            keys.add(key)
+        else:
+            keys = self.slot_keys.get(slot)
+            if keys is not None:
+                keys.discard(key)
+
+    def keys_in_slots(self, slots):
+        """Return {slot: [keys]} for the keys stored here in slots."""
+        found = {}
+        for slot in slots:
+            keys = self.slot_keys.get(slot)
+            if keys:
+                found[slot] = list(keys)
+        return found
+
+    def migrate(self, slots):
+        """Move every key in the migrating slots to their targets, then hand the slots over.
+
+        Returns the number of keys moved.
+        """
+        by_target = defaultdict(list)
+        for slot in slots:
+            if slot not in self.migrating:
+                raise ValueError(f"Hash slot {slot} is not migrating")
+            by_target[self.migrating[slot]].append(slot)
+        moved = 0
+        for target, target_slots in by_target.items():
+            peer = client.TCPClient(*split_address(target), pool_size=1, cache_size=0)
+            try:
+                for slot, keys in self.keys_in_slots(target_slots).items():
+                    for i in range(0, len(keys), MIGRATE_BATCH):
+                        with self.slot_locks[slot]:
+                            moved += self._move(peer, keys[i:i + MIGRATE_BATCH])
+                # Keys written by requests that were already running when the
+                # slots were marked migrating are picked up by a final pass
+                locks = [self.slot_locks[slot] for slot in sorted(target_slots)]
+                for lock in locks:
+                    lock.acquire()
+                try:
+                    for keys in self.keys_in_slots(target_slots).values():
+                        moved += self._move(peer, keys)
+                    # The target first, so redirects never bounce back here
+                    self._call(peer, subcommand="setslot", slots=target_slots, state="node", node=target)
+                    self.set_slots(target_slots, "node", target)
+                finally:
+                    for lock in reversed(locks):
+                        lock.release()
+            finally:
+                peer.disconnect()
+            logger.info("Migrated %d slots to %s", len(target_slots), target)
+        return moved
+
+    def _move(self, peer, keys):
+        """Copy keys to the target and delete them here. The caller holds their slot locks."""
+        entries = []
+        present = []
+        for key in keys:
+            value = self.db.get(key)
+            if value is not None:
+                entries.append(snapshot_entry(key, value, self.db.expiry(key)))
+                present.append(key)
+        if not entries:
+            return 0
+        self._call(peer, subcommand="import", entries=entries)
+        self.db.mdelete(present)
+        return len(present)
+
+    @staticmethod
+    def _call(peer, **fields):
+        response = peer.send_command("cluster", timeout=max(peer.timeout, 60), **fields)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    def handle_command(self, command):
+        """Run a cluster subcommand and return its response."""
+        subcommand = command.get("subcommand")
+        if subcommand == "slots":
+            return {"result": slot_ranges(self.owners), "myself": self.myself}
+        if subcommand == "info":
+            return {"result": self.info()}
+        if subcommand == "keyslot":
+            if command.get("key") is None:
+                return {"error": "key not provided"}
+            return {"result": key_slot(command["key"])}
+        if subcommand in ("countkeysinslot", "getkeysinslot"):
+            slot = command.get("slot")
+            if not isinstance(slot, int) or not 0 <= slot < SLOTS:
+                return {"error": "Invalid slot"}
+            keys = self.keys_in_slots([slot]).get(slot, [])
+            if subcommand == "countkeysinslot":
+                return {"result": len(keys)}
+            return {"result": keys[:command.get("count", 10)]}
+
+        slots = command.get("slots")
+        if subcommand in ("setslot", "migrate") and (
+                not isinstance(slots, list)
+                or not all(isinstance(slot, int) and 0 <= slot < SLOTS for slot in slots)):
+            return {"error": "slots must be a list of slot numbers"}
+        try:
+            if subcommand == "setslot":
+                node = command.get("node")
+                if command.get("state") != "stable" and not isinstance(node, str):
+                    return {"error": "node must be 'host:port'"}
+                self.set_slots(slots, command.get("state"), node)
+                return {"result": "OK"}
+            if subcommand == "migrate":
+                return {"result": "OK", "moved": self.migrate(slots)}
+        except (ValueError, RuntimeError, OSError) as e:
+            return {"error": str(e)}
+        if subcommand == "import":
+            entries = command.get("entries")
+            if not isinstance(entries, list):
+                return {"error": "entries must be a list"}
+            for entry in entries:
+                self.apply_entry(entry)
+            return {"result": "OK", "count": len(entries)}
+        return {"error": "Unknown cluster subcommand"}
+
+    def info(self):
+        return {
+            "myself": self.myself,
+            "known_nodes": len(self.nodes()),
+            "slots_owned": sum(owner == self.myself for owner in self.owners),
+            "slots_migrating": len(self.migrating),
+            "slots_importing": len(self.importing),
+        }
\ No newline at end of file
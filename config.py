@@ -2,12 +2,92 @@
 # Server configuration
 SERVER_HOST = '127.0.0.1'
 SERVER_PORT = 65432
+MAX_FRAME_SIZE = 512 * 1024 * 1024  # Largest accepted protocol frame (bytes)
+LISTEN_BACKLOG = 1024
+RESP_PORT = 0  # Also accept Redis protocol (RESP2/RESP3) clients on this port, 0 to disable
+SERVER_MODE = 'threaded'  # 'threaded' (one thread per client) or 'eventloop' (asyncio)
+EVENT_LOOP_WORKERS = 1  # Event loops in 'eventloop' mode, each in its own thread; more only help free-threaded builds
+
+# Observability configuration
+LOG_LEVEL = 'info'  # 'debug' (also logs every request), 'info', 'warning' or 'error'
+METRICS_PORT = 0  # Serve Prometheus metrics over HTTP on this port, 0 to disable
+SLOWLOG_LOG_SLOWER_THAN = 10000  # Log commands slower than this (microseconds), negative to disable
+SLOWLOG_MAX_LEN = 128  # Entries kept in the slowlog
+
+# Replication configuration
+REPLICA_OF = None  # (host, port) of a primary to replicate from, None to run as a primary
+REPL_BACKLOG_SIZE = 1024 * 1024  # Bytes of recent stream kept so a reconnecting replica can resume
+REPL_OUTPUT_BUFFER_LIMIT = 64 * 1024 * 1024  # Bytes that may wait to be sent to one replica
+REPL_TIMEOUT = 10  # Seconds without hearing from the primary before a replica reconnects
+
+# Cluster configuration
+CLUSTER_NODES = []  # "host:port" of every node; the hash slots are split evenly between them
+CLUSTER_CONFIG_FILE = 'nodes.json'  # Where a cluster node keeps its slot map across restarts
+
+# Client configuration
+CLIENT_POOL_SIZE = 10  # Persistent connections kept per TCPClient
+CLIENT_TIMEOUT = 5.0  # Default per-call timeout in seconds
+CLIENT_CONNECT_RETRIES = 3  # Reconnect attempts before giving up
+CLIENT_RETRY_BACKOFF = 0.05  # First retry delay in seconds, doubled on each attempt
+CLIENT_HEALTH_CHECK_INTERVAL = 30  # Probe connections idle for longer than this (seconds)
+ASYNC_CLIENT_CONNECTIONS = 4  # Connections an AsyncTCPClient spreads its pipelined batches over
+
+# PubSub configuration
+PUBSUB_OUTPUT_BUFFER_LIMIT = 8 * 1024 * 1024  # Bytes that may wait to be sent to one subscriber
+# What to do when a subscriber's buffer is full: 'drop', 'disconnect' or 'block'
+PUBSUB_SLOW_CONSUMER_POLICY = 'disconnect'
+PUBSUB_BLOCK_TIMEOUT = 1.0  # Longest a publisher waits under 'block' before disconnecting
 
 # Cache configuration
 CACHE_CAPACITY = 100  # Number of items the LRU cache can hold
+CLIENT_CACHE_SIZE = 0  # Values a TCPClient keeps locally with server-assisted invalidation, 0 to disable
+TRACKING_TABLE_MAX_KEYS = 1000000  # Keys the server remembers readers for; the oldest are invalidated beyond this
+
+# Database configuration
+DB_LOCK_STRIPES = 16  # Independent locks the keyspace is partitioned over
+CDC_BUFFER_SIZE = 65536  # Recent changes kept in the change log for consumers to read
+CDC_BATCH_SIZE = 1024  # Most changes a consumer is handed at once
+LAZYFREE = False  # Free large deleted, expired, evicted or overwritten values, and flushed keyspaces, in the background
+LAZYFREE_THRESHOLD = 64  # Elements (or 4 KB pages of a string) above which a value is freed in the background
+
+# Data type encodings: collections stay in a compact encoding up to these sizes
+HASH_MAX_LISTPACK_ENTRIES = 128
+HASH_MAX_LISTPACK_VALUE = 64  # Longest field or value (characters) kept in a compact hash
+LIST_MAX_LISTPACK_ENTRIES = 128
+SET_MAX_INTSET_ENTRIES = 512  # Integer-only sets up to this size are a sorted array
+ZSET_MAX_LISTPACK_ENTRIES = 128
+ZSET_MAX_LISTPACK_VALUE = 64  # Longest member (characters) kept in a compact sorted set
+
+# Memory limit configuration
+MAXMEMORY = 0  # Memory ceiling in bytes for keys and values, 0 for no limit
+# What to do at the limit: 'noeviction', 'allkeys-lru', 'allkeys-lfu', 'volatile-ttl' or 'allkeys-random'
+MAXMEMORY_POLICY = 'noeviction'
+MAXMEMORY_SAMPLES = 5  # Keys sampled per eviction by 'allkeys-lfu'
+MAXMEMORY_STRIPE_SAMPLES = 4  # Random lock stripes asked for a candidate per eviction
+LFU_LOG_FACTOR = 10  # Higher values need more hits to raise an LFU counter
+LFU_DECAY_TIME = 1  # Minutes after which an idle key's LFU counter drops by one
+
+# Tiered storage configuration
+HOT_TIER_KEYS = 0  # Values kept in RAM; the least recently used of the rest go to spill files. 0 keeps all in RAM
+SPILL_DIR = 'spill'  # Directory of the spill files, which are deleted when the server exits
+SPILL_COMPACT_MIN_SIZE = 16 * 1024 * 1024  # Never compact spill files smaller than this (bytes)
 
 # Storage configuration
-STORAGE_FILE = 'persistence.json'
+STORAGE_FILE = 'persistence.json'  # Legacy JSON dump, only read when no snapshot exists
+SNAPSHOT_FILE = 'dump.imdb'
+SNAPSHOT_FORK = True  # Write background snapshots from a forked child where fork() exists
+# Take a background snapshot after <seconds> if at least <changes> writes happened
+SAVE_POINTS = [(900, 1), (300, 10), (60, 1000)]
 
 # TTL configuration
-DEFAULT_TTL = 3600  # Default TTL in seconds (1 hour)
\ No newline at end of file
+DEFAULT_TTL = 3600  # Default TTL in seconds (1 hour)
+EXPIRE_CYCLE_INTERVAL = 0.1  # Seconds between active expiry cycles
+EXPIRE_CYCLE_BUDGET = 0.025  # Max seconds one cycle may spend expiring keys
+
+# Append-only log configuration
+APPENDONLY = True  # Log every write instead of rewriting STORAGE_FILE each time
+AOF_FILE = 'appendonly.aof'
+AOF_FSYNC = 'everysec'  # 'always', 'everysec' or 'no'
+AOF_FSYNC_INTERVAL_MS = 1000  # Group commit window for 'everysec'
+AOF_REWRITE_PERCENTAGE = 100  # Compact once the log has grown this much since the last rewrite
+AOF_REWRITE_MIN_SIZE = 64 * 1024 * 1024  # Never compact logs smaller than this (bytes)
\ No newline at end of file
@@ -0,0 +1,742 @@
+#datatypes.py
+import bisect
+import random
+import sys
+from array import array
+from collections import deque
+from itertools import islice
+from config import (HASH_MAX_LISTPACK_ENTRIES, HASH_MAX_LISTPACK_VALUE, LIST_MAX_LISTPACK_ENTRIES,
+                    SET_MAX_INTSET_ENTRIES, ZSET_MAX_LISTPACK_ENTRIES, ZSET_MAX_LISTPACK_VALUE)
+from eviction import estimate_size
+
+class WrongTypeError(Exception):
+    """Raised when a command is used on a key holding another kind of value."""
+
+    def __init__(self):
+        super().__init__("WRONGTYPE Operation against a key holding the wrong kind of value")
+
+
+def _is_small(value, limit):
+    return not isinstance(value, str) or len(value) <= limit
+
+
+def _index_range(start, stop, length):
+    """Turn inclusive, possibly negative start/stop indexes into a Python range."""
+    start, stop = int(start), int(stop)
+    if start < 0:
+        start = max(start + length, 0)
+    if stop < 0:
+        stop += length
+    stop = min(stop, length - 1)
+    return range(start, stop + 1) if start <= stop else range(0)
+
+
+class Collection:
+    """Base class for the native data types.
+
+    Each type starts out in a compact encoding and converts itself, once and
+    for good, to a structure with better complexity when it grows past the
+    configured limits. Every type keeps a running total of the bytes used by
+    its elements so memory accounting stays O(1) per update.
+    """
+
+    TYPE = None
+
+    def __init__(self):
+        self.payload = 0  # Bytes used by the elements themselves
+
+    def memory_usage(self):
+        return self.payload + sum(sys.getsizeof(part) for part in self._containers())
+
+    def _containers(self):
+        return ()
+
+    def freeze(self):
+        """Return a point-in-time copy that can be serialized later."""
+        return FrozenCollection(self.TYPE, self.dump())
+
+    @classmethod
+    def load(cls, data):
+        raise NotImplementedError
+
+    def dump(self):
+        raise NotImplementedError
+
+
+class FrozenCollection:
+    """Plain-data copy of a Collection taken for a snapshot."""
+
+    def __init__(self, type, data):
+        self.TYPE = type
+        self.data = data
+
+    def dump(self):
+        return self.data
+
+
+class Hash(Collection):
+    """Field -> value map.
+
+    Small hashes are a flat [field, value, field, value, ...] list; lookups
+    scan it, which is cheap at this size and avoids a dict per key. Larger
+    hashes, or ones with long values, use a dict.
+    """
+
+    TYPE = 'hash'
+
+    def __init__(self):
+        super().__init__()
+        self.listpack = []
+        self.table = None
+
+    @property
+    def encoding(self):
+        return 'listpack' if self.table is None else 'hashtable'
+
+    def _containers(self):
+        return (self.listpack if self.table is None else self.table,)
+
+    def __len__(self):
+        return len(self.listpack) // 2 if self.table is None else len(self.table)
+
+    def _find(self, field):
+        listpack = self.listpack
+        for i in range(0, len(listpack), 2):
+            if listpack[i] == field:
+                return i
+        return -1
+
+    def _convert(self):
+        listpack = self.listpack
+        self.table = dict(zip(listpack[::2], listpack[1::2]))
+        self.listpack = []
+
+    def get(self, field, default=None):
+        field = str(field)
+        if self.table is not None:
+            return self.table.get(field, default)
+        i = self._find(field)
+        return default if i < 0 else self.listpack[i + 1]
+
+    def _set(self, field, value):
+        """Set one field and return True if it is new."""
+        old = self.get(field, self)
+        if old is not self:
+            self.payload -= estimate_size(old)
+        else:
+            self.payload += estimate_size(field)
+        self.payload += estimate_size(value)
+        if self.table is None and (len(self) >= HASH_MAX_LISTPACK_ENTRIES and old is self
+                                   or not _is_small(field, HASH_MAX_LISTPACK_VALUE)
+                                   or not _is_small(value, HASH_MAX_LISTPACK_VALUE)):
+            self._convert()
+        if self.table is not None:
+            self.table[field] = value
+        elif old is self:
+            self.listpack += [field, value]
+        else:
+            self.listpack[self._find(field) + 1] = value
+        return old is self
+
+    def hset(self, *pairs):
+        """Set field/value pairs and return how many fields were added."""
+        if not pairs or len(pairs) % 2:
+            raise ValueError("hset needs field value pairs")
+        return sum(self._set(str(pairs[i]), pairs[i + 1]) for i in range(0, len(pairs), 2))
+
+    def hget(self, field):
+        return self.get(field)
+
+    def hmget(self, *fields):
+        return [self.get(field) for field in fields]
+
+    def hdel(self, *fields):
+        removed = 0
+        for field in map(str, fields):
+            if self.table is not None:
+                if field not in self.table:
+                    continue
+                value = self.table.pop(field)
+            else:
+                i = self._find(field)
+                if i < 0:
+                    continue
+                value = self.listpack[i + 1]
+                del self.listpack[i:i + 2]
+            self.payload -= estimate_size(field) + estimate_size(value)
+            removed += 1
+        return removed
+
+    def hexists(self, field):
+        return self.get(field, self) is not self
+
+    def hlen(self):
+        return len(self)
+
+    def hkeys(self):
+        return list(self.table) if self.table is not None else self.listpack[::2]
+
+    def hvals(self):
+        return list(self.table.values()) if self.table is not None else self.listpack[1::2]
+
+    def hgetall(self):
+        return dict(self.table) if self.table is not None else dict(zip(self.listpack[::2], self.listpack[1::2]))
+
+    def dump(self):
+        return self.hgetall()
+
+    @classmethod
+    def load(cls, data):
+        value = cls()
+        for field, item in data.items():
+            value._set(str(field), item)
+        return value
+
+
+class List(Collection):
+    """Sequence with O(1) pushes and pops at both ends.
+
+    Small lists are a plain list; past the limit they become a deque, which
+    never has to shift its elements.
+    """
+
+    TYPE = 'list'
+
+    def __init__(self):
+        super().__init__()
+        self.items = []
+
+    @property
+    def encoding(self):
+        return 'listpack' if isinstance(self.items, list) else 'quicklist'
+
+    def _containers(self):
+        return (self.items,)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _grow(self, values):
+        self.payload += sum(estimate_size(value) for value in values)
+        if isinstance(self.items, list) and len(self.items) + len(values) > LIST_MAX_LISTPACK_ENTRIES:
+            self.items = deque(self.items)
+
+    def lpush(self, *values):
+        """Insert values at the head, one after another, and return the new length."""
+        if not values:
+            raise ValueError("lpush needs at least one value")
+        self._grow(values)
+        if isinstance(self.items, list):
+            self.items[:0] = reversed(values)
+        else:
+            self.items.extendleft(values)
+        return len(self.items)
+
+    def rpush(self, *values):
+        """Append values at the tail and return the new length."""
+        if not values:
+            raise ValueError("rpush needs at least one value")
+        self._grow(values)
+        self.items.extend(values)
+        return len(self.items)
+
+    def _pop(self, left, count):
+        if count is None:
+            if not self.items:
+                return None
+            value = (self.items.pop(0) if isinstance(self.items, list) else self.items.popleft()) if left else self.items.pop()
+            self.payload -= estimate_size(value)
+            return value
+        return [self._pop(left, None) for _ in range(min(int(count), len(self.items)))]
+
+    def lpop(self, count=None):
+        """Remove and return the first element, or the first count elements as a list."""
+        return self._pop(True, count)
+
+    def rpop(self, count=None):
+        """Remove and return the last element, or the last count elements as a list."""
+        return self._pop(False, count)
+
+    def llen(self):
+        return len(self.items)
+
+    def lindex(self, index):
+        index = int(index)
+        if -len(self.items) <= index < len(self.items):
+            return self.items[index]
+        return None
+
+    def lset(self, index, value):
+        index = int(index)
+        if not -len(self.items) <= index < len(self.items):
+            raise IndexError("index out of range")
+        self.payload += estimate_size(value) - estimate_size(self.items[index])
+        self.items[index] = value
+        return "OK"
+
+    def lrange(self, start, stop):
+        """Return the elements from start to stop inclusive; negative indexes count from the end."""
+        indexes = _index_range(start, stop, len(self.items))
+        if isinstance(self.items, list):
+            return self.items[indexes.start:indexes.stop]
+        return list(islice(self.items, indexes.start, indexes.stop))
+
+    def ltrim(self, start, stop):
+        """Keep only the elements from start to stop inclusive."""
+        kept = self.lrange(start, stop)
+        self.payload = sum(estimate_size(value) for value in kept)
+        self.items = kept if isinstance(self.items, list) else deque(kept)
+        return "OK"
+
+    def dump(self):
+        return list(self.items)
+
+    @classmethod
+    def load(cls, data):
+        value = cls()
+        if data:
+            value.rpush(*data)
+        return value
+
+
+class Set(Collection):
+    """Unordered collection of unique members.
+
+    Sets holding only 64-bit integers are a sorted array (an intset), which
+    stores each member in 8 bytes and finds it by binary search. Adding any
+    other member, or growing past the limit, converts it to a Python set.
+    """
+
+    TYPE = 'set'
+
+    def __init__(self):
+        super().__init__()
+        self.intset = array('q')
+        self.table = None
+
+    @property
+    def encoding(self):
+        return 'intset' if self.table is None else 'hashtable'
+
+    def _containers(self):
+        return (self.intset if self.table is None else self.table,)
+
+    def __len__(self):
+        return len(self.intset) if self.table is None else len(self.table)
+
+    @staticmethod
+    def _is_int(member):
+        return type(member) is int and -2**63 <= member < 2**63
+
+    def _convert(self):
+        self.table = set(self.intset)
+        self.payload = sum(estimate_size(member) for member in self.table)
+        self.intset = array('q')
+
+    def __contains__(self, member):
+        if self.table is not None:
+            return member in self.table
+        if not self._is_int(member):
+            return False
+        i = bisect.bisect_left(self.intset, member)
+        return i < len(self.intset) and self.intset[i] == member
+
+    def sadd(self, *members):
+        """Add members and return how many were not already present."""
+        if not members:
+            raise ValueError("sadd needs at least one member")
+        hash(members)  # Reject unhashable members before changing anything
+        added = 0
+        for member in members:
+            if member in self:
+                continue
+            if self.table is None and (not self._is_int(member) or len(self.intset) >= SET_MAX_INTSET_ENTRIES):
+                self._convert()
+            if self.table is None:
+                self.intset.insert(bisect.bisect_left(self.intset, member), member)
+            else:
+                self.table.add(member)
+                self.payload += estimate_size(member)
+            added += 1
+        return added
+
+    def srem(self, *members):
+        removed = 0
+        for member in members:
+            if member not in self:
+                continue
+            if self.table is None:
+                del self.intset[bisect.bisect_left(self.intset, member)]
+            else:
+                self.table.remove(member)
+                self.payload -= estimate_size(member)
+            removed += 1
+        return removed
+
+    def sismember(self, member):
+        return member in self
+
+    def scard(self):
+        return len(self)
+
+    def smembers(self):
+        return list(self.intset) if self.table is None else list(self.table)
+
+    def dump(self):
+        return self.smembers()
+
+    @classmethod
+    def load(cls, data):
+        value = cls()
+        if data:
+            value.sadd(*data)
+        return value
+
+
+class SkipListNode:
+    __slots__ = ('member', 'score', 'forward', 'span', 'backward')
+
+    def __init__(self, member, score, level):
+        self.member = member
+        self.score = score
+        self.forward = [None] * level
+        self.span = [0] * level  # Number of nodes each forward link skips over
+        self.backward = None
+
+
+class SkipList:
+    """Members ordered by (score, member), with O(log n) insert, delete and rank.
+
+    Every forward link records how many nodes it spans, so the rank of a
+    member and the member at a rank are found on the way down the levels.
+    """
+
+    MAX_LEVEL = 32
+    P = 0.25
+
+    def __init__(self):
+        self.header = SkipListNode(None, None, self.MAX_LEVEL)
+        self.tail = None
+        self.level = 1
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def _random_level(self):
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < self.P:
+            level += 1
+        return level
+
+    def insert(self, score, member):
+        """Insert a member that is not already present."""
+        update = [None] * self.MAX_LEVEL
+        rank = [0] * self.MAX_LEVEL
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            rank[i] = 0 if i == self.level - 1 else rank[i + 1]
+            while x.forward[i] and (x.forward[i].score, x.forward[i].member) < (score, member):
+                rank[i] += x.span[i]
+                x = x.forward[i]
+            update[i] = x
+        level = self._random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                rank[i] = 0
+                update[i] = self.header
+                update[i].span[i] = self.length
+            self.level = level
+        x = SkipListNode(member, score, level)
+        for i in range(level):
+            x.forward[i] = update[i].forward[i]
+            update[i].forward[i] = x
+            x.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = rank[0] - rank[i] + 1
+        for i in range(level, self.level):
+            update[i].span[i] += 1
+        x.backward = None if update[0] is self.header else update[0]
+        if x.forward[0]:
+            x.forward[0].backward = x
+        else:
+            self.tail = x
+        self.length += 1
+
+    def delete(self, score, member):
+        """Remove a member with the given score; returns False if it is not there."""
+        update = [None] * self.MAX_LEVEL
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while x.forward[i] and (x.forward[i].score, x.forward[i].member) < (score, member):
+                x = x.forward[i]
+            update[i] = x
+        x = x.forward[0]
+        if x is None or x.score != score or x.member != member:
+            return False
+        for i in range(self.level):
+            if update[i].forward[i] is x:
+                update[i].span[i] += x.span[i] - 1
+                update[i].forward[i] = x.forward[i]
+            else:
+                update[i].span[i] -= 1
+        if x.forward[0]:
+            x.forward[0].backward = x.backward
+        else:
+            self.tail = x.backward
+        while self.level > 1 and self.header.forward[self.level - 1] is None:
+            self.level -= 1
+        self.length -= 1
+        return True
+
+    def rank(self, score, member):
+        """Return the 0-based rank of a member, or None."""
+        traversed = 0
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while x.forward[i] and (x.forward[i].score, x.forward[i].member) <= (score, member):
+                traversed += x.span[i]
+                x = x.forward[i]
+            if x is not self.header and x.member == member:
+                return traversed - 1
+        return None
+
+    def node_at(self, rank):
+        """Return the node at a 0-based rank, or None."""
+        traversed = 0
+        x = self.header
+        rank += 1
+        for i in range(self.level - 1, -1, -1):
+            while x.forward[i] and traversed + x.span[i] <= rank:
+                traversed += x.span[i]
+                x = x.forward[i]
+            if traversed == rank:
+                return x
+        return None
+
+    def first_at_least(self, score):
+        """Return the first node whose score is >= score, or None."""
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while x.forward[i] and x.forward[i].score < score:
+                x = x.forward[i]
+        return x.forward[0]
+
+    def __iter__(self):
+        x = self.header.forward[0]
+        while x:
+            yield x.score, x.member
+            x = x.forward[0]
+
+
+class SortedSet(Collection):
+    """Unique string members ordered by a float score.
+
+    Small sorted sets are a sorted list of (score, member) tuples searched
+    with bisect. Larger ones pair a member -> score dict with a SkipList, so
+    updates, ranks and range queries are O(log n).
+    """
+
+    TYPE = 'zset'
+    # Rough size of a SkipListNode with its two level lists
+    NODE_SIZE = 200
+
+    def __init__(self):
+        super().__init__()
+        self.listpack = []
+        self.scores = None
+        self.skiplist = None
+
+    @property
+    def encoding(self):
+        return 'listpack' if self.skiplist is None else 'skiplist'
+
+    def _containers(self):
+        return (self.listpack,) if self.skiplist is None else (self.scores,)
+
+    def memory_usage(self):
+        size = super().memory_usage()
+        if self.skiplist is not None:
+            size += self.NODE_SIZE * len(self.skiplist)
+        return size
+
+    def __len__(self):
+        return len(self.listpack) if self.skiplist is None else len(self.skiplist)
+
+    def _convert(self):
+        self.scores = {}
+        self.skiplist = SkipList()
+        for score, member in self.listpack:
+            self.scores[member] = score
+            self.skiplist.insert(score, member)
+        self.listpack = []
+
+    def score(self, member):
+        if self.skiplist is not None:
+            return self.scores.get(member)
+        for score, item in self.listpack:
+            if item == member:
+                return score
+        return None
+
+    def _add(self, score, member):
+        """Insert or re-score a member and return True if it is new."""
+        old = self.score(member)
+        if old is not None:
+            if old == score:
+                return False
+            self._remove(old, member)
+        if self.skiplist is None and (len(self.listpack) >= ZSET_MAX_LISTPACK_ENTRIES
+                                      or len(member) > ZSET_MAX_LISTPACK_VALUE):
+            self._convert()
+        if self.skiplist is None:
+            bisect.insort(self.listpack, (score, member))
+        else:
+            self.scores[member] = score
+            self.skiplist.insert(score, member)
+        self.payload += estimate_size(member) + estimate_size(score)
+        return old is None
+
+    def _remove(self, score, member):
+        if self.skiplist is None:
+            del self.listpack[bisect.bisect_left(self.listpack, (score, member))]
+        else:
+            del self.scores[member]
+            self.skiplist.delete(score, member)
+        self.payload -= estimate_size(member) + estimate_size(score)
+
+    @staticmethod
+    def _parse_score(score):
+        try:
+            score = float(score)
+        except (TypeError, ValueError):
+            raise ValueError("score is not a valid float") from None
+        if score != score:
+            raise ValueError("score is not a valid float")
+        return score
+
+    def zadd(self, *pairs):
+        """Add score/member pairs and return how many members were added."""
+        if not pairs or len(pairs) % 2:
+            raise ValueError("zadd needs score member pairs")
+        parsed = [(self._parse_score(pairs[i]), str(pairs[i + 1])) for i in range(0, len(pairs), 2)]
+        return sum(self._add(score, member) for score, member in parsed)
+
+    def zincrby(self, increment, member):
+        """Add increment to a member's score (0 if absent) and return the new score."""
+        member = str(member)
+        score = (self.score(member) or 0.0) + self._parse_score(increment)
+        self._add(score, member)
+        return score
+
+    def zrem(self, *members):
+        removed = 0
+        for member in map(str, members):
+            score = self.score(member)
+            if score is not None:
+                self._remove(score, member)
+                removed += 1
+        return removed
+
+    def zscore(self, member):
+        return self.score(str(member))
+
+    def zcard(self):
+        return len(self)
+
+    def zrank(self, member):
+        """Return the 0-based position of member in score order, or None."""
+        member = str(member)
+        score = self.score(member)
+        if score is None:
+            return None
+        if self.skiplist is None:
+            return bisect.bisect_left(self.listpack, (score, member))
+        return self.skiplist.rank(score, member)
+
+    def _entries(self, indexes):
+        if self.skiplist is None:
+            return self.listpack[indexes.start:indexes.stop]
+        entries = []
+        node = self.skiplist.node_at(indexes.start) if indexes else None
+        while node is not None and len(entries) < len(indexes):
+            entries.append((node.score, node.member))
+            node = node.forward[0]
+        return entries
+
+    @staticmethod
+    def _format(entries, withscores):
+        if withscores:
+            return [[member, score] for score, member in entries]
+        return [member for _, member in entries]
+
+    def zrange(self, start, stop, withscores=False):
+        """Return members by rank from start to stop inclusive; negative ranks count from the end."""
+        return self._format(self._entries(_index_range(start, stop, len(self))), withscores)
+
+    def zrangebyscore(self, min_score, max_score, withscores=False):
+        """Return the members with min_score <= score <= max_score, in order."""
+        min_score = self._parse_score(min_score)
+        max_score = self._parse_score(max_score)
+        entries = []
+        if self.skiplist is None:
+            i = bisect.bisect_left(self.listpack, (min_score,))
+            while i < len(self.listpack) and self.listpack[i][0] <= max_score:
+                entries.append(self.listpack[i])
+                i += 1
+        else:
+            node = self.skiplist.first_at_least(min_score)
+            while node is not None and node.score <= max_score:
+                entries.append((node.score, node.member))
+                node = node.forward[0]
+        return self._format(entries, withscores)
+
+    def zcount(self, min_score, max_score):
+        return len(self.zrangebyscore(min_score, max_score))
+
+    def dump(self):
+        return self.zrange(0, -1, True)
+
+    @classmethod
+    def load(cls, data):
+        value = cls()
+        for member, score in data:
+            value._add(float(score), str(member))
+        return value
+
+
+TYPES = {cls.TYPE: cls for cls in (Hash, List, Set, SortedSet)}
+
+# Command -> (type, whether it modifies the value). The command name is also
+# the method that implements it.
+COMMANDS = {
+    'hset': (Hash, True), 'hdel': (Hash, True), 'hget': (Hash, False), 'hmget': (Hash, False),
+    'hgetall': (Hash, False), 'hkeys': (Hash, False), 'hvals': (Hash, False),
+    'hlen': (Hash, False), 'hexists': (Hash, False),
+    'lpush': (List, True), 'rpush': (List, True), 'lpop': (List, True), 'rpop': (List, True),
+    'lset': (List, True), 'ltrim': (List, True), 'lrange': (List, False),
+    'lindex': (List, False), 'llen': (List, False),
+    'sadd': (Set, True), 'srem': (Set, True), 'smembers': (Set, False),
+    'sismember': (Set, False), 'scard': (Set, False),
+    'zadd': (SortedSet, True), 'zincrby': (SortedSet, True), 'zrem': (SortedSet, True),
+    'zscore': (SortedSet, False), 'zrank': (SortedSet, False), 'zrange': (SortedSet, False),
+    'zrangebyscore': (SortedSet, False), 'zcount': (SortedSet, False), 'zcard': (SortedSet, False),
+}
+
+WRITE_COMMANDS = frozenset(name for name, (_, write) in COMMANDS.items() if write)
+
+
+def is_collection(value):
+    return isinstance(value, (Collection, FrozenCollection))
+
+
+def dump_value(value):
+    """JSON-compatible form of a Collection or FrozenCollection."""
+    return {"type": value.TYPE, "data": value.dump()}
+
+
+def load_value(dumped):
+    """Rebuild a Collection from the output of dump_value()."""
+    cls = TYPES.get(dumped.get("type"))
+    if cls is None:
+        raise ValueError(f"Unknown data type {dumped.get('type')!r}")
+    return cls.load(dumped["data"])
\ No newline at end of file
@@ -1,87 +1,910 @@
 #db.py
+import itertools
+import math
+import random
+import threading
 import time
+import weakref
+from contextlib import contextmanager
+from ttl import TTL
+from scan import KeyIndex, compile_pattern
+from eviction import MemoryCounter, MemoryManager, OutOfMemoryError
+from datatypes import Collection, COMMANDS, WrongTypeError
+from cache import LRUCache
+from spill import COLD, SpillFile
+from cdc import ChangeLog
+from lazyfree import Reclaimer
+from config import (DB_LOCK_STRIPES, MAXMEMORY, MAXMEMORY_POLICY, MAXMEMORY_SAMPLES, MAXMEMORY_STRIPE_SAMPLES,
+                    HOT_TIER_KEYS, SPILL_DIR, LAZYFREE)
+from log import get_logger
+
+logger = get_logger('db')
+
+class Stripe:
+    """One partition of the keyspace and the lock that guards it.
+
+    Every structure here only holds keys that hash to this stripe, so
+    operations on keys in different stripes never contend.
+    """
+
+    def __init__(self, memory):
+        self.lock = threading.RLock()
+        self.ttl = TTL()
+        self.key_index = KeyIndex()
+        self.memory = memory
+        self.collections = set()  # Keys holding a hash, list, set or sorted set
+        self.expired = 0  # Keys removed because their TTL passed
+        self.versions = {}  # key -> version, changed on every write to the key
+        # Start from the clock so versions handed out before a restart are not reused
+        self.next_version = itertools.count(time.time_ns())
+        # Tiered storage, when enabled: recently used keys, and where the others' values are
+        self.hot = None  # LRUCache of the keys whose values are in RAM
+        self.cold = {}  # key -> location in spill of a value that is not in RAM
+        self.spill = None  # SpillFile
+        self.promoted = 0  # Values read back into RAM
+
+
+class PendingSnapshot:
+    """Collections a snapshot in progress has yet to copy.
+
+    Collections are modified in place, so a snapshot does not copy them up
+    front: it records them here, and whoever gets to one first copies it,
+    either the snapshot as it reaches the key or a write that is about to
+    change it. A collection that leaves the keyspace before either happens
+    never changes again and is kept as it is.
+    """
 
-class InMemoryDB:
     def __init__(self):
+        self.lock = threading.Lock()
+        self.owned = {}  # id(collection) -> (key, collection), not copied yet
+        self.copies = {}  # key -> FrozenCollection, or a collection no longer in the keyspace
+        self.retained = []  # Structures dropped by a lazy flush while the snapshot still reads them
+
+    def preserve(self, value):
+        """Copy value for the snapshot if it still waits for one, before it is modified."""
+        with self.lock:
+            entry = self.owned.pop(id(value), None)
+            if entry is not None:
+                self.copies[entry[0]] = value.freeze()
+
+    def detach(self, value):
+        """Keep value for the snapshot if it still waits for one. Returns whether it did."""
+        with self.lock:
+            entry = self.owned.pop(id(value), None)
+            if entry is None:
+                return False
+            self.copies[entry[0]] = value
+            return True
+
+    def take(self, key, value):
+        """The snapshot's copy of the collection value held by key at the time of the snapshot."""
+        with self.lock:
+            copy = self.copies.pop(key, None)
+            if copy is None:
+                self.owned.pop(id(value), None)
+                copy = value.freeze()
+        return copy.freeze() if isinstance(copy, Collection) else copy
+
+
+class InMemoryDB:
+    """Thread-safe key-value store with lock striping.
+
+    Keys are spread over a fixed number of stripes by hash. A stripe's lock
+    is held for the whole of any operation on one of its keys, so
+    check-then-act sequences such as lazy expiry are atomic without
+    serializing unrelated keys. The value dict itself is shared; individual
+    dict operations are thread-safe on their own, including on free-threaded
+    builds, and every compound update happens under the key's stripe lock.
+    Operations that span keys take the stripe locks in index order via
+    atomic(), which rules out deadlocks.
+
+    With hot_keys set, only that many recently used values stay in RAM. A
+    value that drops out of a stripe's hot tier is written to the stripe's
+    spill file and replaced in the dict by COLD; reading it decodes it from
+    the mapped file and makes it hot again. Keys, TTLs and the other indexes
+    always stay in RAM.
+
+    With lazyfree set, large values that are deleted, expired, evicted or
+    overwritten are unlinked at once and freed by a background Reclaimer,
+    so the request that dropped them does not wait for the deallocation.
+    """
+
+    # Keys expired per batch in expire_due() between time budget checks
+    EXPIRE_BATCH = 64
+
+    def __init__(self, stripes=DB_LOCK_STRIPES, maxmemory=MAXMEMORY, policy=MAXMEMORY_POLICY,
+                 hot_keys=HOT_TIER_KEYS, spill_dir=SPILL_DIR, lazyfree=LAZYFREE):
         self.data = {}
-        self.ttl_data = {}
+        self.maxmemory = maxmemory
+        self.memory_counter = MemoryCounter()  # Bytes used by every stripe together
+        self.stripe_samples = min(MAXMEMORY_STRIPE_SAMPLES, stripes)  # Stripes asked for an eviction candidate
+        samples = max(1, -(-MAXMEMORY_SAMPLES // self.stripe_samples))  # Spread the LFU samples over them
+        self.stripes = [Stripe(MemoryManager(policy, samples, counter=self.memory_counter)) for _ in range(stripes)]
+        self.next_expire_stripe = 0
         self.observers = []  # For observer pattern to notify of changes
-        
+        self.changes = ChangeLog()  # Every change, for consumers that follow on their own threads
+        self.lazyfree = lazyfree
+        self.reclaimer = Reclaimer()  # Frees large values off the request path
+        self.snapshots = ()  # PendingSnapshots in progress, replaced as a whole when one starts or ends
+        self.snapshots_lock = threading.RLock()
+        self.hot_keys = hot_keys
+        self.spill_dir = spill_dir
+        if hot_keys:
+            for stripe in self.stripes:
+                self._tier(stripe)
+
+    def _tier(self, stripe):
+        """Give a stripe an empty hot tier and spill file."""
+        stripe.hot = LRUCache(max(1, self.hot_keys // len(self.stripes)),
+                              on_evict=lambda key, _: self._spill(stripe, key))
+        stripe.cold = {}
+        stripe.spill = SpillFile(self.spill_dir)
+
     def add_observer(self, observer):
         """Add an observer that will be notified of data changes."""
         if observer not in self.observers:
             self.observers.append(observer)
-            
+
     def remove_observer(self, observer):
         """Remove an observer."""
         if observer in self.observers:
             self.observers.remove(observer)
-            
+
     def notify_observers(self, operation, key, value=None):
-        """Notify all observers of a change."""
+        """Notify all observers of a change, and append it to the change log.
+
+        Called with the key's stripe lock held, so observers see the changes
+        to any one key in the order they were applied. Batch operations are
+        reported once per batch as "mset", "mdelete" or "mexpire" with key
+        None, and clear() once as "clear" with the number of keys removed.
+        Observers run inline and add to the write's latency; anything that
+        can lag behind the writes should follow self.changes instead.
+        """
         for observer in self.observers:
             observer(operation, key, value)
+        self.changes.append(operation, key, value)
+
+    def stripe_for(self, key):
+        return self.stripes[hash(key) % len(self.stripes)]
+
+    @contextmanager
+    def atomic(self, keys=None):
+        """Hold the locks for every stripe the keys map to (all stripes if keys is None).
+
+        Everything done on those keys inside the block is atomic with respect
+        to other clients.
+        """
+        if keys is None:
+            stripes = self.stripes
+        else:
+            count = len(self.stripes)
+            stripes = [self.stripes[index] for index in sorted({hash(key) % count for key in keys})]
+        for stripe in stripes:
+            stripe.lock.acquire()
+        try:
+            yield
+        finally:
+            for stripe in reversed(stripes):
+                stripe.lock.release()
+
+    @contextmanager
+    def fork_guard(self):
+        """Hold every lock snapshot() takes, so a child forked inside the block can take them.
+
+        A child process inherits locks in whatever state the parent's other
+        threads left them; holding them all around fork() means the forking
+        thread, the only one the child keeps, owns them instead.
+        """
+        with self.atomic(), self.snapshots_lock:
+            yield
 
     def get(self, key):
         """Get a value from the database."""
-        current_time = time.time()
-        if key in self.ttl_data:
-            if self.ttl_data[key] < current_time:
-                # Key has expired
-                print(f"Key '{key}' has expired and is being removed")
-                del self.data[key]
-                del self.ttl_data[key]
-                self.notify_observers("expire", key)
-                return None
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            current_time = time.time()
+            expire_at = stripe.ttl.get(key)
+            if expire_at is not None:
+                if expire_at < current_time:
+                    # Key has expired
+                    logger.debug("Key '%s' has expired and is being removed", key)
+                    self._expire(stripe, key)
+                    return None
+                else:
+                    # Show remaining TTL if the key has one
+                    logger.debug("Key '%s' TTL: %d seconds remaining", key, expire_at - current_time)
+            if stripe.memory.tracks_access and key in self.data:
+                stripe.memory.touch(key)
+            value = self.data.get(key, None)
+            if stripe.hot is not None and value is not None:
+                if value is COLD:
+                    return self._warm(stripe, key)
+                stripe.hot.touch(key)
+            return value
+
+    def _lookup(self, stripe, key):
+        """Return the value of key, removing it first if it has expired.
+
+        The caller must hold the stripe lock.
+        """
+        if stripe.ttl.is_expired(key):
+            self._expire(stripe, key)
+            return None
+        value = self.data.get(key)
+        if stripe.hot is not None and value is not None:
+            if value is COLD:
+                return self._warm(stripe, key)
+            stripe.hot.touch(key)
+        return value
+
+    def _expire(self, stripe, key):
+        """Remove a key whose TTL has passed. The caller must hold the stripe lock."""
+        self._remove(stripe, key)
+        stripe.expired += 1
+        self.notify_observers("expire", key)
+
+    def command(self, action, key, args=()):
+        """Run a data type command such as hset, lpush or zadd on key.
+
+        A read on a missing key behaves as on an empty value and a write
+        creates the key; a collection left empty by a write is deleted. Only
+        the affected elements are touched, never the whole value. Raises
+        WrongTypeError if key holds a different type. Writes are reported to
+        observers with the command as the operation and args as the value.
+        """
+        cls, write = COMMANDS[action]
+        if write:
+            self.make_room()
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            value = self._lookup(stripe, key)
+            exists = value is not None
+            if not exists:
+                value = cls()
+            elif not isinstance(value, cls):
+                raise WrongTypeError()
+            if write:
+                for snapshot in self.snapshots:
+                    snapshot.preserve(value)
+            result = getattr(value, action)(*args)
+            if not write:
+                if exists and stripe.memory.tracks_access:
+                    stripe.memory.touch(key)
+                return result
+            if len(value):
+                if not exists:
+                    self.data[key] = value
+                    stripe.key_index.add(key)
+                    stripe.collections.add(key)
+                    if stripe.hot is not None:
+                        self._heat(stripe, key)
+                stripe.memory.on_write(key, value)
+                stripe.versions[key] = next(stripe.next_version)
+            elif exists:
+                self._remove(stripe, key)
             else:
-                # Show remaining TTL if the key has one
-                remaining = int(self.ttl_data[key] - current_time)
-                print(f"Key '{key}' TTL: {remaining} seconds remaining")
-        return self.data.get(key, None)
-    
+                # Nothing was stored, e.g. a pop from a missing list
+                return result
+            self.notify_observers(action, key, list(args))
+        return result
+
+    def key_type(self, key):
+        """Return (type, encoding) for the value of key, or ("none", None)."""
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            value = self._lookup(stripe, key)
+        if value is None:
+            return "none", None
+        if isinstance(value, Collection):
+            return value.TYPE, value.encoding
+        return "string", "raw"
+
+    def expiry(self, key):
+        """Return the absolute expiry time of key, or None if it has no TTL."""
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            return stripe.ttl.get(key)
+
     def set(self, key, value, ttl=None):
         """Set a value in the database."""
+        self.make_room()
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            if ttl is not None:
+                expiry_time = time.time() + ttl
+                self._store(stripe, key, value, expiry_time)
+                logger.debug("Set TTL for key '%s': expires in %s seconds", key, ttl)
+            else:
+                self._store(stripe, key, value)
+            self.notify_observers("set", key, value)
+        return True
+
+    def _store(self, stripe, key, value, expire_at=None):
+        """Write key without notifying observers. The caller must hold the stripe lock."""
+        old = None
+        if self.lazyfree:
+            old = self.data.get(key)
+            old_size = stripe.memory.sizes.get(key, 0)
         self.data[key] = value
-        if ttl is not None:
-            expiry_time = time.time() + ttl
-            self.ttl_data[key] = expiry_time
-            expiry_datetime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(expiry_time))
-            print(f"Set TTL for key '{key}': expires at {expiry_datetime} ({ttl} seconds)")
+        stripe.key_index.add(key)
+        stripe.memory.on_write(key, value)
+        stripe.versions[key] = next(stripe.next_version)
+        if isinstance(value, Collection):
+            stripe.collections.add(key)
         else:
-            self.ttl_data.pop(key, None)
+            stripe.collections.discard(key)
+        if expire_at is not None:
+            stripe.ttl.set_expiry(key, expire_at)
+        else:
+            stripe.ttl.delete_ttl(key)
+        if stripe.hot is not None:
+            self._heat(stripe, key)
+        if old is not None and old is not value:
+            self._release(old, old_size)
+
+    def load_items(self, items, now=None):
+        """Store (key, value, expire_at) items in bulk, as when loading saved data.
+
+        Much cheaper per key than set(): the stripe locks are taken once for
+        the whole batch, observers are not notified, and the TTL heaps are
+        rebuilt once at the end. When a key occurs more than once, its last
+        item wins. An item whose expiry has passed is skipped, and removes
+        the key if it exists. Eviction runs once, afterwards. Returns
+        (stored, expired) counts.
+        """
+        now = time.time() if now is None else now
+        data = self.data
+        stripes = self.stripes
+        count = len(stripes)
+        loaded_ttls = set()  # Stripes whose TTL heap has to be rebuilt
+        stored = expired = 0
+        with self.atomic():
+            for key, value, expire_at in items:
+                stripe = stripes[hash(key) % count]
+                if expire_at is not None and expire_at <= now:
+                    if key in data:
+                        self._remove(stripe, key)
+                    expired += 1
+                    continue
+                stored += 1
+                if key in data:
+                    self._store(stripe, key, value, expire_at)
+                    continue
+                # A new key needs none of the cleanup _store() does
+                data[key] = value
+                stripe.key_index.add(key)
+                stripe.memory.on_write(key, value)
+                stripe.versions[key] = next(stripe.next_version)
+                if isinstance(value, Collection):
+                    stripe.collections.add(key)
+                if expire_at is not None:
+                    stripe.ttl.load_expiry(key, expire_at)
+                    loaded_ttls.add(stripe)
+                if stripe.hot is not None:
+                    stripe.hot.set(key, None)
+            for stripe in loaded_ttls:
+                stripe.ttl.compact()
+        self.make_room()
+        return stored, expired
+
+    def gets(self, key):
+        """Return (value, version) for key; the version is 0 for a missing key.
+
+        The version changes on every write to the key, so it can be passed
+        to cas() to update the key only if nobody else has written it since.
+        """
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            value = self.get(key)
+            return value, stripe.versions.get(key, 0)
+
+    def _replace(self, stripe, key, value, expire_at=None):
+        """Store value and notify observers. The caller must hold the stripe lock."""
+        self._store(stripe, key, value, expire_at)
         self.notify_observers("set", key, value)
-        return True     
+
+    @staticmethod
+    def _parse_number(value, what="value"):
+        """Return value as an int or a float, converting strings that hold a number."""
+        if isinstance(value, Collection):
+            raise WrongTypeError()
+        if isinstance(value, str):
+            try:
+                value = int(value)
+            except ValueError:
+                try:
+                    value = float(value)
+                except ValueError:
+                    raise ValueError(f"{what} is not a number") from None
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"{what} is not a number")
+        return value
+
+    def incr(self, key, amount=1):
+        """Atomically add amount to the number at key (0 if missing) and return the result.
+
+        Numbers are stored natively: integers stay integers, and a float on
+        either side gives a float. A string holding a number is converted on
+        the first increment. The key keeps its TTL.
+        """
+        amount = self._parse_number(amount, "increment")
+        self.make_room()
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            current = self._lookup(stripe, key)
+            result = (0 if current is None else self._parse_number(current)) + amount
+            if not math.isfinite(result):
+                raise ValueError("increment would produce NaN or Infinity")
+            self._replace(stripe, key, result, stripe.ttl.get(key))
+        return result
+
+    def decr(self, key, amount=1):
+        """Atomically subtract amount from the number at key and return the result."""
+        return self.incr(key, -self._parse_number(amount, "decrement"))
+
+    def append(self, key, suffix):
+        """Atomically append a string to the value at key and return the new length.
+
+        A missing key counts as an empty string and a number as its text.
+        The key keeps its TTL.
+        """
+        if not isinstance(suffix, str):
+            raise ValueError("appended value must be a string")
+        self.make_room()
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            current = self._lookup(stripe, key)
+            if current is None:
+                current = ""
+            elif isinstance(current, Collection):
+                raise WrongTypeError()
+            elif isinstance(current, (int, float)) and not isinstance(current, bool):
+                current = str(current)
+            elif not isinstance(current, str):
+                raise ValueError("value is not a string")
+            value = current + suffix
+            self._replace(stripe, key, value, stripe.ttl.get(key))
+        return len(value)
+
+    def getset(self, key, value):
+        """Atomically set key to value and return the old value. Any TTL is cleared."""
+        self.make_room()
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            old = self._lookup(stripe, key)
+            if isinstance(old, Collection):
+                raise WrongTypeError()
+            self._replace(stripe, key, value)
+        return old
+
+    def setnx(self, key, value, ttl=None):
+        """Set key only if it does not exist. Returns True if it was set."""
+        self.make_room()
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            if self._lookup(stripe, key) is not None:
+                return False
+            self._replace(stripe, key, value, None if ttl is None else time.time() + ttl)
+        return True
+
+    def setxx(self, key, value, ttl=None):
+        """Set key only if it already exists. Returns True if it was set."""
+        self.make_room()
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            if self._lookup(stripe, key) is None:
+                return False
+            self._replace(stripe, key, value, None if ttl is None else time.time() + ttl)
+        return True
+
+    def cas(self, key, version, value, ttl=None):
+        """Set key only if its version is still version (0: only if it does not exist).
+
+        Returns (True, new version) on success and (False, current version)
+        if the key was written in the meantime.
+        """
+        self.make_room()
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            current = 0 if self._lookup(stripe, key) is None else stripe.versions[key]
+            if current != version:
+                return False, current
+            self._replace(stripe, key, value, None if ttl is None else time.time() + ttl)
+            return True, stripe.versions[key]
+
+    def mget(self, keys):
+        """Get several values at once, in the order of keys.
+
+        Missing keys, and keys holding a collection, give None.
+        """
+        with self.atomic(keys):
+            values = [self.get(key) for key in keys]
+        return [None if isinstance(value, Collection) else value for value in values]
+
+    def mset(self, items, ttl=None):
+        """Set several keys atomically.
+
+        items is a dict or an iterable of (key, value) pairs; with ttl every
+        key expires after ttl seconds. Observers are notified once for the
+        whole batch with an "mset" operation whose value is a list of
+        (key, value, expire_at) tuples.
+        """
+        items = list(items.items() if isinstance(items, dict) else items)
+        if not items:
+            return True
+        self.make_room()
+        expire_at = None if ttl is None else time.time() + ttl
+        with self.atomic([key for key, _ in items]):
+            for key, value in items:
+                self._store(self.stripe_for(key), key, value, expire_at)
+            self.notify_observers("mset", None, [(key, value, expire_at) for key, value in items])
+        return True
+
+    def mdelete(self, keys, lazy=None):
+        """Delete several keys atomically.
+
+        Returns a list telling for each key whether it existed. Observers are
+        notified once with an "mdelete" operation listing the deleted keys.
+        lazy overrides the lazyfree setting for these keys.
+        """
+        deleted = []
+        removed = []
+        with self.atomic(keys):
+            for key in keys:
+                if key in self.data:
+                    self._remove(self.stripe_for(key), key, lazy)
+                    removed.append(key)
+                    deleted.append(True)
+                else:
+                    deleted.append(False)
+            if removed:
+                self.notify_observers("mdelete", None, removed)
+        return deleted
+
+    def mexpire(self, keys, ttl):
+        """Give several existing keys a TTL of ttl seconds, atomically.
+
+        Returns a list telling for each key whether it existed. Observers
+        are notified once with an "mexpire" operation whose value is a list
+        of (key, expire_at) tuples.
+        """
+        now = time.time()
+        expire_at = now + ttl
+        updated = []
+        changed = []
+        with self.atomic(keys):
+            for key in keys:
+                stripe = self.stripe_for(key)
+                if key in self.data and not stripe.ttl.is_expired(key, now):
+                    stripe.ttl.set_expiry(key, expire_at)
+                    changed.append((key, expire_at))
+                    updated.append(True)
+                else:
+                    updated.append(False)
+            if changed:
+                self.notify_observers("mexpire", None, changed)
+        return updated
 
     def delete(self, key):
         """Delete a key from the database."""
-        if key in self.data:
-            del self.data[key]
-            self.ttl_data.pop(key, None)
-            self.notify_observers("delete", key)
-            return True
-        return False
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            if key in self.data:
+                self._remove(stripe, key)
+                self.notify_observers("delete", key)
+                return True
+            return False
+
+    def _remove(self, stripe, key, lazy=None):
+        """Drop key and its bookkeeping without notifying observers.
+
+        The caller must hold the stripe lock. A large value is freed in the
+        background if lazy, which defaults to the lazyfree setting, is true.
+        """
+        value = self.data.pop(key, None)
+        stripe.ttl.delete_ttl(key)
+        stripe.key_index.remove(key)
+        size = stripe.memory.on_delete(key)
+        stripe.collections.discard(key)
+        stripe.versions.pop(key, None)
+        if stripe.hot is not None:
+            stripe.hot.delete(key)
+            location = stripe.cold.pop(key, None)
+            if location is not None:
+                stripe.spill.free(location)
+        if (self.lazyfree if lazy is None else lazy) and value is not None:
+            self._release(value, size)
+
+    def _release(self, value, size):
+        """Hand a large value that has left the keyspace to the reclaimer.
+
+        A collection is only ever referred to by the store, as commands never
+        give it out, so the reclaimer takes it apart, unless a snapshot still
+        has to copy it. Other values may have been returned by get(); the
+        reclaimer only drops them.
+        """
+        if not self.reclaimer.worth_it(value):
+            return
+        if isinstance(value, Collection):
+            for snapshot in self.snapshots:
+                if snapshot.detach(value):
+                    return
+        self.reclaimer.release(value, size)
+
+    def _warm(self, stripe, key):
+        """Bring the value of a cold key back into RAM and return it. The caller must hold the stripe lock."""
+        location = stripe.cold.pop(key)
+        value = stripe.spill.read(location)
+        stripe.spill.free(location)
+        self.data[key] = value
+        stripe.memory.on_resize(key, value)
+        stripe.promoted += 1
+        stripe.hot.set(key, None)
+        return value
+
+    def _heat(self, stripe, key):
+        """Count a write of key in the hot tier, whose new value is already in the dict.
+
+        The caller must hold the stripe lock.
+        """
+        location = stripe.cold.pop(key, None)
+        if location is not None:
+            stripe.spill.free(location)
+        stripe.hot.set(key, None)
+
+    def _spill(self, stripe, key):
+        """Move the value of a key the hot tier dropped to the stripe's spill file."""
+        stripe.cold[key] = stripe.spill.write(self.data[key])
+        self.data[key] = COLD
+        stripe.memory.on_resize(key, COLD)
+
+    def compact_spill(self):
+        """Rewrite the spill files that are mostly garbage. Returns how many were compacted.
+
+        Each one is rewritten under its stripe's lock, so only that stripe's
+        keys wait, for as long as it takes to copy its live values.
+        """
+        compacted = 0
+        for stripe in self.stripes:
+            if stripe.spill is not None and stripe.spill.needs_compaction():
+                with stripe.lock:
+                    stripe.spill = stripe.spill.compact(stripe.cold)
+                compacted += 1
+        return compacted
+
+    def used_memory(self):
+        return self.memory_counter.used
+
+    def make_room(self):
+        """Evict keys until memory use is back under the maxmemory limit.
+
+        Called before every write, without holding any stripe lock. Each
+        eviction takes the best candidate of a few random stripes, so only
+        their locks are taken. Raises OutOfMemoryError if the limit is
+        reached and the eviction policy has nothing it may evict.
+        """
+        if not self.maxmemory:
+            return
+        while self.memory_counter.used > self.maxmemory:
+            best = self._eviction_candidate(random.sample(self.stripes, self.stripe_samples))
+            if best is None:
+                # The sampled stripes have nothing to offer, which does not mean no stripe has
+                best = self._eviction_candidate(self.stripes)
+            if best is None:
+                raise OutOfMemoryError("OOM command not allowed when used memory > 'maxmemory'")
+            _, key, stripe = best
+            with stripe.lock:
+                # Another writer may have removed it in the meantime
+                if key in stripe.memory.sizes:
+                    self._remove(stripe, key)
+                    stripe.memory.evicted += 1
+                    self.notify_observers("evict", key)
+
+    @staticmethod
+    def _eviction_candidate(stripes):
+        """The (score, key, stripe) with the lowest score that stripes propose, or None."""
+        best = None
+        for stripe in stripes:
+            with stripe.lock:
+                candidate = stripe.memory.candidate(stripe)
+            if candidate is not None and (best is None or candidate[0] < best[0]):
+                best = (candidate[0], candidate[1], stripe)
+        return best
+
+    def memory_stats(self):
+        stats = {
+            "used_memory": self.used_memory(),
+            "maxmemory": self.maxmemory,
+            "maxmemory_policy": self.stripes[0].memory.policy,
+            "evicted_keys": sum(stripe.memory.evicted for stripe in self.stripes),
+            "lazyfree": self.lazyfree,
+        }
+        stats.update(self.reclaimer.stats())
+        if self.hot_keys:
+            stats.update({
+                "hot_tier_keys": self.hot_keys,
+                "cold_keys": sum(len(stripe.cold) for stripe in self.stripes),
+                "promoted_keys": sum(stripe.promoted for stripe in self.stripes),
+                "spill_file_size": sum(stripe.spill.size for stripe in self.stripes),
+                "spill_garbage": sum(stripe.spill.garbage for stripe in self.stripes),
+            })
+        return stats
+
+    def keyspace_stats(self):
+        return {
+            "keys": len(self.data),
+            "volatile_keys": sum(len(stripe.ttl.ttl_data) for stripe in self.stripes),
+            "expired_keys": sum(stripe.expired for stripe in self.stripes),
+        }
 
     def keys(self):
         """Get all keys in the database."""
         # First, cleanup expired keys
-        current_time = time.time()
-        expired_keys = [
-            key for key, expiry_time in list(self.ttl_data.items())
-            if expiry_time < current_time
-        ]
-        
-        for key in expired_keys:
-            del self.data[key]
-            del self.ttl_data[key]
-            self.notify_observers("expire", key)
-            
+        self.expire_due()
         return list(self.data.keys())
-        
-    def clear(self):
-        """Clear all data from the database."""
-        keys = list(self.data.keys())
-        self.data.clear()
-        self.ttl_data.clear()
-        for key in keys:
-            self.notify_observers("delete", key)
+
+    def scan(self, cursor=0, match=None, count=10):
+        """Incrementally iterate over the keys.
+
+        Start with cursor 0 and pass the returned cursor back in until it is 0
+        again. Each call looks at about count keys and returns those matching
+        the glob pattern match. Keys that exist for the whole iteration are
+        returned at least once, even with concurrent inserts and deletes.
+        Returns (next_cursor, keys).
+
+        The stripes are walked one after another; the cursor encodes the
+        stripe in its low part and the position within it in the high part.
+        """
+        now = time.time()
+        pattern = compile_pattern(match) if match else None
+        stripe_count = len(self.stripes)
+        index, position = cursor % stripe_count, cursor // stripe_count
+        keys = []
+        remaining = count
+        while index < stripe_count and remaining > 0:
+            stripe = self.stripes[index]
+
+            def accept(key):
+                expire_at = stripe.ttl.get(key)
+                if expire_at is not None and expire_at < now:
+                    return False
+                return pattern is None or pattern.fullmatch(str(key)) is not None
+
+            with stripe.lock:
+                position, found, visited = stripe.key_index.scan(position, remaining, accept)
+            keys.extend(found)
+            remaining -= visited
+            if position:
+                # Stopped part way through this stripe
+                return position * stripe_count + index, keys
+            index += 1
+        return (index if index < stripe_count else 0), keys
+
+    def expire_due(self, time_budget=None):
+        """Remove keys whose TTL has passed and return how many were removed.
+
+        Only keys that are actually due are touched. With a time_budget (in
+        seconds) the work stops once the budget is used up; the remaining keys
+        are picked up by the next call, or lazily when they are read.
+        """
+        deadline = None if time_budget is None else time.monotonic() + time_budget
+        now = time.time()
+        expired = 0
+        stripe_count = len(self.stripes)
+        # Start where the last budgeted run stopped so every stripe gets its turn
+        start = self.next_expire_stripe
+        for offset in range(stripe_count):
+            index = (start + offset) % stripe_count
+            stripe = self.stripes[index]
+            while True:
+                with stripe.lock:
+                    keys = stripe.ttl.pop_expired(now, self.EXPIRE_BATCH)
+                    for key in keys:
+                        self._expire(stripe, key)
+                expired += len(keys)
+                drained = len(keys) < self.EXPIRE_BATCH
+                if deadline is not None and time.monotonic() >= deadline:
+                    # A drained stripe is skipped next time, or a tiny budget would never get past it
+                    self.next_expire_stripe = (index + 1) % stripe_count if drained else index
+                    return expired
+                if drained:
+                    break
+        return expired
+
+    def snapshot(self, on_frozen=None):
+        """Point-in-time (key, value, expire_at) tuples for the whole dataset.
+
+        All stripe locks are held only while the dicts are copied, which is
+        a quick C-level operation, so that on_frozen(), which is called
+        while they are held, sees the same moment on every stripe. The tuples
+        are produced lazily afterwards. Collections are copied on write (see
+        PendingSnapshot): one is frozen when the snapshot reaches it, unless
+        a write has already done so. Cold values are read from the spill
+        files as they are produced; records are never overwritten, so they
+        still hold the values of the moment of the copy.
+        """
+        pending = PendingSnapshot()
+        with self.atomic():
+            data = self.data.copy()
+            ttl_data = {}
+            spilled = []  # Per stripe: (spill file, key -> location)
+            for stripe in self.stripes:
+                ttl_data.update(stripe.ttl.ttl_data)
+                for key in stripe.collections:
+                    value = data[key]
+                    if value is not COLD:
+                        pending.owned[id(value)] = (key, value)
+                spilled.append((stripe.spill, stripe.cold.copy()))
+            with self.snapshots_lock:
+                self.snapshots += (pending,)
+            if on_frozen:
+                on_frozen()
+        count = len(self.stripes)
+
+        def items():
+            for key, value in data.items():
+                if value is COLD:
+                    spill, locations = spilled[hash(key) % count]
+                    value = spill.read(locations[key])
+                elif isinstance(value, Collection):
+                    value = pending.take(key, value)
+                yield key, value, ttl_data.get(key)
+            self._forget(pending)
+
+        generator = items()
+        # A snapshot that is not read to the end stops being tracked once it is dropped
+        weakref.finalize(generator, self._forget, pending)
+        return generator
+
+    def _forget(self, pending):
+        """Stop copying collections for a snapshot that is done."""
+        with self.snapshots_lock:
+            self.snapshots = tuple(snapshot for snapshot in self.snapshots if snapshot is not pending)
+        pending.retained.clear()
+
+    def clear(self, lazy=None):
+        """Clear all data from the database.
+
+        With lazy, which defaults to the lazyfree setting, the keyspace and
+        its indexes are swapped for empty ones and the old ones are freed
+        in the background, so the locks are only held for the swap.
+        """
+        lazy = self.lazyfree if lazy is None else lazy
+        with self.atomic():
+            count = len(self.data)
+            if lazy:
+                if self.snapshots:
+                    # Snapshots in progress still read the values; the newest drops them when it ends
+                    self.snapshots[-1].retained.append(self.data)
+                    garbage = []
+                else:
+                    garbage = [self.data]
+                size = self.used_memory()
+                self.data = {}
+            else:
+                self.data.clear()
+            for stripe in self.stripes:
+                if lazy:
+                    memory = stripe.memory
+                    self.memory_counter.add(-memory.used)  # Now counted as pending lazyfree memory
+                    garbage.extend([stripe.ttl, stripe.key_index, memory, stripe.collections, stripe.versions])
+                    stripe.ttl = TTL()
+                    stripe.key_index = KeyIndex()
+                    stripe.memory = MemoryManager(memory.policy, memory.samples, memory.lfu_log_factor,
+                                                  memory.lfu_decay_time, self.memory_counter)
+                    stripe.memory.evicted = memory.evicted
+                    stripe.collections = set()
+                    stripe.versions = {}
+                else:
+                    stripe.ttl.clear()
+                    stripe.key_index.clear()
+                    stripe.memory.clear()
+                    stripe.collections.clear()
+                    stripe.versions.clear()
+                if stripe.hot is not None:
+                    self._tier(stripe)
+            if lazy:
+                self.reclaimer.release_all(garbage, size)
+                del garbage, memory  # They belong to the reclaimer now
+            self.notify_observers("clear", None, count)
         return True
\ No newline at end of file
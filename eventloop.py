@@ -0,0 +1,282 @@
+#eventloop.py
+import asyncio
+import threading
+from collections import deque
+from protocol import FrameReader, encode_frame
+from resp import RespSession, RespProtocolError, encode_error
+from log import get_logger
+
+logger = get_logger('eventloop')
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+class LoopConnection:
+    """Socket-like handle for a connection owned by an event loop.
+
+    PubSub drains its subscriber queues into the transport from callbacks
+    on the owning loop, and calls on_drain once the transport's write buffer
+    has room again. Writes from other threads, such as a replica's full
+    sync, are marshalled onto the loop; like a blocking socket, sendall()
+    from another thread waits while the transport's write buffer is full.
+    """
+
+    def __init__(self, transport, loop):
+        self.transport = transport
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.writable = threading.Event()
+        self.writable.set()
+        self.on_drain = None
+
+    def sendall(self, data):
+        if self.transport.is_closing():
+            raise ConnectionError("Connection is closed")
+        if threading.get_ident() == self.loop_thread:
+            self.transport.write(data)
+        else:
+            self.writable.wait()
+            if self.transport.is_closing():
+                raise ConnectionError("Connection is closed")
+            self.loop.call_soon_threadsafe(self.transport.write, data)
+
+    def getpeername(self):
+        return self.transport.get_extra_info('peername')
+
+    def shutdown(self, how=None):
+        """Drop the connection without flushing, waking up any blocked sendall()."""
+        self.loop.call_soon_threadsafe(self.transport.abort)
+        self.writable.set()
+
+    def close(self):
+        if threading.get_ident() == self.loop_thread:
+            self.transport.close()
+        else:
+            self.loop.call_soon_threadsafe(self.transport.close)
+
+
+class ClientProtocol(asyncio.Protocol):
+    """Serves one client connection on the event loop.
+
+    Requests are answered in the order they arrive, every one that has
+    arrived with one write. A request that can block, such as a foreground
+    save, runs in the loop's default executor instead, so other connections
+    are served meanwhile; this connection stops reading, and the requests
+    after it wait until it is answered.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.reader = FrameReader()
+        self.conn = None
+        self.addr = None
+        self.requests = deque()  # Received and not answered yet
+        self.busy = False  # A blocking request is running in the executor
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.addr = transport.get_extra_info('peername')
+        self.conn = LoopConnection(transport, asyncio.get_running_loop())
+        with self.server.clients_lock:
+            self.server.clients.add(self.conn)
+
+    def data_received(self, data):
+        self.reader.feed(data)
+        try:
+            frames = self.reader.frames()
+        except ValueError as e:
+            # The stream can't be resynchronized after a bad frame header
+            logger.warning("Protocol error from %s: %s", self.addr, e)
+            self.transport.write(encode_frame({"error": str(e)}))
+            self.transport.close()
+            return
+        self.requests.extend(self.server.decode_request(payload) for payload in frames)
+        self.answer()
+
+    def blocks(self, request):
+        return self.server.blocks(request)
+
+    def execute(self, request):
+        return self.server.process_command(request, self.conn)
+
+    def closing(self):
+        return self.transport.is_closing()
+
+    def answer(self):
+        """Answer the received requests until one has to run in the executor."""
+        if self.busy:
+            return
+        replies = []
+        while self.requests and not self.closing():
+            request = self.requests.popleft()
+            if self.blocks(request):
+                self.busy = True
+                self.transport.pause_reading()
+                future = asyncio.get_running_loop().run_in_executor(None, self.execute, request)
+                future.add_done_callback(self.executed)
+                break
+            replies.append(self.execute(request))
+        if replies:
+            self.transport.write(b''.join(replies))
+
+    def executed(self, future):
+        """Send the reply of a blocking request and go on with the requests after it."""
+        self.busy = False
+        if self.transport.is_closing():
+            return
+        try:
+            reply = future.result()
+        except Exception as e:
+            logger.error("Error handling command: %s", e)
+            reply = self.error_reply(e)
+        self.transport.write(reply)
+        if self.conn.writable.is_set():
+            self.transport.resume_reading()
+        self.answer()
+
+    def error_reply(self, error):
+        return encode_frame({"error": str(error)})
+
+    def pause_writing(self):
+        # The client is not reading its responses, stop reading its requests
+        self.conn.writable.clear()
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.conn.writable.set()
+        if not self.busy:
+            self.transport.resume_reading()
+        if self.conn.on_drain:
+            self.conn.on_drain()
+
+    def connection_lost(self, exc):
+        self.conn.writable.set()
+        with self.server.clients_lock:
+            self.server.clients.discard(self.conn)
+        self.server.pubsub.drop_client(self.conn)
+        self.server.replication.drop(self.conn)
+
+
+class RespClientProtocol(ClientProtocol):
+    """Serves one RESP connection on the event loop."""
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.session = RespSession(self.server, self.conn)
+
+    def data_received(self, data):
+        try:
+            self.requests.extend(self.session.requests(data))
+        except RespProtocolError as e:
+            logger.warning("Protocol error from %s: %s", self.addr, e)
+            self.transport.write(encode_error(f"ERR Protocol error: {e}"))
+            self.transport.close()
+            return
+        self.answer()
+
+    def blocks(self, request):
+        return self.session.blocks(request)
+
+    def execute(self, request):
+        return self.session.execute(request)
+
+    def closing(self):
+        # After QUIT, the replies so far are sent and the connection closed
+        return self.session.closing or self.transport.is_closing()
+
+    def answer(self):
+        super().answer()
+        if self.session.closing and not self.transport.is_closing():
+            self.transport.close()
+
+    def error_reply(self, error):
+        return encode_error(f"ERR {error}")
+
+
+class EventLoopServer:
+    """Single-threaded asyncio front end for a TCPServer.
+
+    Each worker runs its own event loop and accepts from the shared listening
+    socket; all of them execute commands against the same TCPServer, so the
+    command semantics are identical to the thread-per-connection mode. Idle
+    connections cost a file descriptor and a small protocol object instead of
+    a thread and a wakeup every second.
+
+    With workers > 1 the loops run in separate threads of this process.
+    Under the GIL they only take turns, so extra workers add no throughput;
+    only a free-threaded Python build runs them on separate cores. Requests
+    that can block run in each loop's default executor (see ClientProtocol).
+    """
+
+    def __init__(self, server, workers=1):
+        self.server = server
+        self.workers = max(1, workers)
+        self.stop_events = []  # (loop, asyncio.Event) for every running worker
+        self.lock = threading.Lock()
+
+    def serve(self, sock, resp_sock=None):
+        """Serve connections accepted on the listening sock, and RESP ones on resp_sock, until stopped."""
+        raise_fd_limit()
+        sock.setblocking(False)
+        if resp_sock:
+            resp_sock.setblocking(False)
+
+        # Each worker gets its own duplicates of the listening sockets, since
+        # a loop closes the sockets it served from when it stops
+        def duplicates():
+            return sock.dup(), resp_sock.dup() if resp_sock else None
+
+        threads = [
+            threading.Thread(target=self._run_worker, args=duplicates(), daemon=True)
+            for _ in range(self.workers - 1)
+        ]
+        for thread in threads:
+            thread.start()
+        # The first worker runs in the calling thread so Ctrl+C reaches it
+        self._run_worker(*duplicates())
+        for thread in threads:
+            thread.join()
+
+    def _run_worker(self, sock, resp_sock=None):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._serve(sock, resp_sock))
+        finally:
+            loop.close()
+
+    async def _serve(self, sock, resp_sock=None):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        with self.lock:
+            if not self.server.running:
+                return
+            self.stop_events.append((loop, stop))
+        listeners = [await loop.create_server(lambda: ClientProtocol(self.server), sock=sock)]
+        if resp_sock:
+            listeners.append(await loop.create_server(lambda: RespClientProtocol(self.server), sock=resp_sock))
+        try:
+            await stop.wait()
+        finally:
+            for listener in listeners:
+                listener.close()
+
+    def stop(self):
+        """Stop every worker loop."""
+        with self.lock:
+            for loop, stop in self.stop_events:
+                loop.call_soon_threadsafe(stop.set)
+
+
+def raise_fd_limit():
+    """Raise the open file limit to the hard limit so many clients can connect."""
+    if resource is None:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY and soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        pass
\ No newline at end of file
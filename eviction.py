@@ -0,0 +1,183 @@
+#eviction.py
+import math
+import random
+import sys
+import threading
+import time
+from cache import LRUCache
+from config import MAXMEMORY_POLICY, MAXMEMORY_SAMPLES, LFU_LOG_FACTOR, LFU_DECAY_TIME
+
+POLICIES = ('noeviction', 'allkeys-lru', 'allkeys-lfu', 'volatile-ttl', 'allkeys-random')
+
+# Rough cost of one key in the dict, the TTL index and the scan index
+ENTRY_OVERHEAD = 96
+
+SCALAR_TYPES = frozenset((str, int, float, bool, bytes, type(None)))
+
+LFU_INIT = 5  # Counter given to new keys so they are not evicted straight away
+LFU_MAX = 255
+
+class OutOfMemoryError(Exception):
+    """Raised for a write when maxmemory is reached and nothing can be evicted."""
+
+
+def estimate_size(value):
+    """Estimate the bytes used by a value, including nested containers."""
+    if type(value) in SCALAR_TYPES:
+        return sys.getsizeof(value)
+    if hasattr(value, 'memory_usage'):
+        # Native data types keep a running total
+        return value.memory_usage()
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += estimate_size(k) + estimate_size(v)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += estimate_size(item)
+    return size
+
+
+class MemoryCounter:
+    """Bytes used by all stripes together, so checking the limit reads one number."""
+
+    def __init__(self):
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def add(self, delta):
+        if delta:
+            with self.lock:
+                self.used += delta
+
+
+class MemoryManager:
+    """Per-key memory accounting and the bookkeeping for eviction policies.
+
+    The database keeps one MemoryManager per lock stripe, guarded by that
+    stripe's lock, and every change is also added to the shared counter.
+    Each one proposes an eviction candidate for its keys and the database
+    evicts the best candidate of a few randomly chosen stripes:
+
+    - allkeys-lru:    keys are kept in an LRUCache ordered by last access; the
+                      least recently used key is evicted.
+    - allkeys-lfu:    every key has a logarithmic access counter that decays
+                      over time; the least frequently used of a random sample
+                      of keys is evicted.
+    - volatile-ttl:   the key with a TTL that expires soonest is evicted.
+    - allkeys-random: a random key is evicted.
+    - noeviction:     writes fail with OutOfMemoryError instead.
+
+    Every hook is O(1), and get() only pays for one when the policy needs
+    access information.
+    """
+
+    def __init__(self, policy=MAXMEMORY_POLICY, samples=MAXMEMORY_SAMPLES,
+                 lfu_log_factor=LFU_LOG_FACTOR, lfu_decay_time=LFU_DECAY_TIME, counter=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown maxmemory policy: {policy}")
+        self.policy = policy
+        self.counter = MemoryCounter() if counter is None else counter
+        self.samples = samples
+        self.lfu_log_factor = lfu_log_factor
+        self.lfu_decay_time = lfu_decay_time
+        self.tracks_access = policy in ('allkeys-lru', 'allkeys-lfu')
+        self.sizes = {}  # key -> estimated bytes
+        self.used = 0
+        self.evicted = 0
+        self.lru = LRUCache(capacity=math.inf) if policy == 'allkeys-lru' else None
+        self.lfu = {} if policy == 'allkeys-lfu' else None  # key -> [counter, minute of last decay]
+
+    def on_write(self, key, value):
+        """Account for a key that was created or overwritten."""
+        size = ENTRY_OVERHEAD + estimate_size(key) + estimate_size(value)
+        delta = size - self.sizes.get(key, 0)
+        self.used += delta
+        self.counter.add(delta)
+        self.sizes[key] = size
+        if self.tracks_access:
+            self.touch(key)
+
+    def on_resize(self, key, value):
+        """Account for a new size of key's value that is not a write, e.g. when it leaves RAM."""
+        size = ENTRY_OVERHEAD + estimate_size(key) + estimate_size(value)
+        delta = size - self.sizes.get(key, 0)
+        self.used += delta
+        self.counter.add(delta)
+        self.sizes[key] = size
+
+    def on_delete(self, key):
+        """Forget a key that was removed and return the bytes it was using."""
+        size = self.sizes.pop(key, 0)
+        self.used -= size
+        self.counter.add(-size)
+        if self.lru is not None:
+            self.lru.delete(key)
+        elif self.lfu is not None:
+            self.lfu.pop(key, None)
+        return size
+
+    def clear(self):
+        self.sizes.clear()
+        self.counter.add(-self.used)
+        self.used = 0
+        if self.lru is not None:
+            self.lru.clear()
+        elif self.lfu is not None:
+            self.lfu.clear()
+
+    def touch(self, key):
+        """Record an access to key."""
+        if self.lru is not None:
+            self.lru.set(key, time.monotonic())
+        elif self.lfu is not None:
+            self._lfu_increment(key)
+
+    def _lfu_decay(self, entry, now):
+        """Apply the time-based decay to an LFU entry."""
+        if self.lfu_decay_time:
+            periods = (now - entry[1]) // self.lfu_decay_time
+            if periods:
+                entry[0] = max(entry[0] - periods, 0)
+                entry[1] = now
+        return entry[0]
+
+    def _lfu_increment(self, key):
+        now = int(time.time() // 60)
+        entry = self.lfu.get(key)
+        if entry is None:
+            self.lfu[key] = [LFU_INIT, now]
+            return
+        counter = self._lfu_decay(entry, now)
+        if counter < LFU_MAX:
+            # Logarithmic counter: the more hits a key has, the less likely
+            # one more hit is to increment it
+            base = max(counter - LFU_INIT, 0)
+            if random.random() < 1.0 / (base * self.lfu_log_factor + 1):
+                entry[0] = counter + 1
+
+    def candidate(self, stripe):
+        """Propose (score, key) for eviction from this stripe, lowest score first.
+
+        Returns None if the policy allows nothing in this stripe to be evicted.
+        """
+        if not self.sizes:
+            return None
+        if self.policy == 'allkeys-lru':
+            key = self.lru.oldest()
+            return self.lru.cache[key], key
+        if self.policy == 'allkeys-random':
+            return random.random(), stripe.key_index.random_key()
+        if self.policy == 'volatile-ttl':
+            return stripe.ttl.earliest()
+        if self.policy == 'allkeys-lfu':
+            now = int(time.time() // 60)
+            best = None
+            for _ in range(self.samples):
+                key = stripe.key_index.random_key()
+                entry = self.lfu.get(key)
+                counter = self._lfu_decay(entry, now) if entry else 0
+                if best is None or counter < best[0]:
+                    best = (counter, key)
+            return best
+        return None
\ No newline at end of file
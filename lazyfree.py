@@ -0,0 +1,163 @@
+#lazyfree.py
+import threading
+import time
+from collections import deque
+from itertools import islice
+from datatypes import Collection, SkipList
+from config import LAZYFREE_THRESHOLD
+from log import get_logger
+
+logger = get_logger('lazyfree')
+
+CONTAINERS = (dict, list, set, frozenset, deque)
+# Objects only the store refers to, taken apart wherever they are found
+DATA_TYPES = (Collection, SkipList)
+# Types never worth freeing in the background, skipped without a closer look
+SMALL_TYPES = frozenset((int, float, bool, type(None), tuple))
+
+def free_effort(value):
+    """Roughly how many objects freeing value deallocates.
+
+    Elements for containers and data types, one per 4 KB for strings, and
+    the sum over the attributes of other objects with a __dict__.
+    """
+    if isinstance(value, (str, bytes, bytearray)):
+        return 1 + len(value) // 4096
+    if isinstance(value, CONTAINERS) or isinstance(value, (Collection, SkipList)):
+        return len(value)
+    if hasattr(value, '__dict__') and not isinstance(value, type):
+        return sum(free_effort(attribute) for attribute in vars(value).values())
+    return 1
+
+
+class Reclaimer:
+    """Frees large values on a background thread, a slice at a time.
+
+    Whatever is handed to release() belongs to the reclaimer from then on:
+    the caller has unlinked it and must not keep or share it. The
+    reclaimer takes containers apart chunk elements at a time and yields
+    the interpreter lock between chunks, so freeing a huge hash or a
+    flushed keyspace never holds up requests for more than one chunk.
+    Inside a container, only data types are taken apart further. Plain
+    values, which a client may have been handed, are dropped whole, and
+    freed here if nobody else holds them; a single large string is freed
+    in one go, only off the request path.
+    """
+
+    CHUNK = 1024  # Elements freed between yields
+
+    def __init__(self, threshold=LAZYFREE_THRESHOLD):
+        self.threshold = threshold
+        self.queue = deque()  # (objects, estimated bytes, whether to take them apart)
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pending_objects = 0
+        self.pending_bytes = 0
+        self.freed_objects = 0
+
+    def worth_it(self, value):
+        """Whether value is big enough to be freed in the background."""
+        return free_effort(value) > self.threshold
+
+    def release(self, value, size=0):
+        """Free a value unlinked from the keyspace in the background; size is its estimated bytes.
+
+        A data type is handed over and taken apart, so nothing else may refer
+        to it afterwards. Any other value is only dropped in one piece, as a
+        caller may still hold it; it is freed here if nobody does.
+        """
+        self._enqueue([value], size, isinstance(value, DATA_TYPES))
+
+    def release_all(self, structures, size=0):
+        """Take apart the list of structures, such as a flushed keyspace and its indexes, as one object.
+
+        The list and the structures in it are handed over.
+        """
+        self._enqueue(structures, size, True)
+
+    def _enqueue(self, objects, size, take_apart):
+        with self.lock:
+            self.pending_objects += 1
+            self.pending_bytes += size
+            self.queue.append((objects, size, take_apart))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='lazyfree', daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            while True:
+                try:
+                    stack, size, take_apart = self.queue.popleft()
+                except IndexError:
+                    break
+                try:
+                    if take_apart:
+                        self._dismantle(stack)
+                except Exception:
+                    logger.exception("Failed to free a value in the background")
+                del stack
+                with self.lock:
+                    self.pending_objects -= 1
+                    self.pending_bytes -= size
+                    self.freed_objects += 1
+
+    def _dismantle(self, stack):
+        """Take apart the objects on stack, which belong to the reclaimer."""
+        budget = self.CHUNK
+        while stack:
+            value = stack.pop()
+            if isinstance(value, (dict, list, set, deque)):
+                while value:
+                    # Take a chunk out, keep the elements worth their own pass, and free the rest
+                    if isinstance(value, dict):
+                        items = list(map(value.pop, list(islice(value, budget))))
+                    elif isinstance(value, list):
+                        items = value[-budget:]
+                        del value[-budget:]
+                    elif isinstance(value, set):
+                        items = list(islice(value, budget))
+                        value.difference_update(items)
+                    else:
+                        items = [value.pop() for _ in range(min(budget, len(value)))]
+                    budget -= len(items)
+                    stack.extend(self._large(items, DATA_TYPES))
+                    del items
+                    if not budget:
+                        budget = self._yield()
+            elif isinstance(value, SkipList):
+                # Unlink the nodes front to back so each is freed as soon as it is passed
+                node, value.header, value.tail = value.header, None, None
+                while node is not None:
+                    following = node.forward[0]
+                    node.forward = node.span = node.backward = None
+                    node = following
+                    budget -= 1
+                    if not budget:
+                        budget = self._yield()
+            elif hasattr(value, '__dict__') and not isinstance(value, type):
+                attributes = vars(value)
+                stack.extend(self._large(attributes.values()))
+                attributes.clear()
+            del value
+
+    def _large(self, items, types=object):
+        threshold = self.threshold
+        return [item for item in items
+                if type(item) not in SMALL_TYPES and isinstance(item, types) and free_effort(item) > threshold]
+
+    def _yield(self):
+        time.sleep(0)  # Let request threads take the interpreter lock
+        return self.CHUNK
+
+    def stats(self):
+        with self.lock:
+            return {
+                "lazyfree_pending_objects": self.pending_objects,
+                "lazyfree_pending_memory": self.pending_bytes,
+                "lazyfreed_objects": self.freed_objects,
+            }
\ No newline at end of file
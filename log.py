@@ -0,0 +1,17 @@
+#log.py
+import logging
+import sys
+from config import LOG_LEVEL
+
+# Server modules log through here instead of printing. Per-request messages
+# are logged at 'debug', so they cost next to nothing unless enabled.
+_handler = logging.StreamHandler(sys.stdout)
+_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+root_logger = logging.getLogger('imdb')
+root_logger.addHandler(_handler)
+root_logger.setLevel(LOG_LEVEL.upper())
+root_logger.propagate = False
+
+def get_logger(name):
+    """Return the logger for a server module; its level follows LOG_LEVEL."""
+    return root_logger.getChild(name)
\ No newline at end of file
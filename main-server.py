@@ -1,7 +1,22 @@
 #main-server.py
+import argparse
+import os
 import signal
 import sys
 from network import TCPServer
+from config import SERVER_PORT, RESP_PORT, REPLICA_OF, CLUSTER_NODES
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError(f"expected host:port, got '{text}'")
+    return host, int(port)
+
+def parse_nodes(text):
+    nodes = [node.strip() for node in text.split(',') if node.strip()]
+    for node in nodes:
+        parse_address(node)
+    return nodes
 
 def signal_handler(sig, frame):
     print('Shutting down server...')
@@ -10,6 +25,20 @@ def signal_handler(sig, frame):
     sys.exit(0)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the in-memory database server.")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help=f"port to listen on (default: {SERVER_PORT})")
+    parser.add_argument("--resp-port", type=int, default=RESP_PORT, help="port for Redis protocol clients, 0 for none")
+    parser.add_argument("--replicaof", type=parse_address, default=REPLICA_OF, metavar="HOST:PORT",
+                        help="replicate from the primary at HOST:PORT")
+    parser.add_argument("--cluster", type=parse_nodes, default=CLUSTER_NODES, metavar="HOST:PORT,...",
+                        help="run as a cluster node; the slots are split evenly over these nodes, which include this one")
+    parser.add_argument("--cluster-join", metavar="HOST:PORT",
+                        help="join the cluster that the node at HOST:PORT belongs to, owning no slots at first")
+    parser.add_argument("--dir", help="directory for the snapshot and append-only log (default: current)")
+    args = parser.parse_args()
+    if args.dir:
+        os.chdir(args.dir)
+
     server = None
     try:
         # Register signal handler for shutdown
@@ -17,7 +46,8 @@ if __name__ == "__main__":
         signal.signal(signal.SIGTERM, signal_handler)
         
         # Start the server
-        server = TCPServer()
+        server = TCPServer(port=args.port, resp_port=args.resp_port, replica_of=args.replicaof,
+                           cluster_nodes=args.cluster, cluster_join=args.cluster_join)
         print("In-Memory DB Server with PubSub started")
         server.start()
     except KeyboardInterrupt:
@@ -0,0 +1,127 @@
+#metrics.py
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from log import get_logger
+
+logger = get_logger('metrics')
+
+# Upper bounds (seconds) of the command latency histogram buckets
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# (section, field, metric name, type, help) for every single-valued metric
+GAUGES = [
+    ("server", "uptime_seconds", "imdb_uptime_seconds", "gauge", "Seconds since the server started"),
+    ("clients", "connected_clients", "imdb_connected_clients", "gauge", "Open client connections"),
+    ("keyspace", "keys", "imdb_keys", "gauge", "Keys in the database"),
+    ("keyspace", "volatile_keys", "imdb_volatile_keys", "gauge", "Keys with a TTL"),
+    ("stats", "expired_keys", "imdb_expired_keys_total", "counter", "Keys removed because their TTL passed"),
+    ("stats", "evicted_keys", "imdb_evicted_keys_total", "counter", "Keys evicted to stay under maxmemory"),
+    ("stats", "slowlog_length", "imdb_slowlog_length", "gauge", "Entries in the slowlog"),
+    ("memory", "used_memory", "imdb_used_memory_bytes", "gauge", "Estimated memory used by keys and values"),
+    ("memory", "maxmemory", "imdb_maxmemory_bytes", "gauge", "Memory limit, 0 for none"),
+    ("memory", "cold_keys", "imdb_cold_keys", "gauge", "Keys whose values are in spill files instead of RAM"),
+    ("memory", "promoted_keys", "imdb_promoted_keys_total", "counter", "Cold values read back into RAM"),
+    ("memory", "lazyfree_pending_memory", "imdb_lazyfree_pending_memory_bytes", "gauge",
+     "Estimated bytes of deleted values still waiting to be freed in the background"),
+    ("memory", "spill_file_size", "imdb_spill_file_size_bytes", "gauge", "Bytes written to the spill files"),
+    ("persistence", "changes_since_last_save", "imdb_changes_since_last_save", "gauge",
+     "Writes not yet in a snapshot"),
+    ("persistence", "seconds_since_last_save", "imdb_seconds_since_last_save", "gauge",
+     "Seconds since the last successful snapshot"),
+    ("persistence", "aof_size", "imdb_aof_size_bytes", "gauge", "Size of the append-only log"),
+    ("persistence", "aof_unsynced_entries", "imdb_aof_unsynced_entries", "gauge",
+     "Append-only log entries not yet fsynced"),
+    ("persistence", "aof_last_sync_age", "imdb_aof_last_sync_age_seconds", "gauge",
+     "Seconds since the append-only log was last fsynced"),
+    ("pubsub", "channels", "imdb_pubsub_channels", "gauge", "Channels with subscribers"),
+    ("pubsub", "patterns", "imdb_pubsub_patterns", "gauge", "Subscribed patterns"),
+    ("pubsub", "subscribers", "imdb_pubsub_subscribers", "gauge", "Connections with subscriptions"),
+    ("pubsub", "published_messages", "imdb_pubsub_published_messages_total", "counter", "Messages published"),
+    ("pubsub", "deliveries", "imdb_pubsub_deliveries_total", "counter", "Messages handed to subscribers"),
+    ("pubsub", "dropped_messages", "imdb_pubsub_dropped_messages_total", "counter",
+     "Messages dropped for slow subscribers"),
+    ("pubsub", "slow_disconnects", "imdb_pubsub_slow_disconnects_total", "counter",
+     "Subscribers disconnected for falling behind"),
+    ("pubsub", "pending_bytes", "imdb_pubsub_pending_bytes", "gauge", "Bytes waiting to be sent to subscribers"),
+    ("tracking", "tracked_keys", "imdb_tracking_keys", "gauge", "Keys with client-side caching readers"),
+    ("tracking", "invalidated_keys", "imdb_tracking_invalidated_keys_total", "counter",
+     "Keys sent to caching clients in invalidation messages"),
+    ("replication", "offset", "imdb_replication_offset", "gauge",
+     "Entries written to the replication stream, or applied from it on a replica"),
+    ("replication", "connected_replicas", "imdb_connected_replicas", "gauge", "Replicas following this server"),
+    ("replication", "lag_entries", "imdb_replication_lag_entries", "gauge",
+     "Stream entries the primary has sent that this replica has not applied"),
+    ("replication", "last_io_seconds_ago", "imdb_replication_last_io_age_seconds", "gauge",
+     "Seconds since this replica last heard from its primary"),
+]
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render(server):
+    """Return the server's metrics in the Prometheus text exposition format."""
+    info = server.info()
+    lines = []
+    for section, field, name, kind, help_text in GAUGES:
+        value = info.get(section, {}).get(field)
+        if value is None:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {float(value):g}" if isinstance(value, float) else f"{name} {int(value)}")
+
+    histograms = server.stats.histograms()
+    lines.append("# HELP imdb_command_duration_seconds Time spent executing commands")
+    lines.append("# TYPE imdb_command_duration_seconds histogram")
+    bounds_ns = [bound * 1e9 for bound in LATENCY_BUCKETS]
+    for action in sorted(histograms):
+        histogram = histograms[action]
+        label = escape_label(action)
+        for bound, count in zip(LATENCY_BUCKETS, histogram.count_below(bounds_ns)):
+            lines.append(f'imdb_command_duration_seconds_bucket{{action="{label}",le="{bound:g}"}} {count}')
+        lines.append(f'imdb_command_duration_seconds_bucket{{action="{label}",le="+Inf"}} {histogram.total}')
+        lines.append(f'imdb_command_duration_seconds_sum{{action="{label}"}} {histogram.sum_ns / 1e9:g}')
+        lines.append(f'imdb_command_duration_seconds_count{{action="{label}"}} {histogram.total}')
+    lines.append("# HELP imdb_command_ops_per_second Recent commands per second")
+    lines.append("# TYPE imdb_command_ops_per_second gauge")
+    for action, rate in sorted(server.stats.ops_per_sec().items()):
+        label = escape_label(action)
+        lines.append(f'imdb_command_ops_per_second{{action="{label}"}} {rate:g}')
+    return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """Serves GET /metrics over HTTP from a background thread."""
+
+    def __init__(self, server, host, port):
+        self.server = server
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    def _handler(self):
+        server = self.server
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = render(server).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("Metrics request from %s: %s", self.address_string(), format % args)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
\ No newline at end of file
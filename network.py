@@ -2,46 +2,333 @@
 import socket
 import json
 import time
+import os
 import threading
+from contextlib import nullcontext
 from db import InMemoryDB
-from storage import Storage
-from config import SERVER_HOST, SERVER_PORT
+from storage import Storage, AppendOnlyLog, Snapshot
+from config import (SERVER_HOST, SERVER_PORT, RESP_PORT, METRICS_PORT, APPENDONLY, SAVE_POINTS, SERVER_MODE,
+                    EVENT_LOOP_WORKERS, LISTEN_BACKLOG, EXPIRE_CYCLE_INTERVAL, EXPIRE_CYCLE_BUDGET, REPLICA_OF,
+                    CLUSTER_NODES)
 from pubsub import PubSub
+from tracking import KeyTracker
+from cdc import ChangeConsumer, ChangesLost, BATCH_OPERATIONS
+from datatypes import Collection, COMMANDS, WRITE_COMMANDS, WrongTypeError, is_collection, dump_value, load_value
+from protocol import FrameReader, encode_frame, decode_frame, RECV_SIZE
+from eventloop import EventLoopServer
+from resp import RespSession, RespProtocolError, encode_error
+from stats import CommandStats, SlowLog
+from metrics import MetricsServer
+from replication import ReplicationSource, Replica
+from cluster import ClusterState, ClusterRedirect
+from log import get_logger
+
+logger = get_logger('network')
+
+# Read-modify-write commands that may change a key
+ATOMIC_COMMANDS = ["incr", "decr", "append", "getset", "setnx", "cas"]
+# Actions a replica refuses, besides the data type write commands
+WRITE_ACTIONS = ["set", "set_with_ttl", "delete", "mset", "mdelete", "unlink", "mexpire", "flushall"] + ATOMIC_COMMANDS
+READONLY_ERROR = "READONLY You can't write against a read only replica"
+# Actions on keys, which cluster mode routes to the node owning the keys
+KEY_ACTIONS = WRITE_ACTIONS + ["get", "mget", "type"]
+# Responses to actions that don't exist, counted together in the statistics
+UNKNOWN_COMMAND_ERRORS = ("Invalid action", "Invalid PubSub command")
+# Actions that can take long enough to stall an event loop; it runs them in its executor
+BLOCKING_ACTIONS = ("save", "flushall", "replicaof")
+
+def describe_command(command):
+    """A command's arguments for the slowlog: the action and key, then the other fields."""
+    if not isinstance(command, dict):
+        return [json.dumps(command)]
+    args = [command.get("action")]
+    if "key" in command:
+        args.append(command["key"])
+    args.extend(f"{field}={json.dumps(value)}" for field, value in command.items()
+                if field not in ("action", "key", "id", "type"))
+    return args
+
+class SocketConnection:
+    """Socket-like handle for a connection served by its own thread.
+
+    The connection's thread writes responses, and once the connection
+    subscribes, its Subscriber's sender thread writes messages; a lock
+    keeps each write whole so their frames never interleave. The
+    EventLoopServer's LoopConnection plays the same part for its loops.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.write_lock = threading.Lock()
+        self.closed = False
+
+    def recv(self, size):
+        return self.sock.recv(size)
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def sendall(self, data):
+        with self.write_lock:
+            # The connection's thread sets a short timeout for its reads, which
+            # a slow reader must not turn into a half-written frame
+            view = memoryview(data)
+            while view:
+                try:
+                    view = view[self.sock.send(view):]
+                except socket.timeout:
+                    if self.closed:
+                        raise ConnectionError("Connection was closed")
+
+    def getpeername(self):
+        return self.sock.getpeername()
+
+    def shutdown(self, how=socket.SHUT_RDWR):
+        """Drop the connection, waking up any blocked sendall()."""
+        self.closed = True
+        self.sock.shutdown(how)
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
 
 class TCPServer:
-    def __init__(self, host=SERVER_HOST, port=SERVER_PORT):
+    LOAD_BATCH = 10000  # Logged writes stored per bulk load while replaying the append-only log
+
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, mode=SERVER_MODE, workers=EVENT_LOOP_WORKERS,
+                 resp_port=RESP_PORT, metrics_port=METRICS_PORT, replica_of=REPLICA_OF,
+                 cluster_nodes=CLUSTER_NODES, cluster_join=None):
+        if mode not in ("threaded", "eventloop"):
+            raise ValueError(f"Unknown server mode: {mode}")
         self.host = host
         self.port = port
+        self.resp_port = resp_port  # Second listener speaking RESP, disabled if 0
+        self.metrics_port = metrics_port  # HTTP endpoint for Prometheus, disabled if 0
+        self.metrics_server = None
+        self.started_at = time.time()
+        self.stats = CommandStats()
+        self.slowlog = SlowLog()
+        self.mode = mode
+        self.workers = workers
+        self.event_loop_server = None
         self.db = InMemoryDB()
         self.storage = Storage()
+        self.snapshot = Snapshot()
+        self.aof = AppendOnlyLog() if APPENDONLY else None
         self.pubsub = PubSub()
+        self.tracker = KeyTracker(self.pubsub)  # Readers to invalidate for client-side caching
+        self.replication = ReplicationSource()
+        self.replica_of = replica_of  # (host, port) of the primary to follow at start
+        self.replica = None  # Replica link while this server follows a primary
+        self.dirty = 0  # Writes since the last successful snapshot
+        self.last_save = time.time()
+        self.last_bgsave_ok = True
+        self.last_load = {}  # What load_data() loaded, and how long it took
         self.load_data()
+        self.db.add_observer(self.count_change)
+        if self.aof:
+            seed_log = not self.aof.exists()
+            self.aof.open(snapshot_source=self.snapshot_items)
+            if seed_log:
+                # Start the log from the loaded snapshot so it is complete on its own
+                self.aof.rewrite()
+            self.db.add_observer(self.log_change)
+        self.db.add_observer(self.replicate_change)
+        # Invalidations may lag the writes, so they follow the change log instead of running inline
+        self.invalidator = ChangeConsumer(self.db.changes, self.invalidate_changes,
+                                          on_lost=self.tracker.invalidate_all, name='tracking')
+        self.cluster = None  # Slot map in cluster mode
+        if cluster_nodes or cluster_join:
+            self.cluster = ClusterState(self.db, f"{host}:{port}", cluster_nodes, self.apply_log_entry,
+                                        join=cluster_join)
         self.running = False
         self.clients = set()
         self.clients_lock = threading.Lock()
 
     def load_data(self):
-        data = self.storage.load()
-        for key, value in data.items():
-            self.db.set(key, value)
+        """Fill the database from the data files at startup, in bulk and without notifying observers."""
+        started = time.perf_counter()
+        # The append-only log, when present, is the authoritative copy
+        if self.aof and self.aof.exists():
+            source = self.aof.filename
+            entries, expired = self.replay_log()
+        elif self.snapshot.exists():
+            source = self.snapshot.filename
+            entries, expired = self.db.load_items(self.snapshot.iter_items())
+        else:
+            # Fall back to the legacy JSON dump
+            source = self.storage.filename
+            entries, expired = self.db.load_items((key, value, None) for key, value in self.storage.load().items())
+        seconds = time.perf_counter() - started
+        self.last_load = {"source": source, "entries": entries, "expired": expired, "seconds": round(seconds, 3)}
+        if entries or expired:
+            logger.info("Loaded %d keys from %s in %.2f seconds (%d entries, %d already expired)",
+                        len(self.db.data), source, seconds, entries, expired)
+
+    def replay_log(self):
+        """Apply the append-only log, storing runs of set and restore entries in bulk.
+
+        Returns the number of entries applied, and of those skipped because
+        they had expired.
+        """
+        batch = []
+        counts = [0, 0]
+
+        def flush():
+            stored, expired = self.db.load_items(batch)
+            counts[0] += stored
+            counts[1] += expired
+            batch.clear()
+
+        def apply(entry):
+            op = entry.get("op")
+            if op in ("set", "restore"):
+                value = entry.get("value")
+                batch.append((entry.get("key"), load_value(value) if op == "restore" else value, entry.get("expire_at")))
+                if len(batch) >= self.LOAD_BATCH:
+                    flush()
+                return
+            if batch:
+                flush()
+            self.apply_log_entry(entry)
+            counts[0] += 1
+
+        self.aof.replay(apply)
+        flush()
+        return counts[0], counts[1]
+
+    def apply_log_entry(self, entry):
+        """Apply one append-only log entry to the database."""
+        op = entry.get("op")
+        key = entry.get("key")
+        if op in ("set", "restore"):
+            value = entry.get("value")
+            if op == "restore":
+                value = load_value(value)
+            expire_at = entry.get("expire_at")
+            if expire_at is None:
+                self.db.set(key, value)
+            elif expire_at > time.time():
+                self.db.set(key, value, expire_at - time.time())
+            else:
+                self.db.delete(key)
+        elif op in ("delete", "expire", "evict"):
+            self.db.delete(key)
+        elif op == "expireat":
+            expire_at = entry.get("expire_at")
+            if expire_at > time.time():
+                self.db.mexpire([key], expire_at - time.time())
+            else:
+                self.db.delete(key)
+        elif op == "clear":
+            self.db.clear()
+        elif op in COMMANDS:
+            self.db.command(op, key, entry.get("value", []))
+
+    def change_entries(self, operation, key, value=None):
+        """The (operation, key, value, expire_at) log entries that record one database change."""
+        if operation == "set":
+            if is_collection(value):
+                # A whole collection, as loaded from a snapshot
+                return [("restore", key, dump_value(value), self.db.expiry(key))]
+            return [("set", key, value, self.db.expiry(key))]
+        if operation == "mset":
+            return [("set", key, value, expire_at) for key, value, expire_at in value]
+        if operation == "mdelete":
+            return [("delete", key, None, None) for key in value]
+        if operation == "mexpire":
+            return [("expireat", key, None, expire_at) for key, expire_at in value]
+        if operation == "clear":
+            return [("clear", None, None, None)]
+        # Deletions, and data type commands with their arguments
+        return [(operation, key, value, None)]
+
+    def log_change(self, operation, key, value=None):
+        """Observer that records every database mutation in the append-only log."""
+        self.aof.append_many(self.change_entries(operation, key, value))
+
+    def replicate_change(self, operation, key, value=None):
+        """Observer that sends every database mutation, expirations included, to the replicas."""
+        if self.replication.active:
+            self.replication.feed(self.change_entries(operation, key, value))
+
+    def invalidate_changes(self, events):
+        """Change log consumer that sends invalidations to the clients caching the changed keys."""
+        if not self.tracker.table:
+            return
+        keys = []
+        for _, _, operation, key, detail in events:
+            if operation in BATCH_OPERATIONS:
+                keys.extend(detail)
+            elif operation == "clear":
+                self.tracker.invalidate(keys)
+                self.tracker.invalidate_all()
+                keys = []
+            else:
+                keys.append(key)
+        self.tracker.invalidate(keys)
+
+    def replicaof(self, host, port=None):
+        """Follow the primary at host:port, or with host None stop following and accept writes."""
+        if self.replica:
+            self.replica.stop()
+            self.replica = None
+        if host is not None:
+            self.replica = Replica(self, host, port)
+            self.replica.start()
+            logger.info("Replicating from %s:%d", host, port)
+
+    def count_change(self, operation, key, value=None):
+        """Observer that counts writes towards the snapshot save points."""
+        self.dirty += len(value) if operation in ("mset", "mdelete", "mexpire") else 1
+
+    def snapshot_items(self, on_frozen=None):
+        """Point-in-time (key, value, expire_at) tuples for the current dataset."""
+        return self.db.snapshot(on_frozen)
 
     def save_data(self):
-        current_time = time.time()
-        expired_keys = [
-            key for key, expiry_time in self.db.ttl_data.items()
-            if expiry_time < current_time
-        ]
-        for key in expired_keys:
-            del self.db.data[key]
-            del self.db.ttl_data[key]
-        self.storage.save(self.db.data)
+        """Write a snapshot in the foreground."""
+        dirty = self.dirty
+        self.snapshot.save(self.snapshot_items())
+        self.dirty -= dirty
+        self.last_save = time.time()
+
+    def background_save(self):
+        """Write a snapshot without blocking request handling."""
+        dirty = self.dirty
+        started_at = time.time()
+
+        def on_done(success):
+            self.last_bgsave_ok = success
+            if success:
+                self.dirty -= dirty
+                self.last_save = started_at
+                logger.info("Background snapshot completed")
+            else:
+                logger.error("Background snapshot failed")
+
+        return self.snapshot.save_in_background(self.snapshot_items, on_done, fork_lock=self.db.fork_guard)
+
+    def listen(self, port):
+        """Open a listening socket on port."""
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((self.host, port))
+        s.listen(LISTEN_BACKLOG)
+        return s
 
     def start(self):
         self.running = True
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.bind((self.host, self.port))
-            s.listen()
-            print(f"Server listening on {self.host}:{self.port}")
+        with self.listen(self.port) as s:
+            logger.info("Server listening on %s:%d (%s mode)", self.host, self.port, self.mode)
+            resp_socket = None
+            if self.resp_port:
+                resp_socket = self.listen(self.resp_port)
+                logger.info("RESP listener on %s:%d", self.host, self.resp_port)
+            if self.metrics_port:
+                self.metrics_server = MetricsServer(self, self.host, self.metrics_port)
+                self.metrics_server.start()
+                logger.info("Metrics endpoint on http://%s:%d/metrics", self.host, self.metrics_port)
             
             # Start periodic data saving in a separate thread
             save_thread = threading.Thread(target=self.periodic_save, daemon=True)
@@ -50,96 +337,263 @@ class TCPServer:
             #added
             ttl_cleanup_thread = threading.Thread(target=self.periodic_ttl_cleanup, daemon=True)
             ttl_cleanup_thread.start()
+            self.invalidator.start()
+
+            if self.replica_of:
+                self.replicaof(*self.replica_of)
 
             try:
-                while self.running:
-                    try:
-                        s.settimeout(1.0)  # Allow checking self.running every second
-                        conn, addr = s.accept()
-                        with self.clients_lock:
-                            self.clients.add(conn)
-                        client_thread = threading.Thread(target=self.handle_client, args=(conn, addr))
-                        client_thread.daemon = True
-                        client_thread.start()
-                    except socket.timeout:
-                        continue
+                if self.mode == "eventloop":
+                    self.event_loop_server = EventLoopServer(self, self.workers)
+                    self.event_loop_server.serve(s, resp_socket)
+                else:
+                    if resp_socket:
+                        threading.Thread(target=self.serve_threaded, args=(resp_socket, self.handle_resp_client),
+                                         daemon=True).start()
+                    self.serve_threaded(s)
             except KeyboardInterrupt:
-                print("Server shutdown initiated")
+                logger.info("Server shutdown initiated")
             finally:
                 self.running = False
-                print("Server shutdown complete")
+                self.invalidator.stop()
+                if resp_socket:
+                    resp_socket.close()
+                if self.metrics_server:
+                    self.metrics_server.stop()
+                    self.metrics_server = None
+                logger.info("Server shutdown complete")
+
+    def serve_threaded(self, s, handler=None):
+        """Accept connections and serve each one from its own thread."""
+        handler = handler or self.handle_client
+        while self.running:
+            try:
+                s.settimeout(1.0)  # Allow checking self.running every second
+                sock, addr = s.accept()
+                conn = SocketConnection(sock)
+                with self.clients_lock:
+                    self.clients.add(conn)
+                client_thread = threading.Thread(target=handler, args=(conn, addr))
+                client_thread.daemon = True
+                client_thread.start()
+            except socket.timeout:
+                continue
 
-    def periodic_save(self, interval=60):
-        """Periodically save data to disk"""
+    def periodic_save(self, interval=1, save_points=SAVE_POINTS):
+        """Take a background snapshot whenever one of the save points is reached."""
         while self.running:
             time.sleep(interval)
-            self.save_data()
-            print(f"Periodic data save completed at {time.strftime('%Y-%m-%d %H:%M:%S')}")
+            self.stats.sample()
+            self.replication.heartbeat()
+            self.db.compact_spill()
+            elapsed = time.time() - self.last_save
+            if any(elapsed >= seconds and self.dirty >= changes for seconds, changes in save_points):
+                self.background_save()
 
     #added
-    def periodic_ttl_cleanup(self, interval=1):
+    def periodic_ttl_cleanup(self, interval=EXPIRE_CYCLE_INTERVAL, time_budget=EXPIRE_CYCLE_BUDGET):
+        """Actively expire due keys, spending at most time_budget per cycle."""
         while self.running:
             time.sleep(interval)
-            # Get current time once to avoid inconsistencies
-            current_time = time.time()
-            expired_keys = [
-                key for key, expiry_time in list(self.db.ttl_data.items())
-                if expiry_time < current_time
-            ]
-
-            for key in expired_keys:
-                if key in self.db.data:
-                    del self.db.data[key]
-                    del self.db.ttl_data[key]
-                    print(f"TTL expired for key: {key}")
-                    self.db.notify_observers("expire", key)
-
+            expired = self.db.expire_due(time_budget)
+            if expired:
+                logger.debug("TTL expired for %d keys", expired)
 
     def handle_client(self, conn, addr):
         """Handle communication with a client."""
+        reader = FrameReader()
         try:
-            print(f"Connected by {addr}")
+            logger.debug("Connected by %s", addr)
             while self.running:
                 try:
                     conn.settimeout(1.0)
-                    data = conn.recv(1024)
+                    data = conn.recv(RECV_SIZE)
+                    if not data:
+                        break
+                    reader.feed(data)
+                    # Answer every pipelined command that has arrived with one write
+                    responses = [self.process_frame(payload, conn) for payload in reader.frames()]
+                    if responses:
+                        conn.sendall(b''.join(responses))
+                except socket.timeout:
+                    continue
+                except ValueError as e:
+                    # The stream can't be resynchronized after a bad frame header
+                    logger.warning("Protocol error from %s: %s", addr, e)
+                    conn.sendall(encode_frame({"error": str(e)}))
+                    break
+        except Exception as e:
+            logger.warning("Connection error with %s: %s", addr, e)
+        finally:
+            self.close_client(conn, addr)
+
+    def handle_resp_client(self, conn, addr):
+        """Handle communication with a client speaking RESP."""
+        session = RespSession(self, conn)
+        try:
+            logger.debug("RESP client connected from %s", addr)
+            while self.running and not session.closing:
+                try:
+                    conn.settimeout(1.0)
+                    data = conn.recv(RECV_SIZE)
                     if not data:
                         break
-                    
-                    command = json.loads(data.decode('utf-8'))
-                    print(f"Received command: {command}")
-                    
-                    # Check if it's a PubSub command
-                    if command.get("type") == "pubsub":
-                        response = self.pubsub.handle_command(command, conn)
-                    else:
-                        response = self.handle_db_command(command)
-                        
-                        # If it was a data modification command, publish an update
-                        if command.get("action") in ["set", "set_with_ttl", "delete"]:
-                            key = command.get("key", "")
-                            self.pubsub.publish("db_updates", {
-                                "operation": command.get("action"),
-                                "key": key,
-                                "timestamp": time.time()
-                            })
-                    
-                    conn.sendall(json.dumps(response).encode('utf-8'))
+                    # Answer every pipelined command that has arrived with one write
+                    replies = session.handle(data)
+                    if replies:
+                        conn.sendall(replies)
                 except socket.timeout:
                     continue
-                except json.JSONDecodeError:
-                    conn.sendall(json.dumps({"error": "Invalid JSON"}).encode('utf-8'))
-                except Exception as e:
-                    print(f"Error handling client {addr}: {e}")
-                    conn.sendall(json.dumps({"error": str(e)}).encode('utf-8'))
+                except RespProtocolError as e:
+                    logger.warning("Protocol error from %s: %s", addr, e)
+                    conn.sendall(encode_error(f"ERR Protocol error: {e}"))
+                    break
         except Exception as e:
-            print(f"Connection error with {addr}: {e}")
+            logger.warning("Connection error with %s: %s", addr, e)
         finally:
-            with self.clients_lock:
-                if conn in self.clients:
-                    self.clients.remove(conn)
-            conn.close()
-            print(f"Connection closed with {addr}")
+            self.close_client(conn, addr)
+
+    def close_client(self, conn, addr):
+        """Forget a client connection and its subscriptions, and close it."""
+        with self.clients_lock:
+            if conn in self.clients:
+                self.clients.remove(conn)
+        self.pubsub.drop_client(conn)
+        self.replication.drop(conn)
+        self.stats.retire()
+        conn.close()
+        logger.debug("Connection closed with %s", addr)
+
+    def record_command(self, name, ns, describe, conn):
+        """Count a command in the statistics, and in the slowlog if it was slow.
+
+        describe() returns the command's arguments; it is only called for
+        slow commands.
+        """
+        self.stats.record(name, ns)
+        if self.slowlog.is_slow(ns):
+            try:
+                host, port = conn.getpeername()[:2]
+                client = f"{host}:{port}"
+            except Exception:
+                client = None
+            self.slowlog.add(ns, describe(), client)
+
+    def process_frame(self, payload, conn):
+        """Decode one request frame, execute it and return the encoded response."""
+        return self.process_command(self.decode_request(payload), conn)
+
+    @staticmethod
+    def decode_request(payload):
+        """The command in a request frame, or None if it is not valid JSON."""
+        try:
+            return decode_frame(payload)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return None
+
+    @staticmethod
+    def blocks(command):
+        """Whether a decoded request may run long enough to stall an event loop, such as a foreground save."""
+        if not isinstance(command, dict):
+            return False
+        action = command.get("action")
+        if action == "cluster":
+            return command.get("subcommand") == "migrate"
+        return action in BLOCKING_ACTIONS
+
+    def process_command(self, command, conn):
+        """Execute a request decoded by decode_request() and return the encoded response."""
+        try:
+            if command is None:
+                raise json.JSONDecodeError("Not a JSON document", "", 0)
+            logger.debug("Received command: %s", command)
+            started = time.perf_counter_ns()
+            response = None
+            try:
+                response = self.execute_command(command, conn)
+            finally:
+                action = command.get("action") if isinstance(command, dict) else None
+                if not isinstance(action, str) or (response or {}).get("error") in UNKNOWN_COMMAND_ERRORS:
+                    action = "unknown"
+                self.record_command(action, time.perf_counter_ns() - started,
+                                    lambda: describe_command(command), conn)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            response = {"error": "Invalid JSON"}
+        except Exception as e:
+            logger.error("Error handling command: %s", e)
+            response = {"error": str(e)}
+        if response is None:
+            return b''  # Replication requests get no reply
+        return encode_frame(response)
+
+    def execute_command(self, command, conn):
+        """Run one decoded command and return its response."""
+        action = command.get("action")
+        # Check if it's a PubSub command
+        if command.get("type") == "pubsub":
+            response = self.pubsub.handle_command(command, conn)
+        elif action in ("sync", "replconf"):
+            return self.replication.handle_command(command, conn, self.snapshot_items)
+        elif self.replica and (action in WRITE_ACTIONS or action in WRITE_COMMANDS):
+            response = {"error": READONLY_ERROR}
+        else:
+            try:
+                with self.serving(command):
+                    response = self.handle_db_command(command)
+            except ClusterRedirect as e:
+                response = {"error": str(e)}
+
+            # If it was a data modification command, publish an update
+            if ((command.get("action") in ["set", "set_with_ttl", "delete"] + ATOMIC_COMMANDS or command.get("action") in WRITE_COMMANDS)
+                    and "error" not in response and response.get("result") is not False):
+                self.publish_update(command.get("action"), command.get("key", ""))
+            elif command.get("action") in ["mset", "mdelete", "unlink", "mexpire"] and "error" not in response and self.pubsub.has_subscribers("db_updates"):
+                # One notification for the whole batch
+                keys = command.get("keys")
+                if keys is None:
+                    keys = self.batch_items(command.get("items"))[0]
+                self.publish_update(command.get("action"), keys=keys)
+
+        # Echo the request id so pipelining clients can match responses
+        if "id" in command:
+            response["id"] = command["id"]
+        return response
+
+    def serving(self, command):
+        """Context to run a command in. In cluster mode it raises ClusterRedirect for keys owned elsewhere."""
+        if not self.cluster or not (command.get("action") in KEY_ACTIONS or command.get("action") in COMMANDS):
+            return nullcontext()
+        keys = []
+        if "key" in command:
+            keys.append(command["key"])
+        if isinstance(command.get("keys"), list):
+            keys.extend(command["keys"])
+        if command.get("action") == "mset":
+            keys.extend(self.batch_items(command.get("items"))[0] or [])
+        return self.cluster.serving(keys, command.get("asking", False))
+
+    def publish_update(self, operation, key=None, keys=None):
+        """Announce a change to one key, or to several keys, on the db_updates channel."""
+        if not self.pubsub.has_subscribers("db_updates"):
+            return
+        update = {"operation": operation}
+        if keys is None:
+            update["key"] = key
+        else:
+            update["keys"] = keys
+        update["timestamp"] = time.time()
+        self.pubsub.publish("db_updates", update)
+
+    def batch_items(self, items):
+        """Split MSET items, a dict or a list of [key, value] pairs, into (keys, values).
+
+        Returns (None, None) if items is malformed.
+        """
+        if isinstance(items, dict):
+            return list(items.keys()), list(items.values())
+        if isinstance(items, list) and all(isinstance(item, list) and len(item) == 2 for item in items):
+            return [item[0] for item in items], [item[1] for item in items]
+        return None, None
 
     def handle_db_command(self, command):
         """Handle database commands."""
@@ -148,16 +602,24 @@ class TCPServer:
         value = command.get("value")
         ttl = command.get("ttl")
     
+        track = command.get("track")
+        if track is not None and not isinstance(track, str):
+            return {"error": "track must be a string token"}
+
         if action == "get":
-            result = self.db.get(key)
+            if track is not None:
+                self.tracker.track(track, [key])
+            result, version = self.db.gets(key)
+            if isinstance(result, Collection):
+                return {"error": str(WrongTypeError())}
             # Add TTL information if available
             remaining_ttl = None
-            if key in self.db.ttl_data:
-                remaining_ttl = max(0, int(self.db.ttl_data[key] - time.time()))
-            return {"result": result, "ttl_remaining": remaining_ttl}
+            expire_at = self.db.expiry(key)
+            if expire_at is not None:
+                remaining_ttl = max(0, int(expire_at - time.time()))
+            return {"result": result, "ttl_remaining": remaining_ttl, "version": version}
         elif action == "set":
             self.db.set(key, value)
-            self.save_data()
             return {"result": "OK"}
         elif action == "set_with_ttl":
             if ttl is None:
@@ -165,25 +627,237 @@ class TCPServer:
             try:
                 ttl_value = int(ttl)
                 self.db.set(key, value, ttl_value)
-                self.save_data()
                 return {"result": "OK", "ttl_set": ttl_value}
             except ValueError:
                 return {"error": "TTL must be an integer"}
         elif action == "delete":
             success = self.db.delete(key)
-            self.save_data()
             return {"result": "OK" if success else "Key not found"}
+        elif action in ("mget", "mdelete", "unlink", "mexpire"):
+            keys = command.get("keys")
+            if not isinstance(keys, list):
+                return {"error": "keys must be a list"}
+            if action == "mget":
+                if track is not None:
+                    self.tracker.track(track, keys)
+                return {"result": self.db.mget(keys)}
+            if action in ("mdelete", "unlink"):
+                # unlink always frees large values in the background
+                deleted = self.db.mdelete(keys, lazy=True if action == "unlink" else None)
+                return {"result": deleted, "deleted": sum(deleted)}
+            if ttl is None:
+                return {"error": "TTL not provided"}
+            try:
+                ttl_value = int(ttl)
+            except ValueError:
+                return {"error": "TTL must be an integer"}
+            return {"result": self.db.mexpire(keys, ttl_value), "ttl_set": ttl_value}
+        elif action == "mset":
+            keys, values = self.batch_items(command.get("items"))
+            if keys is None:
+                return {"error": "items must be an object or a list of [key, value] pairs"}
+            ttl_value = None
+            if ttl is not None:
+                try:
+                    ttl_value = int(ttl)
+                except ValueError:
+                    return {"error": "TTL must be an integer"}
+            self.db.mset(zip(keys, values), ttl_value)
+            response = {"result": "OK", "count": len(keys)}
+            if ttl_value is not None:
+                response["ttl_set"] = ttl_value
+            return response
+        elif action in ("incr", "decr"):
+            return {"result": self.db.incr(key, command.get("amount", 1)) if action == "incr"
+                    else self.db.decr(key, command.get("amount", 1))}
+        elif action == "append":
+            return {"result": self.db.append(key, value)}
+        elif action == "getset":
+            return {"result": self.db.getset(key, value)}
+        elif action in ("setnx", "cas"):
+            ttl_value = None
+            if ttl is not None:
+                try:
+                    ttl_value = int(ttl)
+                except ValueError:
+                    return {"error": "TTL must be an integer"}
+            if action == "setnx":
+                return {"result": self.db.setnx(key, value, ttl_value)}
+            version = command.get("version")
+            if not isinstance(version, int) or isinstance(version, bool):
+                return {"error": "version must be an integer"}
+            ok, version = self.db.cas(key, version, value, ttl_value)
+            return {"result": ok, "version": version}
+        elif action in COMMANDS:
+            args = command.get("args", [])
+            if not isinstance(args, list):
+                return {"error": "args must be a list"}
+            try:
+                return {"result": self.db.command(action, key, args)}
+            except TypeError:
+                return {"error": f"Wrong arguments for '{action}'"}
+        elif action == "type":
+            value_type, encoding = self.db.key_type(key)
+            return {"result": value_type, "encoding": encoding}
         elif action == "keys":
             keys = self.db.keys()
             return {"result": keys}
+        elif action == "scan":
+            try:
+                cursor = int(command.get("cursor", 0))
+                count = int(command.get("count", 10))
+            except (TypeError, ValueError):
+                return {"error": "Cursor and count must be integers"}
+            if cursor < 0 or count < 1:
+                return {"error": "Invalid cursor or count"}
+            next_cursor, keys = self.db.scan(cursor, command.get("match"), count)
+            return {"result": keys, "cursor": next_cursor}
+        elif action in ("info", "stats"):
+            info = self.info()
+            section = command.get("section")
+            if section is not None:
+                if section not in info:
+                    return {"error": f"Unknown info section '{section}'"}
+                info = {section: info[section]}
+            return {"result": info}
+        elif action == "flushall":
+            lazy = command.get("async")
+            if lazy is not None and not isinstance(lazy, bool):
+                return {"error": "async must be true or false"}
+            self.db.clear(lazy)
+            return {"result": "OK"}
+        elif action == "changes":
+            offset = command.get("offset")
+            count = command.get("count", 100)
+            if offset is None:
+                offset = self.db.changes.next_offset()
+            if not isinstance(offset, int) or not isinstance(count, int) or offset < 1 or count < 1:
+                return {"error": "offset and count must be positive integers"}
+            try:
+                events = self.db.changes.read(offset, min(count, self.db.changes.size))
+            except ChangesLost as e:
+                return {"error": str(e), "oldest_offset": e.oldest}
+            return {"result": [list(event) for event in events],
+                    "next_offset": events[-1][0] + 1 if events else offset}
+        elif action == "slowlog":
+            subcommand = command.get("subcommand", "get")
+            if subcommand == "get":
+                try:
+                    count = int(command.get("count", 10))
+                except (TypeError, ValueError):
+                    return {"error": "count must be an integer"}
+                return {"result": self.slowlog.get(count)}
+            if subcommand == "len":
+                return {"result": len(self.slowlog)}
+            if subcommand == "reset":
+                self.slowlog.reset()
+                return {"result": "OK"}
+            return {"error": "subcommand must be 'get', 'len' or 'reset'"}
+        elif action == "cluster":
+            if not self.cluster:
+                return {"error": "This instance has cluster support disabled"}
+            return self.cluster.handle_command(command)
+        elif action == "replicaof":
+            host = command.get("host")
+            if host is None:
+                self.replicaof(None)
+                return {"result": "OK"}
+            port = command.get("port")
+            if not isinstance(port, int):
+                return {"error": "port must be an integer"}
+            self.replicaof(host, port)
+            return {"result": "OK"}
+        elif action == "memory":
+            stats = self.db.memory_stats()
+            stats["keys"] = len(self.db.data)
+            return {"result": stats}
+        elif action == "save":
+            self.save_data()
+            return {"result": "OK"}
+        elif action == "bgsave":
+            started = self.background_save()
+            return {"result": "Background saving started" if started else "Background save already in progress"}
+        elif action == "rewrite_aof":
+            if not self.aof:
+                return {"error": "Append-only log is disabled"}
+            started = self.aof.rewrite_in_background()
+            return {"result": "OK" if started else "Rewrite already in progress"}
         else:
             return {"error": "Invalid action"}
 
+    def info(self):
+        """Server statistics grouped into sections, as returned by the info command."""
+        now = time.time()
+        histograms = self.stats.histograms()
+        ops_per_sec = self.stats.ops_per_sec()
+        keyspace = self.db.keyspace_stats()
+        memory = self.db.memory_stats()
+        with self.clients_lock:
+            connected = len(self.clients)
+        persistence = {
+            "changes_since_last_save": self.dirty,
+            "last_save_time": int(self.last_save),
+            "seconds_since_last_save": int(now - self.last_save),
+            "bgsave_in_progress": self.snapshot.in_progress,
+            "last_bgsave_ok": self.last_bgsave_ok,
+            "aof_enabled": self.aof is not None,
+            "loaded_entries": self.last_load.get("entries", 0),
+            "load_seconds": self.last_load.get("seconds", 0.0),
+        }
+        if self.aof:
+            persistence.update(self.aof.stats())
+        info = {
+            "server": {
+                "mode": self.mode,
+                "process_id": os.getpid(),
+                "port": self.port,
+                "resp_port": self.resp_port,
+                "metrics_port": self.metrics_port,
+                "uptime_seconds": int(now - self.started_at),
+            },
+            "clients": {"connected_clients": connected},
+            "memory": memory,
+            "persistence": persistence,
+            "stats": {
+                "total_commands": sum(histogram.total for histogram in histograms.values()),
+                "instantaneous_ops_per_sec": round(sum(ops_per_sec.values()), 2),
+                "expired_keys": keyspace.pop("expired_keys"),
+                "evicted_keys": memory["evicted_keys"],
+                "slowlog_length": len(self.slowlog),
+            },
+            "keyspace": keyspace,
+            "pubsub": self.pubsub.stats(),
+            "tracking": dict(self.tracker.stats(), invalidation_lag=self.invalidator.stats()["lag"]),
+            "changes": self.db.changes.stats(),
+            "replication": self.replica.info() if self.replica else self.replication.info(),
+            "commandstats": {
+                action: {
+                    "calls": histogram.total,
+                    "ops_per_sec": round(ops_per_sec.get(action, 0.0), 2),
+                    "usec_per_call": round(histogram.sum_ns / histogram.total / 1000, 2),
+                    "p50_usec": round(histogram.percentile(50) * 1000, 2),
+                    "p99_usec": round(histogram.percentile(99) * 1000, 2),
+                    "p999_usec": round(histogram.percentile(99.9) * 1000, 2),
+                    "max_usec": round(histogram.max_ns / 1000, 2),
+                }
+                for action, histogram in sorted(histograms.items())
+            },
+        }
+        if self.cluster:
+            info["cluster"] = self.cluster.info()
+        return info
+
     def shutdown(self):
         """Gracefully shutdown the server."""
         self.running = False
+        if self.replica:
+            self.replica.stop()
+        if self.event_loop_server:
+            self.event_loop_server.stop()
         self.save_data()
-        print("Server is shutting down...")
+        if self.aof:
+            self.aof.close()
+        logger.info("Server is shutting down...")
         with self.clients_lock:
             for client in self.clients:
                 try:
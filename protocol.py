@@ -0,0 +1,69 @@
+#protocol.py
+import json
+import struct
+from collections import deque
+from config import MAX_FRAME_SIZE
+
+# Every message on the wire is a 4 byte big-endian length followed by that
+# many bytes of UTF-8 JSON.
+HEADER = struct.Struct('>I')
+RECV_SIZE = 64 * 1024
+
+def encode_frame(message):
+    """Serialize a message into one length-prefixed frame."""
+    payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(len(payload)) + payload
+
+def decode_frame(payload):
+    """Deserialize the payload of one frame."""
+    return json.loads(payload.decode('utf-8'))
+
+class FrameReader:
+    """Buffers a byte stream and splits it into frame payloads.
+
+    Bytes can arrive in any chunking: a frame split over several reads is held
+    until it is complete, and several frames in one read are all returned.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.pending = deque()  # Parsed frames not yet handed out by read_frame
+        self.max_frame_size = max_frame_size
+
+    def feed(self, data):
+        self.buffer += data
+
+    def frames(self):
+        """Return the payloads of all complete frames received so far."""
+        payloads = list(self.pending)
+        self.pending.clear()
+        pos = 0
+        buffer = self.buffer
+        while len(buffer) - pos >= HEADER.size:
+            (length,) = HEADER.unpack_from(buffer, pos)
+            if length > self.max_frame_size:
+                raise ValueError(f"Frame of {length} bytes exceeds the {self.max_frame_size} byte limit")
+            end = pos + HEADER.size + length
+            if end > len(buffer):
+                break
+            payloads.append(bytes(buffer[pos + HEADER.size:end]))
+            pos = end
+        if pos:
+            del buffer[:pos]
+        return payloads
+
+    def read_frame(self, sock):
+        """Block until one frame has arrived on sock and return its payload.
+
+        Frames that arrived together with it stay buffered for the next call.
+        Returns None if the connection was closed.
+        """
+        while not self.pending:
+            self.pending.extend(self.frames())
+            if self.pending:
+                break
+            data = sock.recv(RECV_SIZE)
+            if not data:
+                return None
+            self.feed(data)
+        return self.pending.popleft()
\ No newline at end of file
@@ -1,57 +1,499 @@
 #pubsub.py
+import re
 import threading
-import json
+import itertools
 import socket
-from collections import defaultdict
+from collections import defaultdict, deque
+from protocol import encode_frame
+import resp
+from scan import compile_pattern
+from config import PUBSUB_OUTPUT_BUFFER_LIMIT, PUBSUB_SLOW_CONSUMER_POLICY, PUBSUB_BLOCK_TIMEOUT
+from log import get_logger
+
+logger = get_logger('pubsub')
+
+SLOW_CONSUMER_POLICIES = ('drop', 'disconnect', 'block')
+
+class Subscriber:
+    """Outbound message queue for one subscribed connection.
+
+    Publishers only append the already encoded frame to the queue, which is
+    drained to the connection with whatever has piled up batched into one
+    write. A connection served by an event loop is drained by a callback on
+    its loop into the transport's write buffer, and the bytes waiting there
+    count as pending; any other connection gets a sender thread. When more
+    than buffer_limit bytes are waiting, the slow-consumer policy decides
+    what happens to a new message:
+
+    - drop:       the message is discarded for this subscriber only.
+    - disconnect: the subscriber's connection is closed.
+    - block:      the publisher waits up to block_timeout for room, then
+                  disconnects the subscriber.
+    """
+
+    def __init__(self, client, on_close, buffer_limit=PUBSUB_OUTPUT_BUFFER_LIMIT,
+                 policy=PUBSUB_SLOW_CONSUMER_POLICY, block_timeout=PUBSUB_BLOCK_TIMEOUT):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.client = client
+        self.on_close = on_close
+        self.buffer_limit = buffer_limit
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.protocol = 'json'  # Wire format of messages: 'json', 'resp2' or 'resp3'
+        self.channels = set()
+        self.patterns = set()
+        self.queue = deque()
+        self.pending = 0  # Bytes queued or being written, besides those in a loop's transport
+        self.dropped = 0
+        self.slow = False  # Disconnected for falling behind
+        self.closed = False
+        self.cond = threading.Condition()
+        self.loop = getattr(client, 'loop', None)  # The event loop serving the connection, if any
+        self.flush_scheduled = False
+        if self.loop is None:
+            self.thread = threading.Thread(target=self._drain, daemon=True)
+            self.thread.start()
+        else:
+            self.thread = None
+            client.on_drain = self._drained
+
+    def backlog(self):
+        """Bytes waiting to be sent."""
+        if self.loop is None:
+            return self.pending
+        return self.pending + self.client.transport.get_write_buffer_size()
+
+    def deliver(self, frame):
+        """Queue an encoded frame for sending. Returns False if it was not queued."""
+        with self.cond:
+            if self.closed:
+                return False
+
+            def fits():
+                # A single message larger than the limit still goes to an idle subscriber
+                backlog = self.backlog()
+                return not backlog or backlog + len(frame) <= self.buffer_limit
+
+            if not fits():
+                if self.policy == 'drop':
+                    self.dropped += 1
+                    return False
+                if self.policy == 'block' and not self._on_loop():
+                    self.cond.wait_for(lambda: self.closed or fits(), self.block_timeout)
+                    if self.closed:
+                        return False
+            if fits():
+                self.queue.append(frame)
+                self.pending += len(frame)
+                if self.loop is None:
+                    self.cond.notify_all()
+                elif not self.flush_scheduled:
+                    self.flush_scheduled = True
+                    self.loop.call_soon_threadsafe(self._flush)
+                return True
+            logger.warning("Disconnecting slow subscriber with %d bytes pending", self.backlog())
+            self.slow = True
+        self.close()
+        return False
+
+    def wait_for_room(self, size, timeout=None):
+        """Block until a frame of size bytes fits in the buffer.
+
+        Lets a producer that can afford to wait avoid the slow-consumer
+        policy. Returns False if the subscriber was closed.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.closed or not self.backlog() or self.backlog() + size <= self.buffer_limit,
+                               timeout)
+            return not self.closed
+
+    def _on_loop(self):
+        # Waiting for room on the loop thread would stop the loop from making any
+        return self.loop is not None and self.client.loop_thread == threading.get_ident()
+
+    def _flush(self):
+        """Move the queued frames into the transport; runs on the connection's loop."""
+        with self.cond:
+            self.flush_scheduled = False
+            if self.closed or not self.queue:
+                return
+            data = b''.join(self.queue)
+            self.queue.clear()
+            self.pending -= len(data)
+        try:
+            self.client.sendall(data)
+        except Exception as e:
+            logger.info("Error sending message to client: %s", e)
+            self.close()
+            return
+        # The transport usually sends most of it right away
+        self._drained()
+
+    def _drained(self):
+        """Called on the loop once the transport's write buffer has room again."""
+        with self.cond:
+            self.cond.notify_all()
+
+    def _drain(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.queue or self.closed)
+                if self.closed:
+                    return
+                frames = list(self.queue)
+                self.queue.clear()
+            data = b''.join(frames)
+            try:
+                self._write(data)
+            except Exception as e:
+                logger.info("Error sending message to client: %s", e)
+                self.close()
+                return
+            with self.cond:
+                self.pending -= len(data)
+                self.cond.notify_all()
+
+    def _write(self, data):
+        # The connection serializes this with the responses its own thread writes
+        self.client.sendall(data)
+
+    def close(self):
+        """Stop sending, close the connection and drop the subscriptions."""
+        if not self.stop():
+            return
+        try:
+            # shutdown() also wakes up a sender blocked in sendall()
+            self.client.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        self.on_close(self)
+
+    def stop(self):
+        """Stop the sender thread without touching the connection.
+
+        Returns False if the subscriber was already stopped.
+        """
+        with self.cond:
+            if self.closed:
+                return False
+            self.closed = True
+            self.queue.clear()
+            self.cond.notify_all()
+            return True
+
+
+class PatternIndex:
+    """Glob patterns indexed by their literal prefix, or else their literal suffix.
+
+    Each pattern is stored in a character trie under the part before its
+    first wildcard, so publishing to a channel only tests the patterns whose
+    prefix the channel starts with, found by walking the channel name down
+    the trie. A pattern that starts with a wildcard, such as '*.errors',
+    goes into a second trie under the part after its last wildcard, walked
+    with the channel name reversed. The patterns that start and end with a
+    wildcard share one compiled expression, which rules out a channel none
+    of them matches in a single test. The patterns matching a channel are
+    also cached until the set of patterns changes.
+    """
+
+    WILDCARDS = '*?[\\'
+    # Characters a literal suffix stops at, including the end of a character class
+    SUFFIX_STOPS = '*?[]\\'
+
+    def __init__(self):
+        self.root = {}  # char -> node; a node's None key holds {pattern: compiled}
+        self.suffix_root = {}  # The same, for suffixes, reversed
+        self.unanchored = {}  # pattern -> compiled, for patterns with neither
+        self.unanchored_filter = None  # Matches what any of the unanchored patterns matches
+        self.size = 0
+        self.cache = {}  # channel -> tuple of matching patterns
+
+    def __len__(self):
+        return self.size
+
+    def _prefix(self, pattern):
+        for i, c in enumerate(pattern):
+            if c in self.WILDCARDS:
+                return pattern[:i]
+        return pattern
+
+    def _reversed_suffix(self, pattern):
+        suffix = []
+        for c in reversed(pattern):
+            if c in self.SUFFIX_STOPS:
+                break
+            suffix.append(c)
+        return ''.join(suffix)
+
+    def _place(self, pattern):
+        """The trie and path a pattern is stored under, or (None, None) if it has no literal end."""
+        prefix = self._prefix(pattern)
+        if prefix:
+            return self.root, prefix
+        suffix = self._reversed_suffix(pattern)
+        if suffix:
+            return self.suffix_root, suffix
+        return None, None
+
+    def add(self, pattern):
+        root, path = self._place(pattern)
+        if root is None:
+            if pattern in self.unanchored:
+                return
+            self.unanchored[pattern] = compile_pattern(pattern)
+            self._compile_filter()
+        else:
+            node = root
+            for c in path:
+                node = node.setdefault(c, {})
+            patterns = node.setdefault(None, {})
+            if pattern in patterns:
+                return
+            patterns[pattern] = compile_pattern(pattern)
+        self.size += 1
+        self.cache.clear()
+
+    def remove(self, pattern):
+        root, path = self._place(pattern)
+        if root is None:
+            if self.unanchored.pop(pattern, None) is None:
+                return
+            self._compile_filter()
+        elif not self._remove(root, path, pattern):
+            return
+        self.size -= 1
+        self.cache.clear()
+
+    def _remove(self, root, path, pattern):
+        nodes = [root]
+        for c in path:
+            node = nodes[-1].get(c)
+            if node is None:
+                return False
+            nodes.append(node)
+        patterns = nodes[-1].get(None)
+        if not patterns or pattern not in patterns:
+            return False
+        del patterns[pattern]
+        if not patterns:
+            del nodes[-1][None]
+        # Prune the branches that no longer lead to a pattern
+        for c, parent in zip(reversed(path), reversed(nodes[:-1])):
+            if parent[c]:
+                break
+            del parent[c]
+        return True
+
+    def _compile_filter(self):
+        regexes = self.unanchored.values()
+        self.unanchored_filter = re.compile('|'.join(f'(?:{regex.pattern})' for regex in regexes),
+                                            re.DOTALL) if regexes else None
+
+    def match(self, channel):
+        """Return the patterns that match channel."""
+        matched = self.cache.get(channel)
+        if matched is not None:
+            return matched
+        matched = []
+        text = str(channel)
+        self._walk(self.root, text, text, matched)
+        if self.suffix_root:
+            self._walk(self.suffix_root, text[::-1], text, matched)
+        if self.unanchored_filter is not None and self.unanchored_filter.fullmatch(text):
+            matched.extend(pattern for pattern, regex in self.unanchored.items() if regex.fullmatch(text))
+        matched = tuple(matched)
+        if len(self.cache) >= 4096:
+            self.cache.clear()
+        self.cache[channel] = matched
+        return matched
+
+    @staticmethod
+    def _walk(node, path, text, matched):
+        """Test text against the patterns stored along path in the trie at node."""
+        for c in itertools.chain(path, (None,)):
+            patterns = node.get(None)
+            if patterns:
+                matched.extend(pattern for pattern, regex in patterns.items() if regex.fullmatch(text))
+            node = node.get(c) if c is not None else None
+            if node is None:
+                break
+
+
+def encode_message(protocol, channel, message, pattern=None):
+    """Encode a published message in a subscriber's wire format."""
+    if protocol == 'json':
+        frame = {"channel": channel, "message": message}
+        if pattern is not None:
+            frame["pattern"] = pattern
+        return encode_frame(frame)
+    return resp.encode_message(3 if protocol == 'resp3' else 2, channel, message, pattern)
+
 
 class PubSub:
+    """Channels, patterns and their subscribers.
+
+    publish() encodes a message once per wire format and hands the same frame
+    to every subscriber's queue, so its cost does not depend on how fast subscribers
+    read. The lock is only held to look subscribers up. One connection can
+    hold any number of channel and pattern subscriptions.
+    """
+
     def __init__(self):
         self.channels = defaultdict(set)  # Dictionary to store channels and their subscribers
+        self.patterns = defaultdict(set)  # pattern -> subscribers
+        self.pattern_index = PatternIndex()
+        self.subscribers = {}  # client -> Subscriber
         self.lock = threading.Lock()
+        self.published = 0  # Messages published
+        self.deliveries = 0  # Messages handed to subscribers, the fan-out of published
+        self.dropped = 0  # Messages dropped for subscribers that are gone
+        self.slow_disconnects = 0
+
+    def _subscriber(self, client, protocol):
+        subscriber = self.subscribers.get(client)
+        if subscriber is None:
+            subscriber = self.subscribers[client] = Subscriber(client, self.remove_subscriber)
+        subscriber.protocol = protocol
+        return subscriber
+
+    def _release(self, subscriber):
+        """Stop a subscriber once its last subscription is gone."""
+        if not subscriber.channels and not subscriber.patterns:
+            del self.subscribers[subscriber.client]
+            subscriber.stop()
+            self._retire(subscriber)
 
-    def subscribe(self, channel, client):
-        """Subscribe a client to a channel."""
+    def _retire(self, subscriber):
+        """Move a departing subscriber's counters into the totals, once."""
+        self.dropped += subscriber.dropped
+        self.slow_disconnects += subscriber.slow
+        subscriber.dropped = 0
+        subscriber.slow = False
+
+    def subscribe(self, channel, client, protocol='json'):
+        """Subscribe a client to a channel; messages are sent in the given wire format."""
         with self.lock:
-            self.channels[channel].add(client)
+            subscriber = self._subscriber(client, protocol)
+            subscriber.channels.add(channel)
+            self.channels[channel].add(subscriber)
             return True
 
     def unsubscribe(self, channel, client):
         """Unsubscribe a client from a channel."""
         with self.lock:
-            if channel in self.channels and client in self.channels[channel]:
-                self.channels[channel].remove(client)
-                if not self.channels[channel]:
-                    del self.channels[channel]
+            subscriber = self.subscribers.get(client)
+            if subscriber is not None and subscriber in self.channels.get(channel, ()):
+                self._unsubscribe(channel, subscriber)
+                self._release(subscriber)
                 return True
             return False
 
-    def publish(self, channel, message):
-        """Publish a message to all clients subscribed to a channel."""
-        clients_to_remove = []
+    def _unsubscribe(self, channel, subscriber):
+        subscriber.channels.discard(channel)
+        self.channels[channel].discard(subscriber)
+        if not self.channels[channel]:
+            del self.channels[channel]
+
+    def psubscribe(self, pattern, client, protocol='json'):
+        """Subscribe a client to every channel matching a glob pattern."""
         with self.lock:
-            if channel in self.channels:
-                for client in self.channels[channel]:
-                    try:
-                        client.sendall(json.dumps({"channel": channel, "message": message}).encode('utf-8'))
-                    except Exception as e:
-                        print(f"Error sending message to client: {e}")
-                        clients_to_remove.append((channel, client))
-                
-                # Clean up disconnected clients
-                for ch, client in clients_to_remove:
-                    if ch in self.channels and client in self.channels[ch]:
-                        self.channels[ch].remove(client)
-                        if not self.channels[ch]:
-                            del self.channels[ch]
+            subscriber = self._subscriber(client, protocol)
+            subscriber.patterns.add(pattern)
+            self.patterns[pattern].add(subscriber)
+            self.pattern_index.add(pattern)
+            return True
+
+    def punsubscribe(self, pattern, client):
+        """Unsubscribe a client from a pattern."""
+        with self.lock:
+            subscriber = self.subscribers.get(client)
+            if subscriber is not None and subscriber in self.patterns.get(pattern, ()):
+                self._punsubscribe(pattern, subscriber)
+                self._release(subscriber)
                 return True
             return False
 
+    def _punsubscribe(self, pattern, subscriber):
+        subscriber.patterns.discard(pattern)
+        self.patterns[pattern].discard(subscriber)
+        if not self.patterns[pattern]:
+            del self.patterns[pattern]
+            self.pattern_index.remove(pattern)
+
+    def _drop(self, subscriber):
+        self._retire(subscriber)
+        for channel in list(subscriber.channels):
+            self._unsubscribe(channel, subscriber)
+        for pattern in list(subscriber.patterns):
+            self._punsubscribe(pattern, subscriber)
+
+    def remove_subscriber(self, subscriber):
+        """Drop a subscriber whose connection was closed."""
+        with self.lock:
+            self._drop(subscriber)
+            if self.subscribers.get(subscriber.client) is subscriber:
+                del self.subscribers[subscriber.client]
+
+    def drop_client(self, client):
+        """Forget every subscription held by a client that disconnected."""
+        with self.lock:
+            subscriber = self.subscribers.pop(client, None)
+            if subscriber is None:
+                return
+            self._drop(subscriber)
+        subscriber.stop()
+
+    def subscriptions(self, client):
+        """Return the (channels, patterns) a client is subscribed to."""
+        with self.lock:
+            subscriber = self.subscribers.get(client)
+            if subscriber is None:
+                return [], []
+            return list(subscriber.channels), list(subscriber.patterns)
+
+    def has_subscribers(self, channel):
+        with self.lock:
+            return channel in self.channels or bool(self.pattern_index and self.pattern_index.match(channel))
+
+    def publish(self, channel, message):
+        """Publish a message to all clients subscribed to a channel or a matching pattern.
+
+        Returns the number of subscriptions the message was handed to.
+        """
+        with self.lock:
+            subscribers = tuple(self.channels.get(channel, ()))
+            matches = [(pattern, tuple(self.patterns[pattern])) for pattern in self.pattern_index.match(channel)]
+            receivers = len(subscribers) + sum(len(pattern_subscribers) for _, pattern_subscribers in matches)
+            self.published += 1
+            self.deliveries += receivers
+        for pattern, pattern_subscribers in [(None, subscribers)] + matches:
+            frames = {}  # protocol -> encoded frame
+            for subscriber in pattern_subscribers:
+                frame = frames.get(subscriber.protocol)
+                if frame is None:
+                    frame = frames[subscriber.protocol] = encode_message(subscriber.protocol, channel, message, pattern)
+                subscriber.deliver(frame)
+        return receivers
+
     def broadcast(self, message):
         """Broadcast a message to all channels and clients."""
+        for channel in self.list_channels():
+            self.publish(channel, message)
+        return True
+
+    def stats(self):
         with self.lock:
-            for channel in list(self.channels.keys()):
-                self.publish(channel, message)
-            return True
+            return {
+                "channels": len(self.channels),
+                "patterns": len(self.patterns),
+                "subscribers": len(self.subscribers),
+                "published_messages": self.published,
+                "deliveries": self.deliveries,
+                "dropped_messages": self.dropped + sum(s.dropped for s in self.subscribers.values()),
+                "slow_disconnects": self.slow_disconnects,
+                "pending_bytes": sum(s.backlog() for s in self.subscribers.values()),
+            }
 
     def list_subscribers(self, channel):
         """Return the count of subscribers for a given channel."""
@@ -65,11 +507,17 @@ class PubSub:
         with self.lock:
             return list(self.channels.keys())
 
+    def list_patterns(self):
+        """Return a list of all subscribed patterns."""
+        with self.lock:
+            return list(self.patterns.keys())
+
     def handle_command(self, command, client):
         """Handle PubSub commands."""
         action = command.get("action")
         channel = command.get("channel")
         message = command.get("message")
+        pattern = command.get("pattern")
         
         if action == "subscribe" and channel:
             success = self.subscribe(channel, client)
@@ -79,6 +527,14 @@ class PubSub:
             success = self.unsubscribe(channel, client)
             return {"result": "OK" if success else "ERROR", "action": "unsubscribe", "channel": channel}
         
+        elif action == "psubscribe" and pattern:
+            success = self.psubscribe(pattern, client)
+            return {"result": "OK" if success else "ERROR", "action": "psubscribe", "pattern": pattern}
+
+        elif action == "punsubscribe" and pattern:
+            success = self.punsubscribe(pattern, client)
+            return {"result": "OK" if success else "ERROR", "action": "punsubscribe", "pattern": pattern}
+
         elif action == "publish" and channel and message is not None:
             success = self.publish(channel, message)
             return {"result": "OK" if success else "ERROR", "action": "publish", "channel": channel}
@@ -91,6 +547,10 @@ class PubSub:
             channels = self.list_channels()
             return {"result": "OK", "action": "list_channels", "channels": channels}
         
+        elif action == "list_patterns":
+            patterns = self.list_patterns()
+            return {"result": "OK", "action": "list_patterns", "patterns": patterns}
+
         elif action == "list_subscribers" and channel:
             count = self.list_subscribers(channel)
             return {"result": "OK", "action": "list_subscribers", "channel": channel, "count": count}
@@ -0,0 +1,367 @@
+#replication.py
+import os
+import socket
+import threading
+import time
+from collections import deque
+from protocol import FrameReader, encode_frame, decode_frame
+from pubsub import Subscriber
+from storage import log_entry, snapshot_entry
+from config import REPL_BACKLOG_SIZE, REPL_OUTPUT_BUFFER_LIMIT, REPL_TIMEOUT
+from log import get_logger
+
+logger = get_logger('replication')
+
+# A replica connects to the primary's JSON port and sends
+#
+#     {"action": "sync", "replid": <id or null>, "offset": <offset>}
+#
+# The primary answers with one of
+#
+#     {"repl": "fullsync", "replid": ..., "offset": n}  followed by snapshot
+#         frames {"entries": [...]} and {"repl": "online", "keys": count}
+#     {"repl": "continue", "replid": ..., "offset": n}  if the replica's offset
+#         is still in the backlog
+#
+# and then streams {"offset": n, "entries": [...]} frames, where n counts every
+# entry since the stream started, and {"repl": "ping", "offset": n} heartbeats.
+# Entries are the append-only log's. The replica reports its offset with
+# {"action": "replconf", "ack": n}, which gets no reply.
+
+class ReplicaHandle:
+    """A connected replica as seen by the primary."""
+
+    def __init__(self, conn, on_close):
+        self.conn = conn
+        self.sender = Subscriber(conn, on_close, buffer_limit=REPL_OUTPUT_BUFFER_LIMIT, policy='disconnect')
+        self.state = 'sync'  # 'sync' while the snapshot is sent, then 'online'
+        self.pending = []  # Stream frames held back until the snapshot is sent
+        self.pending_bytes = 0
+        self.ack_offset = 0
+        self.ack_time = time.time()
+        try:
+            host, port = conn.getpeername()[:2]
+            self.addr = f"{host}:{port}"
+        except Exception:
+            self.addr = None
+
+
+class ReplicationSource:
+    """The primary's side of replication: the stream of mutations and the replicas reading it.
+
+    feed() is called from a database observer with the stripe lock held, so
+    each key's entries enter the stream in the order they were applied. The
+    stream is only kept once a replica has connected. Recent frames stay in
+    a backlog so a replica that reconnects can continue where it stopped
+    instead of taking a new full sync.
+    """
+
+    SYNC_BATCH = 1000  # Snapshot entries per frame during a full sync
+
+    def __init__(self, backlog_size=REPL_BACKLOG_SIZE):
+        self.replid = os.urandom(20).hex()
+        self.offset = 0  # Entries written to the stream
+        self.backlog = deque()  # (offset after the frame, encoded frame)
+        self.backlog_size = backlog_size
+        self.backlog_bytes = 0
+        self.backlog_start = 0  # Offset just before the first frame in the backlog
+        self.active = False  # Set once the first replica connects
+        self.replicas = {}  # connection -> ReplicaHandle
+        # Reentrant: a replica that overflows its buffer is dropped from inside feed()
+        self.lock = threading.RLock()
+
+    def feed(self, entries):
+        """Append (operation, key, value, expire_at) entries to the stream and send them to the replicas."""
+        if not self.active or not entries:
+            return
+        with self.lock:
+            self.offset += len(entries)
+            frame = encode_frame({"offset": self.offset, "entries": [log_entry(*entry) for entry in entries]})
+            self.backlog.append((self.offset, frame))
+            self.backlog_bytes += len(frame)
+            while self.backlog_bytes > self.backlog_size and len(self.backlog) > 1:
+                self.backlog_start, dropped = self.backlog.popleft()
+                self.backlog_bytes -= len(dropped)
+            for handle in list(self.replicas.values()):
+                self._send(handle, frame)
+
+    def _send(self, handle, frame):
+        """Send a stream frame to a replica. The caller must hold self.lock."""
+        if handle.state == 'online':
+            handle.sender.deliver(frame)
+            return
+        handle.pending.append(frame)
+        handle.pending_bytes += len(frame)
+        if handle.pending_bytes > REPL_OUTPUT_BUFFER_LIMIT:
+            logger.warning("Replica %s fell behind during its full sync, disconnecting it", handle.addr)
+            handle.sender.close()
+
+    def handle_command(self, command, conn, snapshot_source):
+        """Handle a replica's sync or replconf request. Returns None: neither gets a reply frame."""
+        if command.get("action") == "replconf":
+            handle = self.replicas.get(conn)
+            ack = command.get("ack")
+            if handle and isinstance(ack, int):
+                handle.ack_offset = ack
+                handle.ack_time = time.time()
+            return None
+        replid = command.get("replid")
+        offset = command.get("offset")
+        with self.lock:
+            self.active = True
+            if conn in self.replicas:
+                self._drop(self.replicas[conn])
+            handle = ReplicaHandle(conn, self._on_close)
+            if (replid == self.replid and isinstance(offset, int)
+                    and self.backlog_start <= offset <= self.offset):
+                # The replica only missed what is still in the backlog
+                handle.sender.deliver(encode_frame({"repl": "continue", "replid": self.replid, "offset": offset}))
+                for end, frame in self.backlog:
+                    if end > offset:
+                        handle.sender.deliver(frame)
+                handle.state = 'online'
+                handle.ack_offset = offset
+                self.replicas[conn] = handle
+                logger.info("Replica %s continued from offset %d", handle.addr, offset)
+                return None
+        threading.Thread(target=self._full_sync, args=(handle, snapshot_source), daemon=True).start()
+        return None
+
+    def _full_sync(self, handle, snapshot_source):
+        """Send a snapshot of the dataset to a replica, then switch it to the live stream."""
+        start = {}
+
+        def start_buffering():
+            # Runs while the database is frozen: stream entries from here on
+            # are held back and follow the snapshot
+            with self.lock:
+                start["offset"] = self.offset
+                self.replicas[handle.conn] = handle
+
+        try:
+            logger.info("Starting full sync of replica %s", handle.addr)
+            items = snapshot_source(start_buffering)
+            handle.sender.deliver(encode_frame({"repl": "fullsync", "replid": self.replid, "offset": start["offset"]}))
+            now = time.time()
+            count = 0
+            batch = []
+            for key, value, expire_at in items:
+                if expire_at is not None and expire_at < now:
+                    continue
+                batch.append(snapshot_entry(key, value, expire_at))
+                count += 1
+                if len(batch) >= self.SYNC_BATCH:
+                    if not self._send_snapshot(handle, batch):
+                        return
+                    batch = []
+            if batch and not self._send_snapshot(handle, batch):
+                return
+            with self.lock:
+                if handle.sender.closed:
+                    return
+                handle.sender.deliver(encode_frame({"repl": "online", "keys": count}))
+                for frame in handle.pending:
+                    handle.sender.deliver(frame)
+                handle.pending = []
+                handle.pending_bytes = 0
+                handle.state = 'online'
+                handle.ack_offset = start["offset"]
+            logger.info("Full sync of replica %s sent %d keys", handle.addr, count)
+        except Exception as e:
+            logger.error("Full sync of replica %s failed: %s", handle.addr, e)
+            handle.sender.close()
+
+    def _send_snapshot(self, handle, entries):
+        frame = encode_frame({"entries": entries})
+        # Waiting for the replica is fine here, unlike in feed()
+        return handle.sender.wait_for_room(len(frame)) and handle.sender.deliver(frame)
+
+    def heartbeat(self):
+        """Tell the online replicas the current offset, so they can report their lag."""
+        with self.lock:
+            if not self.replicas:
+                return
+            frame = encode_frame({"repl": "ping", "offset": self.offset})
+            for handle in list(self.replicas.values()):
+                if handle.state == 'online':
+                    handle.sender.deliver(frame)
+
+    def _on_close(self, sender):
+        with self.lock:
+            handle = self.replicas.get(sender.client)
+            if handle is not None and handle.sender is sender:
+                del self.replicas[sender.client]
+                logger.info("Replica %s disconnected", handle.addr)
+
+    def _drop(self, handle):
+        del self.replicas[handle.conn]
+        handle.sender.stop()
+
+    def drop(self, conn):
+        """Forget the replica on a closed connection, if it was one."""
+        with self.lock:
+            handle = self.replicas.get(conn)
+            if handle is not None:
+                self._drop(handle)
+                logger.info("Replica %s disconnected", handle.addr)
+
+    def info(self):
+        with self.lock:
+            info = {
+                "role": "primary",
+                "replid": self.replid,
+                "offset": self.offset,
+                "backlog_first_offset": self.backlog_start + 1 if self.backlog else 0,
+                "backlog_bytes": self.backlog_bytes,
+                "connected_replicas": len(self.replicas),
+            }
+            now = time.time()
+            for i, handle in enumerate(self.replicas.values()):
+                info[f"replica{i}"] = {
+                    "addr": handle.addr,
+                    "state": handle.state,
+                    "offset": handle.ack_offset,
+                    "lag": self.offset - handle.ack_offset if handle.state == 'online' else None,
+                    "ack_age": round(now - handle.ack_time, 3),
+                }
+            return info
+
+
+class Replica:
+    """Keeps a server's dataset a copy of a primary's.
+
+    A background thread connects to the primary, loads its snapshot and then
+    applies the stream of mutations, reconnecting with backoff whenever the
+    link drops. After a reconnect it asks to continue from its offset, so a
+    short outage only costs the entries it missed.
+    """
+
+    ACK_INTERVAL = 1.0  # Seconds between offset reports to the primary
+    RETRY_DELAY = 0.1  # First reconnect delay, doubled up to MAX_RETRY_DELAY
+    MAX_RETRY_DELAY = 5.0
+
+    def __init__(self, server, host, port, timeout=REPL_TIMEOUT):
+        self.server = server
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.replid = None  # Stream this replica's data follows, None if it has none yet
+        self.sync_replid = None  # Stream of the full sync in progress
+        self.offset = 0  # Stream entries applied
+        self.primary_offset = 0  # Latest stream offset the primary reported
+        self.state = 'connecting'  # 'connecting', 'sync' while loading the snapshot, then 'online'
+        self.last_io = None
+        self.sync_keys = 0
+        self.full_syncs = 0
+        self.stopping = threading.Event()
+        self.sock = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        sock = self.sock
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def run(self):
+        delay = self.RETRY_DELAY
+        while not self.stopping.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                if not self.stopping.is_set():
+                    logger.warning("Replication link to %s:%d down: %s", self.host, self.port, e)
+            if self.state == 'online':
+                delay = self.RETRY_DELAY  # Reconnect quickly after losing a healthy link
+            self.state = 'connecting'
+            if self.sock:
+                self.sock.close()
+                self.sock = None
+            self.stopping.wait(delay)
+            delay = min(delay * 2, self.MAX_RETRY_DELAY)
+
+    def sync(self):
+        """Connect to the primary and apply what it sends until the link fails."""
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.sendall(encode_frame({"action": "sync", "replid": self.replid, "offset": self.offset}))
+        self.sock.settimeout(self.ACK_INTERVAL)
+        reader = FrameReader()
+        self.last_io = time.time()
+        last_ack = 0.0
+        while not self.stopping.is_set():
+            now = time.time()
+            if self.state == 'online' and now - last_ack >= self.ACK_INTERVAL:
+                self.sock.sendall(encode_frame({"action": "replconf", "ack": self.offset}))
+                last_ack = now
+            try:
+                payload = reader.read_frame(self.sock)
+            except socket.timeout:
+                if time.time() - self.last_io > self.timeout:
+                    raise ConnectionError(f"no data from the primary for {self.timeout} seconds")
+                continue
+            if payload is None:
+                raise ConnectionError("the primary closed the connection")
+            self.last_io = time.time()
+            self.handle_frame(decode_frame(payload))
+
+    def handle_frame(self, message):
+        if "error" in message:
+            raise ConnectionError(message["error"])
+        entries = message.get("entries")
+        if entries is not None:
+            for entry in entries:
+                self.server.apply_log_entry(entry)
+            if "offset" in message:
+                self.offset = message["offset"]
+                self.primary_offset = max(self.primary_offset, self.offset)
+            else:
+                self.sync_keys += len(entries)
+            return
+        kind = message.get("repl")
+        if kind == "ping":
+            self.primary_offset = message["offset"]
+        elif kind == "fullsync":
+            logger.info("Full sync from %s:%d started", self.host, self.port)
+            self.state = 'sync'
+            self.sync_keys = 0
+            self.full_syncs += 1
+            self.server.db.clear()
+            # Until the snapshot is loaded there is nothing to continue from
+            self.replid = None
+            self.sync_replid = message["replid"]
+            self.offset = self.primary_offset = message["offset"]
+        elif kind == "online":
+            self.state = 'online'
+            self.replid = self.sync_replid
+            logger.info("Full sync from %s:%d loaded %d keys", self.host, self.port, self.sync_keys)
+            if self.server.aof:
+                # The log now holds the whole dataset after the clear; compact it
+                self.server.aof.rewrite_in_background()
+        elif kind == "continue":
+            self.state = 'online'
+            self.replid = message["replid"]
+            self.offset = message["offset"]
+            logger.info("Continuing replication from %s:%d at offset %d", self.host, self.port, self.offset)
+
+    def info(self):
+        return {
+            "role": "replica",
+            "primary_host": self.host,
+            "primary_port": self.port,
+            "link_status": self.state,
+            "replid": self.replid,
+            "offset": self.offset,
+            "primary_offset": self.primary_offset,
+            "lag_entries": self.primary_offset - self.offset,
+            "last_io_seconds_ago": round(time.time() - self.last_io, 3) if self.last_io else None,
+            "full_syncs": self.full_syncs,
+        }
\ No newline at end of file
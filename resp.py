@@ -0,0 +1,625 @@
+#resp.py
+import itertools
+import json
+import time
+from config import MAX_FRAME_SIZE
+from datatypes import Collection, WrongTypeError
+from eviction import OutOfMemoryError
+from scan import compile_pattern
+from cluster import ClusterRedirect, SLOTS, key_slot, slot_ranges, split_address
+from log import get_logger
+
+logger = get_logger('resp')
+
+# RESP (the Redis serialization protocol) lets Redis clients, connection
+# pools and benchmarking tools talk to the server. Requests are arrays of
+# bulk strings; replies are RESP2 until a client switches to RESP3 with HELLO.
+CRLF = b'\r\n'
+MAX_ARGUMENTS = 1024 * 1024  # Most arguments accepted in one request
+MAX_INLINE_SIZE = 64 * 1024  # Longest accepted inline request
+
+OK = b'+OK\r\n'
+PONG = b'+PONG\r\n'
+NULL = {2: b'$-1\r\n', 3: b'_\r\n'}
+PUSH = {2: b'*', 3: b'>'}  # Out-of-band messages are push frames in RESP3
+
+class RespProtocolError(ValueError):
+    """Raised for malformed input; the stream can't be resynchronized afterwards."""
+
+class RespReader:
+    """Incremental parser for RESP requests.
+
+    Commands arrive as arrays of bulk strings, or as inline commands such as
+    "PING\\r\\n" typed into telnet. Input is parsed in place in one buffer:
+    every argument is copied out exactly once and the consumed bytes are
+    dropped with a single deletion per batch. While a bulk string is still
+    incomplete, the number of bytes it needs is remembered, so a large value
+    arriving over many reads is not re-parsed on every one.
+    """
+
+    def __init__(self, max_bulk_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.need = 0  # Buffered bytes required before the first command can be complete
+        self.max_bulk_size = max_bulk_size
+
+    def feed(self, data):
+        self.buffer += data
+
+    def commands(self):
+        """Return the arguments (lists of bytes) of all complete commands received so far."""
+        buffer = self.buffer
+        size = len(buffer)
+        if size < self.need:
+            return []
+        commands = []
+        find = buffer.find
+        pos = 0
+        need = 0
+        while pos < size:
+            start = pos
+            end = find(CRLF, pos)
+            if buffer[pos] != 42:  # Not '*', so an inline command
+                if end == -1:
+                    if size - pos > MAX_INLINE_SIZE:
+                        raise RespProtocolError("too big inline request")
+                    break
+                args = bytes(buffer[pos:end]).split()
+                pos = end + 2
+                if args:
+                    commands.append(args)
+                continue
+            if end == -1:
+                break
+            count = self._length(buffer, pos + 1, end, MAX_ARGUMENTS, "multibulk length")
+            pos = end + 2
+            args = []
+            while len(args) < count:
+                if pos >= size:
+                    break
+                if buffer[pos] != 36:  # '$'
+                    raise RespProtocolError(f"expected '$', got '{chr(buffer[pos])}'")
+                end = find(CRLF, pos)
+                if end == -1:
+                    break
+                length = self._length(buffer, pos + 1, end, self.max_bulk_size, "bulk length")
+                if length < 0:
+                    raise RespProtocolError("invalid bulk length")
+                pos = end + 2
+                if pos + length + 2 > size:
+                    need = pos + length + 2 - start
+                    break
+                if buffer[pos + length:pos + length + 2] != CRLF:
+                    raise RespProtocolError("bulk string is not terminated by CRLF")
+                args.append(bytes(buffer[pos:pos + length]))
+                pos += length + 2
+            if len(args) < count:
+                # Incomplete: parse the command again once more data arrived
+                pos = start
+                break
+            if args:
+                commands.append(args)
+        if pos:
+            del buffer[:pos]
+        self.need = need
+        return commands
+
+    @staticmethod
+    def _length(buffer, start, end, limit, what):
+        try:
+            length = int(buffer[start:end])
+        except ValueError:
+            raise RespProtocolError(f"invalid {what}") from None
+        if length > limit:
+            raise RespProtocolError(f"invalid {what}")
+        return length
+
+def to_bytes(value):
+    """Render a stored value as the payload of a bulk string."""
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value).encode('ascii')
+    # Objects stored by JSON clients are returned as their JSON text
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+def encode(value, protocol=2):
+    """Encode a reply. Lists become arrays, dicts maps (flat arrays in RESP2)."""
+    if value is None:
+        return NULL[protocol]
+    if isinstance(value, bytes):
+        return b'$%d\r\n%b\r\n' % (len(value), value)
+    if isinstance(value, str):
+        return encode(value.encode('utf-8'))
+    if isinstance(value, bool):
+        if protocol == 3:
+            return b'#t\r\n' if value else b'#f\r\n'
+        return b':1\r\n' if value else b':0\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, float):
+        if protocol == 3:
+            return b',%b\r\n' % repr(value).encode('ascii')
+        return encode(to_bytes(value))
+    if isinstance(value, (list, tuple)):
+        return b'*%d\r\n' % len(value) + b''.join(encode(item, protocol) for item in value)
+    if isinstance(value, dict):
+        items = b''.join(encode(k, protocol) + encode(v, protocol) for k, v in value.items())
+        if protocol == 3:
+            return b'%%%d\r\n' % len(value) + items
+        return b'*%d\r\n' % (2 * len(value)) + items
+    return encode(to_bytes(value))
+
+def encode_error(message):
+    """Encode an error reply; by convention the message starts with an error code such as ERR."""
+    return b'-' + message.replace('\r', ' ').replace('\n', ' ').encode('utf-8') + CRLF
+
+def encode_push(items, protocol=2):
+    """Encode an out-of-band message such as a published message or a subscribe confirmation."""
+    return PUSH[protocol] + b'%d\r\n' % len(items) + b''.join(encode(item, protocol) for item in items)
+
+def encode_message(protocol, channel, message, pattern=None):
+    """Encode a published message for a RESP subscriber."""
+    if pattern is None:
+        return encode_push([b'message', channel, to_bytes(message)], protocol)
+    return encode_push([b'pmessage', pattern, channel, to_bytes(message)], protocol)
+
+
+# Commands understood over RESP and their arity, counting the command name:
+# a negative arity -n means at least n arguments
+COMMAND_ARITY = {
+    "ping": -1, "echo": 2, "hello": -1, "quit": 1, "select": 2, "command": -1, "client": -2,
+    "dbsize": 1, "get": 2, "set": -3, "del": -2, "unlink": -2, "exists": -2, "expire": 3, "pexpire": 3,
+    "ttl": 2, "pttl": 2, "keys": 2, "scan": -2, "mget": -2, "mset": -3,
+    "incr": 2, "decr": 2, "incrby": 3, "decrby": 3, "flushall": -1, "flushdb": -1,
+    "info": -1, "slowlog": -2, "replicaof": 3, "cluster": -2, "asking": 1,
+    "publish": 3, "subscribe": -2, "unsubscribe": -1, "psubscribe": -2, "punsubscribe": -1,
+}
+# Commands that can take long enough to stall an event loop; it runs them in its executor
+BLOCKING_COMMANDS = {"flushall", "flushdb", "replicaof"}
+# Which arguments are keys, for routing in cluster mode
+KEY_ARGUMENTS = {
+    "get": slice(0, 1), "set": slice(0, 1), "expire": slice(0, 1), "pexpire": slice(0, 1),
+    "ttl": slice(0, 1), "pttl": slice(0, 1), "incr": slice(0, 1), "decr": slice(0, 1),
+    "incrby": slice(0, 1), "decrby": slice(0, 1),
+    "del": slice(None), "unlink": slice(None), "exists": slice(None), "mget": slice(None), "mset": slice(None, None, 2),
+}
+# Commands a replica refuses
+WRITE_COMMANDS = {"set", "del", "unlink", "flushall", "flushdb", "expire", "pexpire", "mset", "incr", "decr",
+                  "incrby", "decrby"}
+# The only commands a RESP2 connection may send while it has subscriptions
+SUBSCRIBED_COMMANDS = {"subscribe", "unsubscribe", "psubscribe", "punsubscribe", "ping", "quit"}
+
+SYNTAX_ERROR = encode_error("ERR syntax error")
+NOT_AN_INTEGER = "value is not an integer or out of range"
+
+session_ids = itertools.count(1)
+
+class RespSession:
+    """One RESP connection: parses its requests and runs them against a TCPServer.
+
+    Commands map onto the same InMemoryDB and PubSub the JSON protocol uses,
+    so both kinds of client see the same data and channels.
+    """
+
+    def __init__(self, server, conn):
+        self.server = server
+        self.db = server.db
+        self.pubsub = server.pubsub
+        self.conn = conn
+        self.reader = RespReader()
+        self.id = next(session_ids)
+        self.name = None
+        self.protocol = 2
+        self.subscriptions = 0
+        self.asking = False  # Set by ASKING for the next command
+        self.closing = False  # Set by QUIT: close once the replies are sent
+
+    def handle(self, data):
+        """Feed received bytes and return the replies to every complete command.
+
+        Raises RespProtocolError if the input is malformed.
+        """
+        replies = []
+        for args in self.requests(data):
+            replies.append(self.execute(args))
+            if self.closing:
+                break
+        return b''.join(replies)
+
+    def requests(self, data):
+        """Feed received bytes and return the arguments of every complete command, for execute().
+
+        Raises RespProtocolError if the input is malformed.
+        """
+        self.reader.feed(data)
+        return self.reader.commands()
+
+    @staticmethod
+    def blocks(args):
+        """Whether a command may run long enough to stall an event loop."""
+        return args[0].decode('utf-8', 'replace').lower() in BLOCKING_COMMANDS
+
+    def execute(self, args):
+        """Run one command and return its encoded reply."""
+        name = args[0].decode('utf-8', 'replace').lower()
+        arity = COMMAND_ARITY.get(name)
+        if arity is None:
+            return encode_error(f"ERR unknown command '{name}'")
+        if (arity >= 0 and len(args) != arity) or len(args) < -arity:
+            return encode_error(f"ERR wrong number of arguments for '{name}' command")
+        if self.subscriptions and self.protocol == 2 and name not in SUBSCRIBED_COMMANDS:
+            return encode_error(f"ERR Can't execute '{name}': only (P)SUBSCRIBE / (P)UNSUBSCRIBE / PING / QUIT"
+                                " are allowed in this context")
+        if name in WRITE_COMMANDS and self.server.replica:
+            return encode_error("READONLY You can't write against a read only replica.")
+        try:
+            params = [arg.decode('utf-8') for arg in args[1:]]
+        except UnicodeDecodeError:
+            return encode_error("ERR keys and values must be valid UTF-8")
+        asking, self.asking = self.asking, False
+        started = time.perf_counter_ns()
+        try:
+            if self.server.cluster and name in KEY_ARGUMENTS:
+                try:
+                    with self.server.cluster.serving(params[KEY_ARGUMENTS[name]], asking):
+                        return self.run(name, params)
+                except ClusterRedirect as e:
+                    return encode_error(str(e))
+            return self.run(name, params)
+        finally:
+            self.server.record_command(name, time.perf_counter_ns() - started,
+                                       lambda: [name] + params, self.conn)
+
+    def run(self, name, params):
+        try:
+            return getattr(self, "cmd_" + name)(params)
+        except (WrongTypeError, OutOfMemoryError) as e:
+            return encode_error(str(e))
+        except ValueError as e:
+            return encode_error(f"ERR {e}")
+        except Exception as e:
+            logger.error("Error handling RESP command '%s': %s", name, e)
+            return encode_error(f"ERR {e}")
+
+    def reply(self, value):
+        return encode(value, self.protocol)
+
+    @staticmethod
+    def integer(text):
+        try:
+            return int(text)
+        except ValueError:
+            raise ValueError(NOT_AN_INTEGER) from None
+
+    # Connection
+    def cmd_ping(self, args):
+        if self.subscriptions and self.protocol == 2:
+            return self.reply(["pong", args[0] if args else ""])
+        return self.reply(args[0]) if args else PONG
+
+    def cmd_echo(self, args):
+        return self.reply(args[0])
+
+    def cmd_hello(self, args):
+        """HELLO [protover [AUTH username password] [SETNAME clientname]]"""
+        protocol = self.protocol
+        if args:
+            try:
+                protocol = int(args[0])
+            except ValueError:
+                return encode_error("ERR Protocol version is not an integer or out of range")
+            if protocol not in (2, 3):
+                return encode_error("NOPROTO unsupported protocol version")
+        options = args[1:]
+        while options:
+            option = options[0].upper()
+            if option == "AUTH" and len(options) >= 3:
+                options = options[3:]  # There are no users; any credentials are accepted
+            elif option == "SETNAME" and len(options) >= 2:
+                self.name = options[1]
+                options = options[2:]
+            else:
+                return SYNTAX_ERROR
+        self.protocol = protocol
+        return self.reply({"server": "in-memory-db", "version": "1.0", "proto": protocol, "id": self.id,
+                           "mode": "standalone",
+                           "role": "replica" if self.server.replica else "master", "modules": []})
+
+    def cmd_quit(self, args):
+        self.closing = True
+        return OK
+
+    def cmd_select(self, args):
+        # There is a single database
+        if args[0] != "0":
+            return encode_error("ERR DB index is out of range")
+        return OK
+
+    def cmd_command(self, args):
+        # Clients such as redis-cli ask for command docs; an empty reply means none are available
+        return self.reply([])
+
+    def cmd_client(self, args):
+        subcommand = args[0].lower()
+        if subcommand == "setname" and len(args) == 2:
+            self.name = args[1]
+            return OK
+        if subcommand == "getname":
+            return self.reply(self.name)
+        if subcommand == "id":
+            return self.reply(self.id)
+        if subcommand == "setinfo":
+            return OK
+        return encode_error(f"ERR unknown subcommand '{args[0]}'")
+
+    def cmd_info(self, args):
+        """INFO [section ...] as "# Section" headers followed by field:value lines."""
+        info = self.server.info()
+        sections = [section.lower() for section in args] or [
+            section for section in info if section != "commandstats"]
+        if "all" in sections or "everything" in sections:
+            sections = list(info)
+        lines = []
+        for section in sections:
+            if section not in info:
+                continue
+            if lines:
+                lines.append("")
+            lines.append(f"# {section.capitalize()}")
+            for field, value in info[section].items():
+                if section == "commandstats":
+                    field = f"cmdstat_{field}"
+                if isinstance(value, dict):
+                    value = ",".join(f"{stat}={number}" for stat, number in value.items())
+                elif isinstance(value, bool):
+                    value = int(value)
+                lines.append(f"{field}:{value}")
+        return encode(to_bytes("\r\n".join(lines) + "\r\n"))
+
+    def cmd_slowlog(self, args):
+        """SLOWLOG GET [count] | LEN | RESET"""
+        subcommand = args[0].lower()
+        if subcommand == "get" and len(args) <= 2:
+            count = self.integer(args[1]) if len(args) == 2 else 10
+            return self.reply([[entry["id"], entry["timestamp"], entry["duration_us"], entry["command"],
+                                entry["client"] or "", ""] for entry in self.server.slowlog.get(count)])
+        if subcommand == "len" and len(args) == 1:
+            return self.reply(len(self.server.slowlog))
+        if subcommand == "reset" and len(args) == 1:
+            self.server.slowlog.reset()
+            return OK
+        return encode_error(f"ERR unknown subcommand or wrong number of arguments for '{args[0]}'")
+
+    def cmd_asking(self, args):
+        self.asking = True
+        return OK
+
+    def cmd_cluster(self, args):
+        """CLUSTER KEYSLOT key | SLOTS | INFO | COUNTKEYSINSLOT slot | GETKEYSINSLOT slot count"""
+        cluster = self.server.cluster
+        if cluster is None:
+            return encode_error("ERR This instance has cluster support disabled")
+        subcommand = args[0].lower()
+        if subcommand == "keyslot" and len(args) == 2:
+            return self.reply(key_slot(args[1]))
+        if subcommand == "slots" and len(args) == 1:
+            slots = []
+            for start, end, owner in slot_ranges(cluster.owners):
+                if owner:
+                    host, port = split_address(owner)
+                    slots.append([start, end, [host, port, owner]])
+            return self.reply(slots)
+        if subcommand == "info" and len(args) == 1:
+            info = dict(state="ok", **cluster.info())
+            return encode(to_bytes("".join(f"cluster_{field}:{value}\r\n" for field, value in info.items())))
+        if (subcommand, len(args)) in (("countkeysinslot", 2), ("getkeysinslot", 3)):
+            slot = self.integer(args[1])
+            if not 0 <= slot < SLOTS:
+                return encode_error("ERR Invalid slot")
+            keys = cluster.keys_in_slots([slot]).get(slot, [])
+            if subcommand == "countkeysinslot":
+                return self.reply(len(keys))
+            return self.reply(keys[:self.integer(args[2])])
+        return encode_error(f"ERR unknown subcommand or wrong number of arguments for '{args[0]}'")
+
+    def cmd_replicaof(self, args):
+        """REPLICAOF host port | NO ONE"""
+        if args[0].upper() == "NO" and args[1].upper() == "ONE":
+            self.server.replicaof(None)
+        else:
+            self.server.replicaof(args[0], self.integer(args[1]))
+        return OK
+
+    # Keys and strings
+    def cmd_dbsize(self, args):
+        return self.reply(len(self.db.data))
+
+    def cmd_get(self, args):
+        value = self.db.get(args[0])
+        if isinstance(value, Collection):
+            raise WrongTypeError()
+        return NULL[self.protocol] if value is None else encode(to_bytes(value))
+
+    def cmd_set(self, args):
+        """SET key value [NX | XX] [EX seconds | PX milliseconds]"""
+        key, value = args[0], args[1]
+        ttl = None
+        condition = None
+        i = 2
+        while i < len(args):
+            option = args[i].upper()
+            if option in ("NX", "XX") and condition is None:
+                condition = option
+                i += 1
+            elif option in ("EX", "PX") and ttl is None and i + 1 < len(args):
+                amount = self.integer(args[i + 1])
+                if amount <= 0:
+                    return encode_error("ERR invalid expire time in 'set' command")
+                ttl = amount if option == "EX" else amount / 1000
+                i += 2
+            else:
+                return SYNTAX_ERROR
+        if condition == "NX":
+            if not self.db.setnx(key, value, ttl):
+                return NULL[self.protocol]
+        elif condition == "XX":
+            if not self.db.setxx(key, value, ttl):
+                return NULL[self.protocol]
+        else:
+            self.db.set(key, value, ttl)
+        self.server.publish_update("set" if ttl is None else "set_with_ttl", key)
+        return OK
+
+    def cmd_del(self, args, lazy=None):
+        deleted = [key for key, existed in zip(args, self.db.mdelete(args, lazy)) if existed]
+        if deleted:
+            self.server.publish_update("mdelete", keys=deleted)
+        return self.reply(len(deleted))
+
+    def cmd_unlink(self, args):
+        return self.cmd_del(args, lazy=True)
+
+    def cmd_flushall(self, args):
+        """FLUSHALL [ASYNC | SYNC]"""
+        if len(args) > 1 or args and args[0].upper() not in ("ASYNC", "SYNC"):
+            return SYNTAX_ERROR
+        self.db.clear(args[0].upper() == "ASYNC" if args else None)
+        return OK
+
+    cmd_flushdb = cmd_flushall  # There is only one database
+
+    def cmd_exists(self, args):
+        return self.reply(sum(self.db.key_type(key)[0] != "none" for key in args))
+
+    def cmd_expire(self, args):
+        return self._expire(args[0], self.integer(args[1]))
+
+    def cmd_pexpire(self, args):
+        return self._expire(args[0], self.integer(args[1]) / 1000)
+
+    def _expire(self, key, ttl):
+        if ttl <= 0:
+            # An expiry in the past deletes the key right away
+            existed = self.db.delete(key)
+            if existed:
+                self.server.publish_update("delete", key)
+            return self.reply(int(existed))
+        existed = self.db.mexpire([key], ttl)[0]
+        if existed:
+            self.server.publish_update("mexpire", keys=[key])
+        return self.reply(int(existed))
+
+    def cmd_ttl(self, args):
+        remaining = self._remaining(args[0])
+        return self.reply(remaining if remaining < 0 else round(remaining))
+
+    def cmd_pttl(self, args):
+        remaining = self._remaining(args[0])
+        return self.reply(remaining if remaining < 0 else int(remaining * 1000))
+
+    def _remaining(self, key):
+        """Seconds until key expires, -1 if it has no TTL and -2 if it does not exist."""
+        if self.db.key_type(key)[0] == "none":
+            return -2
+        expire_at = self.db.expiry(key)
+        if expire_at is None:
+            return -1
+        return max(0.0, expire_at - time.time())
+
+    def cmd_keys(self, args):
+        keys = self.db.keys()
+        if args[0] != "*":
+            pattern = compile_pattern(args[0])
+            keys = [key for key in keys if pattern.fullmatch(str(key))]
+        return self.reply(keys)
+
+    def cmd_scan(self, args):
+        """SCAN cursor [MATCH pattern] [COUNT count]"""
+        cursor = self.integer(args[0])
+        if cursor < 0:
+            return encode_error("ERR invalid cursor")
+        match = None
+        count = 10
+        options = args[1:]
+        while options:
+            option = options[0].upper()
+            if option == "MATCH" and len(options) >= 2:
+                match = options[1]
+            elif option == "COUNT" and len(options) >= 2:
+                count = self.integer(options[1])
+                if count < 1:
+                    return SYNTAX_ERROR
+            else:
+                return SYNTAX_ERROR
+            options = options[2:]
+        next_cursor, keys = self.db.scan(cursor, match, count)
+        return self.reply([str(next_cursor), keys])
+
+    def cmd_mget(self, args):
+        return self.reply([None if value is None else to_bytes(value) for value in self.db.mget(args)])
+
+    def cmd_mset(self, args):
+        if len(args) % 2:
+            return encode_error("ERR wrong number of arguments for 'mset' command")
+        self.db.mset(zip(args[::2], args[1::2]))
+        self.server.publish_update("mset", keys=args[::2])
+        return OK
+
+    def cmd_incr(self, args):
+        return self._incr(args[0], 1)
+
+    def cmd_decr(self, args):
+        return self._incr(args[0], -1)
+
+    def cmd_incrby(self, args):
+        return self._incr(args[0], self.integer(args[1]))
+
+    def cmd_decrby(self, args):
+        return self._incr(args[0], -self.integer(args[1]))
+
+    def _incr(self, key, amount):
+        result = self.db.incr(key, amount)
+        self.server.publish_update("incr", key)
+        return self.reply(result)
+
+    # PubSub
+    def cmd_publish(self, args):
+        return self.reply(self.pubsub.publish(args[0], args[1]))
+
+    def cmd_subscribe(self, args):
+        return self._subscribe("subscribe", self.pubsub.subscribe, args)
+
+    def cmd_psubscribe(self, args):
+        return self._subscribe("psubscribe", self.pubsub.psubscribe, args)
+
+    def _subscribe(self, kind, subscribe, names):
+        replies = []
+        for name in names:
+            subscribe(name, self.conn, f"resp{self.protocol}")
+            replies.append(self._confirm(kind, name))
+        return b''.join(replies)
+
+    def cmd_unsubscribe(self, args):
+        return self._unsubscribe("unsubscribe", self.pubsub.unsubscribe, args, 0)
+
+    def cmd_punsubscribe(self, args):
+        return self._unsubscribe("punsubscribe", self.pubsub.punsubscribe, args, 1)
+
+    def _unsubscribe(self, kind, unsubscribe, names, which):
+        if not names:
+            # Without arguments, drop every subscription of this kind
+            names = sorted(self.pubsub.subscriptions(self.conn)[which])
+            if not names:
+                return self._confirm(kind, None)
+        replies = []
+        for name in names:
+            unsubscribe(name, self.conn)
+            replies.append(self._confirm(kind, name))
+        return b''.join(replies)
+
+    def _confirm(self, kind, name):
+        channels, patterns = self.pubsub.subscriptions(self.conn)
+        self.subscriptions = len(channels) + len(patterns)
+        return encode_push([kind, name, self.subscriptions], self.protocol)
\ No newline at end of file
@@ -0,0 +1,154 @@
+#scan.py
+import random
+import re
+from bisect import bisect_left
+from functools import lru_cache
+
+@lru_cache(maxsize=256)
+def compile_pattern(pattern):
+    """Translate a Redis-style glob pattern into a compiled regular expression.
+
+    Supports '*', '?', character classes such as '[abc]', '[a-z]' and '[^a]',
+    and backslash to escape the next character.
+    """
+    parts = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            parts.append('.*')
+        elif c == '?':
+            parts.append('.')
+        elif c == '\\' and i < n:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+        elif c == '[':
+            end = pattern.find(']', i + 1 if i < n and pattern[i] == '^' else i)
+            if end == -1:
+                parts.append(re.escape(c))
+                continue
+            body = pattern[i:end]
+            negate = body.startswith('^')
+            if negate:
+                body = body[1:]
+            body = body.replace('\\', '\\\\')
+            parts.append(f"[{'^' if negate else ''}{body}]")
+            i = end + 1
+        else:
+            parts.append(re.escape(c))
+    return re.compile(''.join(parts), re.DOTALL)
+
+def match_pattern(pattern, key):
+    """Return True if key matches the glob pattern."""
+    return compile_pattern(pattern).fullmatch(str(key)) is not None
+
+
+class KeyIndex:
+    """Stable positions for keys so a scan cursor survives concurrent writes.
+
+    Every key gets a position when it is inserted and keeps it until it is
+    deleted. A cursor is simply the next position to look at, so a key that
+    exists for the whole duration of a scan is always returned, keys added
+    during the scan may or may not be, and nothing needs to be copied up
+    front.
+
+    Positions are grouped into fixed-size segments. Deleting leaves a hole;
+    once a segment is three quarters empty its remaining keys are moved to
+    the tail and the segment is dropped. Moving a key forward can only make
+    a scan return it twice, never skip it, and it keeps every segment at
+    least a quarter full so a scan step does bounded work.
+    """
+
+    SEGMENT_SIZE = 1024
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.positions = {}    # key -> position
+        self.segments = {}     # segment number -> list of keys, None where deleted
+        self.live = {}         # segment number -> number of keys still present
+        self.segment_ids = []  # sorted segment numbers
+        self.next_position = 0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add(self, key):
+        if key in self.positions:
+            return
+        position = self.next_position
+        self.next_position += 1
+        segment = position // self.SEGMENT_SIZE
+        slots = self.segments.get(segment)
+        if slots is None:
+            slots = self.segments[segment] = []
+            self.live[segment] = 0
+            self.segment_ids.append(segment)
+        slots.append(key)
+        self.live[segment] += 1
+        self.positions[key] = position
+
+    def remove(self, key):
+        position = self.positions.pop(key, None)
+        if position is None:
+            return
+        segment, slot = divmod(position, self.SEGMENT_SIZE)
+        self.segments[segment][slot] = None
+        self.live[segment] -= 1
+        tail = (self.next_position - 1) // self.SEGMENT_SIZE
+        if segment != tail and self.live[segment] <= self.SEGMENT_SIZE // 4:
+            self._evacuate(segment)
+
+    def _evacuate(self, segment):
+        """Move the keys left in a sparse segment to the tail and drop it."""
+        keys = [key for key in self.segments.pop(segment) if key is not None]
+        del self.live[segment]
+        del self.segment_ids[bisect_left(self.segment_ids, segment)]
+        for key in keys:
+            del self.positions[key]
+            self.add(key)
+
+    def random_key(self):
+        """Return a uniformly chosen key, or None if there are none."""
+        if not self.positions:
+            return None
+        segment_ids = self.segment_ids
+        while True:
+            slots = self.segments[segment_ids[random.randrange(len(segment_ids))]]
+            if slots:
+                key = slots[random.randrange(len(slots))]
+                if key is not None:
+                    return key
+
+    def scan(self, cursor, count, accept=None):
+        """Visit up to count keys from cursor on.
+
+        Returns (next_cursor, keys, visited) where keys are the visited keys
+        for which accept(key) is true and visited is how many keys were looked
+        at. next_cursor is 0 once the end has been reached.
+        """
+        keys = []
+        visited = 0
+        position = cursor
+        index = bisect_left(self.segment_ids, cursor // self.SEGMENT_SIZE)
+        while index < len(self.segment_ids) and visited < count:
+            segment = self.segment_ids[index]
+            base = segment * self.SEGMENT_SIZE
+            slots = self.segments[segment]
+            slot = max(position - base, 0)
+            while slot < len(slots) and visited < count:
+                key = slots[slot]
+                slot += 1
+                if key is not None:
+                    visited += 1
+                    if accept is None or accept(key):
+                        keys.append(key)
+            position = base + slot
+            if slot >= len(slots):
+                index += 1
+        if position >= self.next_position or index >= len(self.segment_ids):
+            return 0, keys, visited
+        return position, keys, visited
\ No newline at end of file
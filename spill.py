@@ -0,0 +1,103 @@
+#spill.py
+import mmap
+import os
+import tempfile
+from storage import Snapshot
+from config import SPILL_DIR, SPILL_COMPACT_MIN_SIZE
+
+# A record's location is packed into one int, offset << 32 | length, so the
+# in-memory index costs a single small int per cold key
+LENGTH_BITS = 32
+LENGTH_MASK = (1 << LENGTH_BITS) - 1
+
+
+class _Cold:
+    """Stands in the database's value dict for a value that was moved to a spill file."""
+
+    __slots__ = ()
+
+    def memory_usage(self):
+        return 32  # The location int in the spill index
+
+    def __repr__(self):
+        return 'COLD'
+
+
+COLD = _Cold()
+
+
+class SpillFile:
+    """Values moved out of RAM, appended to an unnamed file and read back through mmap.
+
+    A record is one value in the snapshot encoding. Reading a value decodes
+    it straight from the mapping, without any other file I/O. Records are
+    never changed once written, so a reader holding on to this object (a
+    snapshot in progress, say) can keep reading what it was handed even
+    while the file grows; compaction copies the live records into a new
+    SpillFile rather than rewriting this one. The file is deleted once the
+    last reference to it is gone.
+    """
+
+    INITIAL_CAPACITY = 1024 * 1024
+
+    def __init__(self, directory=SPILL_DIR, compact_min_size=SPILL_COMPACT_MIN_SIZE, capacity=INITIAL_CAPACITY):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.compact_min_size = compact_min_size
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.capacity = 0
+        self.map = None
+        self.size = 0  # Bytes written
+        self.garbage = 0  # Bytes of records that are no longer referenced
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        # Older mappings stay valid for the part of the file they cover
+        os.ftruncate(self.file.fileno(), capacity)
+        self.map = mmap.mmap(self.file.fileno(), capacity)
+        self.capacity = capacity
+
+    def write(self, value):
+        """Append value and return its location."""
+        return self.write_raw(Snapshot.encode_value(value))
+
+    def write_raw(self, raw):
+        end = self.size + len(raw)
+        if end > self.capacity:
+            capacity = self.capacity
+            while capacity < end:
+                capacity *= 2
+            self._grow(capacity)
+        self.map[self.size:end] = raw
+        location = self.size << LENGTH_BITS | len(raw)
+        self.size = end
+        return location
+
+    def read(self, location):
+        """Decode the value at location."""
+        return Snapshot.decode_value(self.map, location >> LENGTH_BITS)[0]
+
+    def free(self, location):
+        """Note that the record at location is no longer needed."""
+        self.garbage += location & LENGTH_MASK
+
+    def needs_compaction(self):
+        return self.size >= self.compact_min_size and self.garbage * 2 >= self.size
+
+    def compact(self, locations):
+        """Copy the records in locations (key -> location) to a new SpillFile and return it.
+
+        locations is updated in place to point into the new file.
+        """
+        live = self.size - self.garbage
+        capacity = self.INITIAL_CAPACITY
+        while capacity < live:
+            capacity *= 2
+        spill = SpillFile(self.directory, self.compact_min_size, capacity)
+        for key, location in locations.items():
+            offset = location >> LENGTH_BITS
+            locations[key] = spill.write_raw(self.map[offset:offset + (location & LENGTH_MASK)])
+        return spill
+
+    def stats(self):
+        return {"spill_file_size": self.size, "spill_garbage": self.garbage}
\ No newline at end of file
@@ -0,0 +1,233 @@
+#stats.py
+import itertools
+import math
+import threading
+import time
+from collections import Counter, deque
+from config import SLOWLOG_LOG_SLOWER_THAN, SLOWLOG_MAX_LEN
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+class LatencyHistogram:
+    """Latency counts in logarithmic buckets about 1% wide.
+
+    Recording is one logarithm and one counter increment, histograms from
+    different threads or processes are merged by adding their counts, and
+    percentiles are accurate to the bucket width.
+    """
+
+    RESOLUTION = 100  # Buckets per factor of e
+
+    def __init__(self):
+        self.counts = Counter()  # bucket -> count
+        self.total = 0
+        self.sum_ns = 0
+        self.max_ns = 0
+
+    def record(self, ns, count=1):
+        self.counts[int(math.log(max(ns, 1)) * self.RESOLUTION)] += count
+        self.total += count
+        self.sum_ns += ns * count
+        self.max_ns = max(self.max_ns, ns)
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.total += other.total
+        self.sum_ns += other.sum_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+
+    def copy(self):
+        histogram = LatencyHistogram()
+        histogram.merge(self)
+        return histogram
+
+    def percentile(self, percent):
+        """Latency in milliseconds below which percent of the samples fall."""
+        if not self.total:
+            return 0.0
+        threshold = self.total * percent / 100
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= threshold:
+                return min(math.exp((bucket + 1) / self.RESOLUTION), self.max_ns) / 1e6
+        return self.max_ns / 1e6
+
+    def count_below(self, bounds_ns):
+        """Cumulative sample counts at or below each of the ascending bounds (nanoseconds)."""
+        counts = []
+        seen = 0
+        buckets = sorted(self.counts)
+        i = 0
+        for bound in bounds_ns:
+            while i < len(buckets) and math.exp((buckets[i] + 1) / self.RESOLUTION) <= bound:
+                seen += self.counts[buckets[i]]
+                i += 1
+            counts.append(seen)
+        return counts
+
+    def buckets(self):
+        """Cumulative distribution over power-of-two millisecond bounds, as (bound_ms, percent) pairs."""
+        rows = []
+        seen = 0
+        bound = 0.0625
+        for bucket in sorted(self.counts):
+            upper = math.exp((bucket + 1) / self.RESOLUTION) / 1e6
+            while upper > bound:
+                if seen:
+                    rows.append((bound, 100 * seen / self.total))
+                bound *= 2
+            seen += self.counts[bucket]
+        rows.append((bound, 100.0))
+        return rows
+
+    def summary(self):
+        result = {
+            "count": self.total,
+            "mean_ms": self.sum_ns / self.total / 1e6 if self.total else 0.0,
+            "max_ms": self.max_ns / 1e6,
+        }
+        for percent in PERCENTILES:
+            result[f"p{percent:g}_ms".replace('.', '')] = self.percentile(percent)
+        return result
+
+    def to_dict(self):
+        return {"counts": dict(self.counts), "total": self.total, "sum_ns": self.sum_ns, "max_ns": self.max_ns}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.counts.update({int(bucket): count for bucket, count in data["counts"].items()})
+        histogram.total = data["total"]
+        histogram.sum_ns = data["sum_ns"]
+        histogram.max_ns = data["max_ns"]
+        return histogram
+
+
+class _Shard:
+    """One thread's histograms."""
+
+    __slots__ = ('lock', 'histograms')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # action -> LatencyHistogram
+
+
+class CommandStats:
+    """Call counts and latency histograms per command.
+
+    Every thread records into its own shard, guarded by a lock only readers
+    ever contend for, so serving threads don't serialize on the statistics.
+    A thread that stops serving calls retire() to fold its shard into the
+    totals. sample() is called about once a second and keeps the recent
+    counts that ops_per_sec() is computed from.
+    """
+
+    SAMPLES = 6  # Seconds of history behind ops_per_sec()
+
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = set()  # _Shard of every recording thread
+        self.retired = {}  # action -> LatencyHistogram from threads that are gone
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=self.SAMPLES)  # (monotonic time, {action: count})
+
+    def record(self, action, ns):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = _Shard()
+            with self.lock:
+                self.shards.add(shard)
+        with shard.lock:
+            histogram = shard.histograms.get(action)
+            if histogram is None:
+                histogram = shard.histograms[action] = LatencyHistogram()
+            histogram.record(ns)
+
+    def retire(self):
+        """Fold the calling thread's shard into the totals."""
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            return
+        self.local.shard = None
+        with self.lock:
+            self.shards.discard(shard)
+            self._merge(self.retired, shard)
+
+    @staticmethod
+    def _merge(totals, shard):
+        with shard.lock:
+            for action, histogram in shard.histograms.items():
+                if action in totals:
+                    totals[action].merge(histogram)
+                else:
+                    totals[action] = histogram.copy()
+
+    def histograms(self):
+        """Return {action: LatencyHistogram} over everything recorded so far."""
+        with self.lock:
+            totals = {action: histogram.copy() for action, histogram in self.retired.items()}
+            for shard in self.shards:
+                self._merge(totals, shard)
+        return totals
+
+    def sample(self):
+        counts = {action: histogram.total for action, histogram in self.histograms().items()}
+        self.samples.append((time.monotonic(), counts))
+
+    def ops_per_sec(self):
+        """Recent operations per second for every action."""
+        if len(self.samples) < 2:
+            return {}
+        (start, old), (end, new) = self.samples[0], self.samples[-1]
+        elapsed = end - start
+        return {action: (count - old.get(action, 0)) / elapsed for action, count in new.items()}
+
+
+class SlowLog:
+    """The most recent commands that took longer than a threshold.
+
+    Checking a fast command is a single comparison; callers only describe a
+    command, and add() shortens long arguments, once it is known to be slow.
+    """
+
+    MAX_ARGUMENTS = 32
+    MAX_ARGUMENT_LENGTH = 128
+
+    def __init__(self, slower_than_us=SLOWLOG_LOG_SLOWER_THAN, max_len=SLOWLOG_MAX_LEN):
+        self.slower_than_ns = slower_than_us * 1000
+        self.entries = deque(maxlen=max_len)
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def is_slow(self, ns):
+        return 0 <= self.slower_than_ns <= ns
+
+    def add(self, ns, args, client=None):
+        """Log a command with arguments args that took ns nanoseconds."""
+        args = [self.shorten(arg) for arg in args]
+        if len(args) > self.MAX_ARGUMENTS:
+            args = args[:self.MAX_ARGUMENTS - 1] + [f"... ({len(args) - self.MAX_ARGUMENTS + 1} more arguments)"]
+        entry = {"id": next(self.ids), "timestamp": int(time.time()), "duration_us": ns // 1000,
+                 "command": args, "client": client}
+        with self.lock:
+            self.entries.append(entry)
+
+    def shorten(self, arg):
+        arg = str(arg)
+        if len(arg) > self.MAX_ARGUMENT_LENGTH:
+            return f"{arg[:self.MAX_ARGUMENT_LENGTH]}... ({len(arg) - self.MAX_ARGUMENT_LENGTH} more characters)"
+        return arg
+
+    def get(self, count=10):
+        """Return up to count entries, newest first."""
+        with self.lock:
+            return list(itertools.islice(reversed(self.entries), max(count, 0)))
+
+    def reset(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
\ No newline at end of file
@@ -1,6 +1,35 @@
 #storage.py
+import contextlib
 import json
-from config import STORAGE_FILE
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from datatypes import is_collection, dump_value, load_value
+from config import (STORAGE_FILE, AOF_FILE, AOF_FSYNC, AOF_FSYNC_INTERVAL_MS,
+                    AOF_REWRITE_PERCENTAGE, AOF_REWRITE_MIN_SIZE, SNAPSHOT_FILE, SNAPSHOT_FORK)
+from log import get_logger
+
+logger = get_logger('storage')
+
+def log_entry(operation, key=None, value=None, expire_at=None):
+    """One mutation as the dict written to the append-only log and the replication stream."""
+    entry = {"op": operation}
+    if key is not None:
+        entry["key"] = key
+    if value is not None:
+        entry["value"] = value
+    if expire_at is not None:
+        entry["expire_at"] = expire_at
+    return entry
+
+def snapshot_entry(key, value, expire_at):
+    """The log entry that recreates one (key, value, expire_at) snapshot item."""
+    if is_collection(value):
+        return log_entry("restore", key, dump_value(value), expire_at)
+    return log_entry("set", key, value, expire_at)
 
 class Storage:
     def __init__(self, filename=STORAGE_FILE):
@@ -20,4 +49,498 @@ class Storage:
         except FileNotFoundError:
             return {} 
         except json.JSONDecodeError:
-            return {} 
\ No newline at end of file
+            return {} 
+
+
+class AppendOnlyLog:
+    """Append-only log of mutations, one JSON entry per line.
+
+    Every write costs one small append instead of a rewrite of the whole
+    dataset. The fsync policy decides durability:
+
+    - 'always':   each append is fsynced before it returns. Concurrent writers
+                  are group-committed, one fsync covers everything buffered.
+    - 'everysec': appends are buffered in memory and a background thread
+                  writes and fsyncs them as one batch every interval.
+    - 'no':       appends go straight to the OS, which decides when to flush.
+    """
+
+    FSYNC_POLICIES = ('always', 'everysec', 'no')
+
+    def __init__(self, filename=AOF_FILE, fsync=AOF_FSYNC, fsync_interval_ms=AOF_FSYNC_INTERVAL_MS,
+                 rewrite_percentage=AOF_REWRITE_PERCENTAGE, rewrite_min_size=AOF_REWRITE_MIN_SIZE):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.filename = filename
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self.rewrite_percentage = rewrite_percentage
+        self.rewrite_min_size = rewrite_min_size
+        self.file = None
+        self.buffer = []
+        self.lock = threading.Lock()       # Guards the buffer and the file handle
+        self.sync_lock = threading.Lock()  # Serializes fsyncs (group commit)
+        self.appended = 0                  # Sequence number of the last append
+        self.synced = 0                    # Sequence number covered by the last fsync
+        self.last_sync = time.time()       # When the last fsync finished
+        self.size = 0
+        self.base_size = 0                 # Size right after the last rewrite
+        self.rewrite_buffer = None         # Appends made while a rewrite is running
+        self.rewrite_thread = None
+        self.snapshot_source = None
+        self.running = False
+        self.flush_thread = None
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def open(self, snapshot_source=None):
+        """Open the log for appending and start the background flusher.
+
+        snapshot_source is a callable returning (key, value, expire_at) tuples
+        for the current dataset; it is used for background rewrites. It is
+        passed a callback to run at the moment the data is copied, while no
+        write can happen.
+        """
+        self.snapshot_source = snapshot_source
+        self.file = open(self.filename, 'a', encoding='utf-8')
+        self.size = self.file.tell()
+        self.base_size = self.size
+        self.running = True
+        if self.fsync == 'everysec':
+            self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self.flush_thread.start()
+
+    def close(self):
+        """Flush whatever is buffered and close the log."""
+        self.running = False
+        rewrite_thread = self.rewrite_thread
+        if rewrite_thread:
+            rewrite_thread.join()
+        if self.file:
+            self.sync()
+            with self.lock:
+                self.file.close()
+                self.file = None
+
+    def append(self, operation, key=None, value=None, expire_at=None):
+        """Append one mutation to the log."""
+        self.append_many([(operation, key, value, expire_at)])
+
+    def append_many(self, entries):
+        """Append (operation, key, value, expire_at) mutations with a single flush."""
+        lines = [json.dumps(log_entry(*entry), separators=(',', ':')) + '\n' for entry in entries]
+        if not lines:
+            return
+
+        with self.lock:
+            self.buffer.extend(lines)
+            if self.rewrite_buffer is not None:
+                self.rewrite_buffer.extend(lines)
+            self.appended += len(lines)
+            self.size += sum(len(line) for line in lines)
+            seq = self.appended
+            if self.fsync == 'no':
+                self._write_buffer()
+
+        if self.fsync == 'always':
+            self._sync_until(seq)
+        if self.should_rewrite():
+            self.rewrite_in_background()
+
+    def _write_buffer(self):
+        """Hand buffered entries to the OS. Caller must hold self.lock."""
+        if self.buffer and self.file:
+            self.file.write(''.join(self.buffer))
+            self.file.flush()
+            self.buffer = []
+
+    def _sync_until(self, seq):
+        """Make sure everything up to seq is on disk.
+
+        Writers that arrive while another fsync is in flight wait for it and
+        usually find their entry already covered, so a burst of writes costs
+        a single fsync.
+        """
+        with self.sync_lock:
+            if self.synced >= seq:
+                return
+            with self.lock:
+                target = self.appended
+                self._write_buffer()
+                if not self.file:
+                    return
+                fileno = self.file.fileno()
+            os.fsync(fileno)
+            self.synced = target
+            self.last_sync = time.time()
+
+    def sync(self):
+        """Write and fsync everything appended so far."""
+        self._sync_until(self.appended)
+
+    def stats(self):
+        return {
+            "aof_size": self.size,
+            "aof_base_size": self.base_size,
+            "aof_unsynced_entries": self.appended - self.synced,
+            "aof_last_sync_age": time.time() - self.last_sync,
+            "aof_rewrite_in_progress": self.rewrite_thread is not None,
+        }
+
+    def _flush_loop(self):
+        while self.running:
+            time.sleep(self.fsync_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error("Error flushing append-only log: %s", e)
+
+    def replay(self, apply):
+        """Feed every logged entry to apply(entry), oldest first.
+
+        A truncated last line (e.g. after a crash mid-write) is dropped and the
+        file is cut back to the last complete entry.
+        """
+        if not self.exists():
+            return 0
+        count = 0
+        good_offset = 0
+        with open(self.filename, 'rb') as f:
+            for raw in f:
+                try:
+                    entry = json.loads(raw)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    entry = None
+                if entry is None or not raw.endswith(b'\n'):
+                    logger.warning("Append-only log is truncated at offset %d, discarding the tail", good_offset)
+                    break
+                apply(entry)
+                good_offset += len(raw)
+                count += 1
+        if good_offset < os.path.getsize(self.filename):
+            with open(self.filename, 'r+b') as f:
+                f.truncate(good_offset)
+        return count
+
+    def should_rewrite(self):
+        if self.rewrite_thread is not None or self.snapshot_source is None:
+            return False
+        if self.size < self.rewrite_min_size:
+            return False
+        growth = (self.size - self.base_size) * 100 / max(self.base_size, 1)
+        return growth >= self.rewrite_percentage
+
+    def rewrite_in_background(self):
+        """Start compacting the log in a background thread."""
+        with self.lock:
+            if self.rewrite_thread is not None or self.snapshot_source is None:
+                return False
+            self.rewrite_thread = threading.Thread(target=self.rewrite, daemon=True)
+            self.rewrite_thread.start()
+            return True
+
+    def rewrite(self):
+        """Write the current dataset to a fresh log and swap it in.
+
+        Appends made while the snapshot is being written are collected in
+        rewrite_buffer and copied to the new file before the swap, so nothing
+        is lost. The buffer starts at the exact moment the snapshot is taken,
+        so no entry is applied twice.
+        """
+        temp_filename = self.filename + '.rewrite'
+        try:
+            def start_buffering():
+                # Runs while the database is frozen, and the database locks
+                # are always taken before ours, never after
+                with self.lock:
+                    self.rewrite_buffer = []
+
+            snapshot = self.snapshot_source(start_buffering)
+            keys = 0
+            with open(temp_filename, 'w', encoding='utf-8') as f:
+                # Entries are written as the snapshot produces them, never all held at once
+                for key, value, expire_at in snapshot:
+                    f.write(json.dumps(snapshot_entry(key, value, expire_at), separators=(',', ':')) + '\n')
+                    keys += 1
+                f.flush()
+                os.fsync(f.fileno())
+
+            with self.sync_lock, self.lock:
+                with open(temp_filename, 'a', encoding='utf-8') as f:
+                    f.write(''.join(self.rewrite_buffer))
+                    f.flush()
+                    os.fsync(f.fileno())
+                # The buffered entries are in the new file now
+                self.buffer = []
+                self.synced = self.appended
+                self.last_sync = time.time()
+                if self.file:
+                    self.file.close()
+                os.replace(temp_filename, self.filename)
+                self.file = open(self.filename, 'a', encoding='utf-8')
+                self.size = self.file.tell()
+                self.base_size = self.size
+            logger.info("Append-only log rewritten, %d keys", keys)
+        except Exception as e:
+            logger.error("Append-only log rewrite failed: %s", e)
+            try:
+                os.remove(temp_filename)
+            except OSError:
+                pass
+        finally:
+            with self.lock:
+                self.rewrite_buffer = None
+                self.rewrite_thread = None
+
+
+class Snapshot:
+    """Point-in-time dump of the dataset in a compact, checksummed binary format.
+
+    Layout (little endian):
+
+        header   b'IMDB' | u16 version | f64 created_at
+        record   u8 opcode | [f64 expire_at] | u32 key length | key | value
+        trailer  u8 0xFF | u64 record count | u32 CRC32 of everything before it
+
+    The opcode is 0x01 for keys without an expiry and 0x02 for keys with one.
+    A value is a one byte tag followed by its payload: 'n' None, 'b' bool,
+    'i' int64, 'd' float64, 's' UTF-8 string, 'c' hash, list, set or sorted
+    set as JSON (since version 2), 'j' anything else as JSON.
+    """
+
+    MAGIC = b'IMDB'
+    VERSION = 2
+    OP_KEY = 0x01
+    OP_KEY_EXPIRE = 0x02
+    OP_EOF = 0xFF
+    HEADER = struct.Struct('<4sHd')
+    TRAILER = struct.Struct('<BQI')
+    U32 = struct.Struct('<I')
+    I64 = struct.Struct('<q')
+    F64 = struct.Struct('<d')
+    WRITE_CHUNK = 64 * 1024
+
+    def __init__(self, filename=SNAPSHOT_FILE, use_fork=SNAPSHOT_FORK):
+        self.filename = filename
+        self.use_fork = use_fork and hasattr(os, 'fork')
+        self.lock = threading.Lock()
+        self.in_progress = False
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    @classmethod
+    def encode_value(cls, value):
+        if value is None:
+            return b'n'
+        if isinstance(value, bool):
+            return b'b' + (b'\x01' if value else b'\x00')
+        if isinstance(value, int) and -2**63 <= value < 2**63:
+            return b'i' + cls.I64.pack(value)
+        if isinstance(value, float):
+            return b'd' + cls.F64.pack(value)
+        if isinstance(value, str):
+            raw = value.encode('utf-8')
+            return b's' + cls.U32.pack(len(raw)) + raw
+        if is_collection(value):
+            raw = json.dumps(dump_value(value), separators=(',', ':')).encode('utf-8')
+            return b'c' + cls.U32.pack(len(raw)) + raw
+        raw = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        return b'j' + cls.U32.pack(len(raw)) + raw
+
+    @classmethod
+    def decode_value(cls, buf, pos):
+        """Decode the value at buf[pos:], returning (value, next position)."""
+        tag = buf[pos:pos + 1]
+        pos += 1
+        if tag == b'n':
+            return None, pos
+        if tag == b'b':
+            return buf[pos] == 1, pos + 1
+        if tag == b'i':
+            return cls.I64.unpack_from(buf, pos)[0], pos + 8
+        if tag == b'd':
+            return cls.F64.unpack_from(buf, pos)[0], pos + 8
+        if tag in (b's', b'j', b'c'):
+            length = cls.U32.unpack_from(buf, pos)[0]
+            pos += 4
+            raw = bytes(buf[pos:pos + length])
+            if len(raw) != length:
+                raise ValueError("Snapshot is truncated")
+            text = raw.decode('utf-8')
+            if tag == b's':
+                return text, pos + length
+            value = json.loads(text)
+            return (load_value(value) if tag == b'c' else value), pos + length
+        raise ValueError(f"Unknown value tag {tag!r} in snapshot")
+
+    def save(self, items):
+        """Write (key, value, expire_at) items to the snapshot file atomically.
+
+        The data goes to a temporary file that is fsynced and then renamed over
+        the old snapshot, so a crash never leaves a half-written file behind.
+        Items that have already expired are skipped.
+        """
+        temp_filename = f"{self.filename}.tmp-{os.getpid()}-{threading.get_ident()}"
+        now = time.time()
+        count = 0
+        crc = 0
+        try:
+            with open(temp_filename, 'wb') as f:
+                chunk = bytearray(self.HEADER.pack(self.MAGIC, self.VERSION, now))
+                for key, value, expire_at in items:
+                    if expire_at is None:
+                        chunk.append(self.OP_KEY)
+                    elif expire_at < now:
+                        continue
+                    else:
+                        chunk.append(self.OP_KEY_EXPIRE)
+                        chunk += self.F64.pack(expire_at)
+                    raw_key = str(key).encode('utf-8')
+                    chunk += self.U32.pack(len(raw_key))
+                    chunk += raw_key
+                    chunk += self.encode_value(value)
+                    count += 1
+                    if len(chunk) >= self.WRITE_CHUNK:
+                        crc = zlib.crc32(chunk, crc)
+                        f.write(chunk)
+                        chunk = bytearray()
+                chunk.append(self.OP_EOF)
+                chunk += struct.pack('<Q', count)
+                crc = zlib.crc32(chunk, crc)
+                chunk += self.U32.pack(crc)
+                f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_filename, self.filename)
+        except BaseException:
+            try:
+                os.remove(temp_filename)
+            except OSError:
+                pass
+            raise
+        return count
+
+    def load(self):
+        """Read the snapshot and return a list of (key, value, expire_at) items.
+
+        Raises ValueError if the file is corrupt or was written by a newer version.
+        """
+        return list(self.iter_items())
+
+    def iter_items(self):
+        """Yield the snapshot's (key, value, expire_at) items one at a time.
+
+        The file is memory-mapped rather than read, so loading a snapshot
+        never holds a second copy of it in memory. The checksum is verified
+        before the first item is yielded. Raises ValueError like load().
+        """
+        with open(self.filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < self.HEADER.size + self.TRAILER.size:
+                raise ValueError("Snapshot is truncated")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                yield from self._parse(buf)
+
+    def _parse(self, buf):
+        magic, version, _ = self.HEADER.unpack_from(buf, 0)
+        if magic != self.MAGIC:
+            raise ValueError("Not a snapshot file")
+        if version > self.VERSION:
+            raise ValueError(f"Unsupported snapshot version {version}")
+        end = len(buf) - self.TRAILER.size
+        opcode, count, crc = self.TRAILER.unpack_from(buf, end)
+        view = memoryview(buf)
+        try:
+            if opcode != self.OP_EOF or zlib.crc32(view[:-4]) != crc:
+                raise ValueError("Snapshot checksum mismatch")
+        finally:
+            view.release()
+
+        u32 = self.U32.unpack_from
+        f64 = self.F64.unpack_from
+        decode_value = self.decode_value
+        STRING_TAG = ord('s')
+        loaded = 0
+        pos = self.HEADER.size
+        while pos < end:
+            opcode = buf[pos]
+            pos += 1
+            expire_at = None
+            if opcode == self.OP_KEY_EXPIRE:
+                expire_at = f64(buf, pos)[0]
+                pos += 8
+            elif opcode != self.OP_KEY:
+                raise ValueError(f"Unknown opcode {opcode} in snapshot")
+            length = u32(buf, pos)[0]
+            pos += 4
+            key = buf[pos:pos + length].decode('utf-8')
+            pos += length
+            if buf[pos] == STRING_TAG:
+                # Most values are strings, so they skip the generic decoder
+                length = u32(buf, pos + 1)[0]
+                pos += 5
+                value = buf[pos:pos + length].decode('utf-8')
+                pos += length
+                if pos > end:
+                    raise ValueError("Snapshot is truncated")
+            else:
+                value, pos = decode_value(buf, pos)
+            loaded += 1
+            yield key, value, expire_at
+        if loaded != count:
+            raise ValueError("Snapshot record count mismatch")
+
+    def save_in_background(self, source, on_done=None, fork_lock=None):
+        """Snapshot the dataset without blocking request handling.
+
+        source is a callable returning the (key, value, expire_at) items. Where
+        fork() is available a child process writes the copy-on-write image of
+        the parent's memory; otherwise the dictionaries are copied (a quick
+        C-level copy) and written by a background thread. on_done(success) is
+        called once the snapshot is on disk or has failed. fork_lock, if
+        given, is a context manager factory held around fork() so the child
+        does not inherit locks that other threads were holding.
+        Returns False if a snapshot is already being written.
+        """
+        with self.lock:
+            if self.in_progress:
+                return False
+            self.in_progress = True
+
+        if self.use_fork:
+            with fork_lock() if fork_lock else contextlib.nullcontext():
+                pid = os.fork()
+                if pid == 0:
+                    # Child: only touch our private copy of the data, never shared locks
+                    code = 1
+                    try:
+                        self.save(source())
+                        code = 0
+                    finally:
+                        os._exit(code)
+            worker = threading.Thread(target=self._wait_for_child, args=(pid, on_done), daemon=True)
+        else:
+            items = source()
+            worker = threading.Thread(target=self._save_worker, args=(items, on_done), daemon=True)
+        worker.start()
+        return True
+
+    def _wait_for_child(self, pid, on_done):
+        _, status = os.waitpid(pid, 0)
+        self._finish(os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0, on_done)
+
+    def _save_worker(self, items, on_done):
+        success = False
+        try:
+            self.save(items)
+            success = True
+        except Exception as e:
+            logger.error("Background snapshot failed: %s", e)
+        self._finish(success, on_done)
+
+    def _finish(self, success, on_done):
+        with self.lock:
+            self.in_progress = False
+        if on_done:
+            on_done(success)
\ No newline at end of file
@@ -0,0 +1,54 @@
+#conftest.py
+import os
+import socket
+import sys
+import threading
+import time
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network import TCPServer
+from helpers import free_port
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run every test in an empty directory, so data files never leak between tests or into the repository."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def server():
+    """A server that loaded its data files but does not listen."""
+    server = TCPServer(port=0, resp_port=0, metrics_port=0)
+    yield server
+    server.aof.close()
+
+
+@pytest.fixture
+def start_server():
+    """Start servers listening on free ports; start_server(**options) returns one once it accepts connections."""
+    servers = []
+
+    def start(**options):
+        options.setdefault("port", free_port())
+        options.setdefault("resp_port", 0)
+        options.setdefault("metrics_port", 0)
+        server = TCPServer(host="127.0.0.1", **options)
+        servers.append(server)
+        threading.Thread(target=server.start, daemon=True).start()
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", server.port), timeout=1).close()
+                return server
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    yield start
+    for server in servers:
+        server.shutdown()
\ No newline at end of file
@@ -0,0 +1,39 @@
+#helpers.py
+import socket
+from datatypes import Collection, dump_value
+
+
+def contents(db):
+    """The dataset as plain values, with set members in a fixed order so two databases compare equal."""
+    def plain(value):
+        if not isinstance(value, Collection):
+            return value
+        dumped = dump_value(value)
+        if dumped["type"] == "set":
+            dumped["data"] = sorted(dumped["data"])
+        return dumped
+
+    return {key: plain(value) for key, value in db.data.items()}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def fill(db):
+    """One write of every kind."""
+    db.set("s", "text")
+    db.set("n", 1)
+    db.incr("n", 41)
+    db.set("gone", 1)
+    db.delete("gone")
+    db.set("ttl", "v", ttl=100)
+    db.mset([("m1", 1), ("m2", 2)])
+    db.command("hset", "h", ("f1", "a", "f2", "b"))
+    db.command("hdel", "h", ("f2",))
+    db.command("rpush", "l", ("x", "y", "z"))
+    db.command("lpop", "l")
+    db.command("sadd", "set", ("a", "b"))
+    db.command("zadd", "z", (1, "one", 2, "two"))
\ No newline at end of file
@@ -0,0 +1,41 @@
+#test_aof.py
+from network import TCPServer
+from helpers import contents, fill
+
+
+def reopen(server):
+    server.aof.sync()
+    server.aof.close()
+    return TCPServer(port=0, resp_port=0, metrics_port=0)
+
+
+def test_aof_replay_restores_every_write(server):
+    fill(server.db)
+    expected = contents(server.db)
+    loaded = reopen(server)
+    try:
+        assert contents(loaded.db) == expected
+        assert loaded.db.expiry("ttl") is not None
+        assert loaded.db.expiry("s") is None
+        assert loaded.db.key_type("h") == ("hash", server.db.key_type("h")[1])
+    finally:
+        loaded.aof.close()
+
+
+def test_aof_rewrite_keeps_dataset_and_later_writes(server):
+    for i in range(100):
+        server.db.set("counter", i)
+    fill(server.db)
+    server.aof.sync()
+    size = server.aof.size
+    server.aof.rewrite()
+    assert server.aof.size < size
+    server.db.command("rpush", "l", ("after",))
+    server.db.set("late", 1)
+    expected = contents(server.db)
+    loaded = reopen(server)
+    try:
+        assert contents(loaded.db) == expected
+        assert loaded.db.expiry("ttl") is not None
+    finally:
+        loaded.aof.close()
\ No newline at end of file
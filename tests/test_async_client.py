@@ -0,0 +1,63 @@
+#test_async_client.py
+import asyncio
+import pytest
+from client import AsyncTCPClient
+
+
+@pytest.fixture
+def server(start_server):
+    return start_server()
+
+
+def test_concurrent_commands_share_one_batch(server):
+    async def main():
+        async with AsyncTCPClient(port=server.port, connections=4) as client:
+            responses = await asyncio.gather(*(client.set(f"k{i}", i) for i in range(1000)))
+            assert all(response["result"] == "OK" for response in responses)
+            # Everything was queued before the first connection was up, so it all went down that one
+            assert len(client.connections) == 1
+            responses = await asyncio.gather(*(client.get(f"k{i}") for i in range(1000)))
+            assert [response["result"] for response in responses] == list(range(1000))
+            responses = await asyncio.gather(*(client.incr("n") for _ in range(200)))
+            assert sorted(response["result"] for response in responses) == list(range(1, 201))
+
+    asyncio.run(main())
+
+
+def test_scan_iter_walks_every_key(server):
+    async def main():
+        async with AsyncTCPClient(port=server.port) as client:
+            await client.mset({f"user:{i}": i for i in range(250)})
+            await client.set("other", 1)
+            keys = [key async for key in client.scan_iter(match="user:*", count=50)]
+            assert sorted(keys) == sorted(f"user:{i}" for i in range(250))
+
+    asyncio.run(main())
+
+
+def test_subscriptions_are_async_iterators(server):
+    async def main():
+        async with AsyncTCPClient(port=server.port) as client:
+            news = await client.subscribe("news")
+            sport = await client.psubscribe("sport.*")
+            await client.publish("news", "hello")
+            await client.publish("sport.tennis", "ace")
+            message = await asyncio.wait_for(news.__anext__(), 5)
+            assert message["message"] == "hello"
+            message = await asyncio.wait_for(sport.__anext__(), 5)
+            assert (message["message"], message["pattern"]) == ("ace", "sport.*")
+            await news.unsubscribe()
+            assert [message async for message in news] == []
+
+    asyncio.run(main())
+
+
+def test_closed_client_refuses_commands(server):
+    async def main():
+        client = AsyncTCPClient(port=server.port)
+        await client.set("k", 1)
+        await client.disconnect()
+        with pytest.raises(ConnectionError):
+            await client.get("k")
+
+    asyncio.run(main())
\ No newline at end of file
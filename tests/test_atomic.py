@@ -0,0 +1,58 @@
+#test_atomic.py
+import threading
+import pytest
+from db import InMemoryDB
+
+
+def test_counters_and_string_updates():
+    db = InMemoryDB()
+    assert db.incr("n") == 1
+    assert db.incr("n", 5) == 6
+    assert db.decr("n", 2) == 4
+    assert db.append("s", "ab") == 2
+    assert db.append("s", "c") == 3
+    assert db.getset("s", "new") == "abc"
+    assert db.setnx("s", "other") is False
+    assert db.setnx("t", "first") is True
+    assert db.get("s") == "new" and db.get("t") == "first"
+    db.set("text", "abc")
+    with pytest.raises(ValueError):
+        db.incr("text")
+
+
+def test_concurrent_increments_are_not_lost():
+    db = InMemoryDB()
+    threads = [threading.Thread(target=lambda: [db.incr("n") for _ in range(1000)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert db.get("n") == 8000
+
+
+def test_cas_applies_only_on_the_expected_version():
+    db = InMemoryDB()
+    assert db.gets("k") == (None, 0)
+    assert db.cas("k", 0, "first")[0]
+    value, version = db.gets("k")
+    assert value == "first" and version
+    assert db.cas("k", 0, "again") == (False, version)
+    ok, new_version = db.cas("k", version, "second")
+    assert ok and new_version != version
+    assert db.cas("k", version, "stale") == (False, new_version)
+    assert db.get("k") == "second"
+
+
+def test_every_write_changes_the_version():
+    db = InMemoryDB()
+    db.set("k", 1)
+    versions = {db.gets("k")[1]}
+    db.incr("k")
+    versions.add(db.gets("k")[1])
+    db.command("hset", "h", ("f", 1))
+    before = db.gets("h")[1]
+    db.command("hset", "h", ("f", 2))
+    assert len(versions) == 2
+    assert db.gets("h")[1] != before
+    db.delete("k")
+    assert db.gets("k") == (None, 0)
\ No newline at end of file
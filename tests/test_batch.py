@@ -0,0 +1,29 @@
+#test_batch.py
+from client import TCPClient
+from db import InMemoryDB
+
+
+def test_multi_key_operations_span_stripes():
+    db = InMemoryDB(stripes=8)
+    keys = [f"k{i}" for i in range(50)]
+    assert len({id(db.stripe_for(key)) for key in keys}) == 8
+    db.mset([(key, i) for i, key in enumerate(keys)])
+    assert db.mget(keys + ["missing"]) == list(range(50)) + [None]
+    assert db.mexpire(["k0", "missing"], 100) == [True, False]
+    assert db.expiry("k0") is not None
+    assert db.mdelete(["k1", "k1", "missing"]) == [True, False, False]
+    assert "k1" not in db.data
+
+
+def test_batch_commands_over_the_wire(start_server):
+    server = start_server()
+    client = TCPClient(port=server.port, cache_size=0)
+    try:
+        response = client.mset({"a": 1, "b": 2, "c": 3}, ttl=100)
+        assert response["result"] == "OK" and response["count"] == 3
+        assert client.mget(["a", "missing", "c"])["result"] == [1, None, 3]
+        assert client.mexpire(["a", "missing"], 10)["result"] == [True, False]
+        assert client.mdelete(["a", "b", "missing"])["result"] == [True, True, False]
+        assert server.db.mget(["a", "b", "c"]) == [None, None, 3]
+    finally:
+        client.disconnect()
\ No newline at end of file
@@ -0,0 +1,79 @@
+#test_cdc.py
+import threading
+import pytest
+from cdc import ChangeConsumer, ChangeLog, ChangesLost
+from db import InMemoryDB
+
+
+def test_read_returns_changes_in_order_from_an_offset():
+    log = ChangeLog(8)
+    for i in range(5):
+        log.append("set", f"k{i}", i)
+    assert [event[0] for event in log.read(1, 3)] == [1, 2, 3]
+    assert [event[3] for event in log.read(4)] == ["k3", "k4"]
+    assert log.read(6) == []
+    assert log.next_offset() == 6
+
+
+def test_events_keep_keys_not_values():
+    log = ChangeLog(8)
+    log.append("set", "k", "a large value")
+    log.append("mset", None, [("a", 1), ("b", 2)])
+    log.append("mdelete", None, ["a", "b"])
+    log.append("clear", None, 3)
+    assert [event[2:] for event in log.read(1)] == [
+        ("set", "k", None), ("mset", None, ["a", "b"]), ("mdelete", None, ["a", "b"]), ("clear", None, 3)]
+
+
+def test_overwritten_changes_are_reported_lost():
+    log = ChangeLog(8)
+    for i in range(20):
+        log.append("set", "k", i)
+    with pytest.raises(ChangesLost) as lost:
+        log.read(2)
+    assert lost.value.oldest == log.oldest() == 13
+    assert [event[0] for event in log.read(lost.value.oldest)] == list(range(13, 21))
+
+
+def collect(changes, last, **kwargs):
+    """A consumer that gathers the events; done is set once it has the one at offset last."""
+    events, lost = [], []
+    done = threading.Event()
+
+    def handle(batch):
+        events.extend(batch)
+        if events[-1][0] == last:
+            done.set()
+
+    consumer = ChangeConsumer(changes, handle, on_lost=lambda: lost.append(True), **kwargs)
+    return consumer, events, lost, done
+
+
+def test_consumer_catches_up_from_an_earlier_offset():
+    db = InMemoryDB()
+    for i in range(50):
+        db.set(f"k{i}", i)
+    consumer, events, lost, done = collect(db.changes, 100, offset=1, batch_size=16)
+    consumer.start()
+    try:
+        for i in range(50, 100):
+            db.set(f"k{i}", i)
+        assert done.wait(5)
+    finally:
+        consumer.stop()
+    assert [event[0] for event in events] == list(range(1, 101))
+    assert not lost and consumer.stats()["lag"] == 0
+
+
+def test_consumer_that_fell_behind_resumes_at_the_oldest_change():
+    log = ChangeLog(8)
+    for i in range(20):
+        log.append("set", f"k{i}", i)
+    consumer, events, lost, done = collect(log, 20, offset=1)
+    consumer.start()
+    try:
+        assert done.wait(5)
+    finally:
+        consumer.stop()
+    assert lost == [True] and consumer.lost == 1
+    assert [event[0] for event in events] == list(range(13, 21))
\ No newline at end of file
@@ -0,0 +1,141 @@
+#test_client.py
+import socket
+import threading
+import time
+import pytest
+from client import ClusterClient, ConnectionPool, TCPClient
+from cluster import SLOTS
+from protocol import FrameReader, encode_frame, decode_frame
+from helpers import free_port
+
+
+class FakeServer:
+    """Speaks the framed protocol on a local port; drop(command) says when to hang up after applying a command.
+
+    handle(command), if given, returns the whole response instead of apply().
+    """
+
+    def __init__(self, drop=lambda command: False, handle=None):
+        self.drop = drop
+        self.handle = handle
+        self.data = {}
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self.serve, args=(sock,), daemon=True).start()
+
+    def serve(self, sock):
+        reader = FrameReader()
+        with sock:
+            while True:
+                frame = reader.read_frame(sock)
+                if frame is None:
+                    return
+                command = decode_frame(frame)
+                response = self.handle(command) if self.handle else {"result": self.apply(command)}
+                if self.drop(command):
+                    return
+                sock.sendall(encode_frame(dict(response, id=command["id"])))
+
+    def apply(self, command):
+        action, key = command["action"], command.get("key")
+        with self.lock:
+            if action == "incr":
+                self.data[key] = self.data.get(key, 0) + command.get("amount", 1)
+            elif action == "set":
+                self.data[key] = command["value"]
+            return self.data.get(key)
+
+    def close(self):
+        self.listener.close()
+
+
+@pytest.fixture
+def dropping():
+    """A server that hangs up after applying each connection's second command."""
+    counts = {}
+
+    def drop(command):
+        thread = threading.get_ident()
+        counts[thread] = counts.get(thread, 0) + 1
+        return counts[thread] == 2
+
+    server = FakeServer(drop)
+    yield server
+    server.close()
+
+
+def test_write_is_not_resent_when_the_connection_drops_after_it(dropping):
+    client = TCPClient(port=dropping.port, cache_size=0)
+    client.set("n", 1)  # Warms up the pooled connection
+    with pytest.raises(ConnectionError):
+        client.incr("n")
+    assert dropping.data["n"] == 2
+    client.pool.close()
+
+
+def test_read_is_retried_on_a_fresh_connection(dropping):
+    client = TCPClient(port=dropping.port, cache_size=0)
+    client.set("k", "v")
+    assert client.get("k")["result"] == "v"
+    assert dropping.connections == 2
+    client.pool.close()
+
+
+def test_pool_reuses_connections_up_to_its_size():
+    server = FakeServer()
+    client = TCPClient(port=server.port, pool_size=2, cache_size=0)
+    threads = [threading.Thread(target=lambda: [client.incr("n") for _ in range(50)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert server.data["n"] == 400
+    assert server.connections <= 2
+    client.pool.close()
+    server.close()
+
+
+def test_connecting_is_retried_with_backoff():
+    port = free_port()
+    listeners = []
+    timer = threading.Timer(0.2, lambda: listeners.append(socket.create_server(("127.0.0.1", port))))
+    timer.start()
+    pool = ConnectionPool("127.0.0.1", port, retries=6, backoff=0.05)
+    started = time.monotonic()
+    conn = pool.new_connection()
+    assert time.monotonic() - started >= 0.15
+    conn.sock.close()
+    timer.join()
+    listeners[0].close()
+    with pytest.raises(OSError):
+        ConnectionPool("127.0.0.1", port, retries=2, backoff=0.01).new_connection()
+
+
+def test_cluster_redirect_loops_stop_after_the_limit():
+    # Two nodes whose slot maps each say the other one owns everything
+    nodes = []
+
+    def handler(other):
+        def handle(command):
+            if command["action"] == "cluster":
+                return {"result": [[0, SLOTS - 1, other()]]}
+            return {"error": f"MOVED 0 {other()}"}
+        return handle
+
+    nodes.append(FakeServer(handle=handler(lambda: f"127.0.0.1:{nodes[1].port}")))
+    nodes.append(FakeServer(handle=handler(lambda: f"127.0.0.1:{nodes[0].port}")))
+    client = ClusterClient(port=nodes[0].port)
+    assert client.get("k")["error"].startswith("MOVED")
+    for node in nodes:
+        node.close()
\ No newline at end of file
@@ -0,0 +1,100 @@
+#test_cluster.py
+import pytest
+from cluster import ClusterRedirect, ClusterState, SLOTS, key_slot
+from db import InMemoryDB
+
+HERE, THERE = "127.0.0.1:7000", "127.0.0.1:7001"
+
+
+def key_in(node_index, prefix="k"):
+    """A key whose slot falls in the first or the second half of the slots."""
+    for i in range(10000):
+        key = f"{prefix}{i}"
+        if key_slot(key) * 2 // SLOTS == node_index:
+            return key
+
+
+@pytest.fixture
+def db():
+    return InMemoryDB()
+
+
+@pytest.fixture
+def here(db):
+    return ClusterState(db, HERE, [HERE, THERE], apply_entry=None, config_file="here.json")
+
+
+def serve(state, keys, asking=False):
+    with state.serving(keys, asking):
+        return True
+
+
+def test_key_slot_hashes_only_the_hash_tag():
+    assert key_slot("user:{42}:name") == key_slot("user:{42}:email") == key_slot("42")
+    assert key_slot("{}x") != key_slot("x")  # An empty tag does not count
+    assert 0 <= key_slot("anything") < SLOTS
+
+
+def test_keys_owned_elsewhere_are_moved(here):
+    mine, theirs = key_in(0), key_in(1)
+    assert serve(here, [mine])
+    with pytest.raises(ClusterRedirect, match=f"^MOVED {key_slot(theirs)} {THERE}$"):
+        serve(here, [theirs])
+    with pytest.raises(ClusterRedirect, match="^CROSSSLOT"):
+        serve(here, [mine, theirs])
+
+
+def test_migrating_slot_asks_for_keys_already_moved(here, db):
+    key = key_in(0)
+    slot = key_slot(key)
+    here.set_slots([slot], "migrating", THERE)
+    db.set(key, 1)
+    assert serve(here, [key])  # Still here
+    db.delete(key)
+    with pytest.raises(ClusterRedirect, match=f"^ASK {slot} {THERE}$"):
+        serve(here, [key])
+    tagged = [f"{{{key}}}:a", f"{{{key}}}:b"]
+    db.set(tagged[0], 1)
+    with pytest.raises(ClusterRedirect, match="^TRYAGAIN"):
+        serve(here, tagged)
+    here.set_slots([slot], "node", THERE)
+    with pytest.raises(ClusterRedirect, match=f"^MOVED {slot} {THERE}$"):
+        serve(here, [key])
+
+
+def test_importing_slot_serves_only_asking_requests():
+    there = ClusterState(InMemoryDB(), THERE, [HERE, THERE], apply_entry=None, config_file="there.json")
+    key = key_in(0)
+    slot = key_slot(key)
+    there.set_slots([slot], "importing", HERE)
+    with pytest.raises(ClusterRedirect, match=f"^MOVED {slot} {HERE}$"):
+        serve(there, [key])
+    assert serve(there, [key], asking=True)
+    there.set_slots([slot], "node", THERE)
+    assert serve(there, [key])
+
+
+def test_slot_map_survives_a_restart(here):
+    key = key_in(0)
+    here.set_slots([key_slot(key)], "node", THERE)
+    restarted = ClusterState(InMemoryDB(), HERE, [HERE, THERE], apply_entry=None, config_file="here.json")
+    with pytest.raises(ClusterRedirect, match="^MOVED"):
+        serve(restarted, [key])
+
+def test_slot_index_follows_writes(db):
+    existing = key_in(0, "old")
+    db.set(existing, 1)  # Stored before the node started
+    here = ClusterState(db, HERE, [HERE, THERE], apply_entry=None, config_file="here.json")
+    a, b, c = key_in(0, "a"), key_in(0, "b"), key_in(0, "c")
+    db.set(a, 1)
+    db.mset([(b, 1), (c, 1)])
+    db.command("rpush", "{%s}:list" % a, ("x",))
+    slots = [key_slot(key) for key in (existing, a, b, c)]
+    assert sorted(sum(here.keys_in_slots(slots).values(), [])) == sorted([existing, a, b, c, "{%s}:list" % a])
+    db.delete(existing)
+    db.mdelete([b])
+    db.command("lpop", "{%s}:list" % a)  # Empties the list, which removes it
+    assert sorted(sum(here.keys_in_slots(slots).values(), [])) == sorted([a, c])
+    assert here.handle_command({"subcommand": "countkeysinslot", "slot": key_slot(a)}) == {"result": 1}
+    db.clear()
+    assert here.keys_in_slots(slots) == {}
\ No newline at end of file
@@ -0,0 +1,70 @@
+#test_datatypes.py
+import pytest
+from datatypes import WrongTypeError
+from db import InMemoryDB
+
+
+@pytest.fixture
+def db():
+    return InMemoryDB()
+
+
+def test_hash_commands_and_encoding(db):
+    assert db.command("hset", "h", ("a", 1, "b", 2)) == 2
+    assert db.command("hset", "h", ("a", 3)) == 0
+    assert db.command("hgetall", "h") == {"a": 3, "b": 2}
+    assert db.key_type("h") == ("hash", "listpack")
+    for i in range(300):
+        db.command("hset", "h", (f"f{i}", i))
+    assert db.key_type("h") == ("hash", "hashtable")
+    assert db.command("hget", "h", ("f299",)) == 299
+    assert db.command("hdel", "h", ("a", "missing")) == 1
+
+
+def test_list_commands(db):
+    assert db.command("rpush", "l", ("b", "c")) == 2
+    assert db.command("lpush", "l", ("a",)) == 3
+    assert db.command("lrange", "l", (0, -1)) == ["a", "b", "c"]
+    assert db.command("lpop", "l") == "a"
+    assert db.command("rpop", "l") == "c"
+    assert db.command("lpop", "l") == "b"
+    assert "l" not in db.data  # An emptied collection is removed
+
+
+def test_sorted_set_commands(db):
+    assert db.command("zadd", "z", (2, "b", 1, "a", 3, "c")) == 3
+    assert db.command("zrange", "z", (0, -1)) == ["a", "b", "c"]
+    assert db.command("zrangebyscore", "z", (2, 3)) == ["b", "c"]
+    assert db.command("zrank", "z", ("c",)) == 2
+    assert db.command("zincrby", "z", (5, "a")) == 6
+    assert db.command("zrange", "z", (0, -1)) == ["b", "c", "a"]
+
+
+def test_set_commands(db):
+    assert db.command("sadd", "s", ("a", "b", "a")) == 2
+    assert db.command("sismember", "s", ("a",)) is True
+    assert db.command("srem", "s", ("a",)) == 1
+    assert db.command("smembers", "s") == ["b"]
+
+
+def test_commands_on_the_wrong_type_fail(db):
+    db.set("str", "x")
+    db.command("rpush", "l", ("x",))
+    with pytest.raises(WrongTypeError):
+        db.command("hset", "str", ("a", 1))
+    with pytest.raises(WrongTypeError):
+        db.command("sadd", "l", ("a",))
+    assert db.command("hget", "missing", ("a",)) is None
+
+
+def test_snapshot_is_not_changed_by_later_writes():
+    db = InMemoryDB()
+    db.command("hset", "h", ("f", "before"))
+    db.command("rpush", "l", ("a",))
+    items = db.snapshot()
+    db.command("hset", "h", ("f", "after", "g", "new"))
+    db.delete("l")
+    db.command("rpush", "l", ("other",))
+    taken = {key: value.dump() for key, value, _ in items}
+    assert taken == {"h": {"f": "before"}, "l": ["a"]}
+    assert db.snapshots == ()
\ No newline at end of file
@@ -0,0 +1,25 @@
+#test_db.py
+import threading
+from db import InMemoryDB
+
+
+def test_multi_key_writes_are_atomic():
+    db = InMemoryDB(stripes=8)
+    keys = [f"k{i}" for i in range(32)]
+    db.mset([(key, 0) for key in keys])
+    stop = threading.Event()
+    torn = []
+
+    def read():
+        while not stop.is_set():
+            values = db.mget(keys)
+            if len(set(values)) != 1:
+                torn.append(values)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for i in range(1, 300):
+        db.mset([(key, i) for key in keys])
+    stop.set()
+    reader.join()
+    assert not torn
\ No newline at end of file
@@ -0,0 +1,73 @@
+#test_eventloop.py
+import threading
+import pytest
+from client import TCPClient
+
+
+@pytest.fixture
+def server(start_server):
+    return start_server(mode="eventloop", workers=2)
+
+
+@pytest.fixture
+def client(server):
+    client = TCPClient(port=server.port, cache_size=0)
+    yield client
+    client.disconnect()
+
+
+def test_pipelined_requests_are_answered_in_order(client):
+    pipe = client.pipeline()
+    for i in range(500):
+        pipe.set(f"k{i}", i)
+        pipe.get(f"k{i}")
+    responses = pipe.execute()
+    assert [response["result"] for response in responses[1::2]] == list(range(500))
+
+
+def test_many_clients_share_the_loops(server):
+    clients = [TCPClient(port=server.port, pool_size=1, cache_size=0) for _ in range(8)]
+    errors = []
+
+    def work(client):
+        try:
+            for _ in range(100):
+                client.incr("n")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert clients[0].get("n")["result"] == 800
+    for client in clients:
+        client.disconnect()
+
+
+def test_blocking_requests_leave_the_loop_serving(client, server):
+    for i in range(100):
+        client.set(f"k{i}", "x" * 100)
+    assert "error" not in client.send_command("save")
+    assert client.flushall()["result"] == "OK"
+    assert client.get("k0")["result"] is None
+    client.set("after", 1)
+    assert client.get("after")["result"] == 1
+
+
+def test_subscribers_get_messages_published_on_another_connection(client, server):
+    received = []
+    delivered = threading.Event()
+
+    def on_message(message):
+        received.append(message)
+        delivered.set()
+
+    assert client.subscribe("news", on_message)
+    publisher = TCPClient(port=server.port, cache_size=0)
+    publisher.publish("news", "hello")
+    assert delivered.wait(5)
+    assert received[0]["message"] == "hello"
+    publisher.disconnect()
\ No newline at end of file
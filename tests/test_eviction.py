@@ -0,0 +1,79 @@
+#test_eviction.py
+import pytest
+from db import InMemoryDB
+from eviction import OutOfMemoryError
+
+
+def test_maxmemory_evicts_down_to_the_limit():
+    db = InMemoryDB(maxmemory=20000, policy="allkeys-lru")
+    for i in range(500):
+        db.set(f"k{i}", "x" * 100)
+    db.make_room()  # Like every write, the last one made room before it was stored
+    assert db.used_memory() <= 20000
+    assert db.memory_stats()["evicted_keys"] > 0
+    assert db.get("k499") == "x" * 100
+
+
+def test_used_memory_is_the_sum_over_the_stripes():
+    db = InMemoryDB(stripes=8)
+
+    def by_stripe():
+        return sum(stripe.memory.used for stripe in db.stripes)
+
+    db.mset([(f"k{i}", "x" * i) for i in range(100)])
+    db.command("rpush", "l", tuple(range(50)))
+    db.mdelete([f"k{i}" for i in range(0, 100, 3)])
+    db.set("k1", "longer" * 20)
+    assert db.used_memory() == by_stripe() > 0
+    db.clear(lazy=True)
+    assert db.used_memory() == by_stripe() == 0
+    db.set("k", "v")
+    db.clear(lazy=False)
+    assert db.used_memory() == 0
+
+
+def test_eviction_asks_only_a_few_stripes():
+    db = InMemoryDB(stripes=16, maxmemory=20000, policy="allkeys-lru")
+    for i in range(200):
+        db.set(f"k{i}", "x" * 100)
+    asked = []
+    for stripe in db.stripes:
+        def candidate(stripe_, memory=stripe.memory, propose=stripe.memory.candidate):
+            asked.append(memory)
+            return propose(stripe_)
+        stripe.memory.candidate = candidate
+    evicted = db.memory_stats()["evicted_keys"]
+    db.set("big", "x" * 3000)
+    rounds = db.memory_stats()["evicted_keys"] - evicted
+    assert rounds > 0
+    assert len(asked) <= rounds * db.stripe_samples
+
+
+def test_volatile_ttl_only_evicts_keys_with_a_ttl():
+    db = InMemoryDB(maxmemory=5000, policy="volatile-ttl")
+    for i in range(10):
+        db.set(f"keep{i}", "x" * 100)
+    for i in range(200):
+        db.set(f"temp{i}", "x" * 100, ttl=1000 + i)
+    assert all(db.get(f"keep{i}") for i in range(10))
+    assert db.memory_stats()["evicted_keys"] > 0
+
+
+def test_noeviction_rejects_writes_over_the_limit():
+    db = InMemoryDB(maxmemory=2000, policy="noeviction")
+    with pytest.raises(OutOfMemoryError):
+        for i in range(100):
+            db.set(f"k{i}", "x" * 100)
+    assert db.get("k0") == "x" * 100
+    assert db.delete("k0")
+
+
+def test_lfu_keeps_frequently_read_keys():
+    db = InMemoryDB(stripes=1, maxmemory=30000, policy="allkeys-lfu")
+    db.set("hot", "x" * 100)
+    for _ in range(200):
+        db.get("hot")
+    for i in range(500):
+        db.set(f"cold{i}", "x" * 100)
+    assert db.memory_stats()["evicted_keys"] > 0
+    assert db.get("hot") == "x" * 100
\ No newline at end of file
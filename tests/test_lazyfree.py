@@ -0,0 +1,78 @@
+#test_lazyfree.py
+import time
+from client import TCPClient
+from datatypes import Hash
+from db import InMemoryDB
+from lazyfree import Reclaimer, free_effort
+
+
+def wait_until_freed(stats, count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while stats()["lazyfreed_objects"] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert stats()["lazyfree_pending_objects"] == 0
+    assert stats()["lazyfree_pending_memory"] == 0
+
+
+def test_free_effort_counts_elements_and_pages():
+    assert free_effort(1) == 1
+    assert free_effort("x" * 10000) == 3
+    assert free_effort(list(range(100))) == 100
+    assert free_effort({"a": 1, "b": 2}) == 2
+
+
+def test_data_types_are_taken_apart_in_chunks():
+    reclaimer = Reclaimer(threshold=10)
+    value = Hash()
+    value.table = {f"f{i}": i for i in range(Reclaimer.CHUNK * 3)}
+    table = value.table
+    assert reclaimer.worth_it(value)
+    reclaimer.release(value, 1000)
+    wait_until_freed(reclaimer.stats, 1)
+    assert table == {}
+
+
+def test_plain_values_are_dropped_whole():
+    # A client may still hold a value that get() returned
+    reclaimer = Reclaimer(threshold=10)
+    value = {i: i for i in range(100)}
+    reclaimer.release(value)
+    wait_until_freed(reclaimer.stats, 1)
+    assert len(value) == 100
+
+
+def test_lazy_delete_hands_large_values_to_the_reclaimer():
+    db = InMemoryDB()
+    for i in range(200):
+        db.command("hset", "big", (f"f{i}", i))
+    db.set("small", 1)
+    assert db.mdelete(["big", "small"], lazy=True) == [True, True]
+    wait_until_freed(db.memory_stats, 1)
+    assert db.memory_stats()["lazyfreed_objects"] == 1
+
+
+def test_lazy_clear_swaps_the_keyspace_out():
+    db = InMemoryDB(lazyfree=True)
+    for i in range(1000):
+        db.set(f"k{i}", i, ttl=3600)
+    db.clear()
+    assert not db.keys()
+    assert db.used_memory() == 0
+    wait_until_freed(db.memory_stats, 1)
+    db.set("k0", "after")
+    assert db.get("k0") == "after"
+
+
+def test_unlink_and_async_flushall_over_the_wire(start_server):
+    server = start_server()
+    client = TCPClient(port=server.port, cache_size=0)
+    for i in range(100):
+        client.rpush("l", *range(10))
+    client.set("k", 1)
+    assert client.unlink(["l", "k", "missing"])["deleted"] == 2
+    client.set("k", 2)
+    assert client.flushall(asynchronous=True)["result"] == "OK"
+    assert client.get("k")["result"] is None
+    wait_until_freed(server.db.memory_stats, 2)
+    client.disconnect()
\ No newline at end of file
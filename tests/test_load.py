@@ -0,0 +1,54 @@
+#test_load.py
+import json
+import time
+from db import InMemoryDB
+from network import TCPServer
+from storage import Snapshot
+from helpers import contents, fill
+
+
+def test_load_items_stores_in_bulk():
+    db = InMemoryDB(stripes=4)
+    changes = []
+    db.add_observer(lambda *change: changes.append(change))
+    db.set("stale", 1)
+    changes.clear()
+    now = time.time()
+    stored, expired = db.load_items([
+        ("a", 1, None),
+        ("a", 2, None),  # The last item for a key wins
+        ("soon", "v", now + 0.01),
+        ("later", "v", now + 100),
+        ("stale", "v", now - 1),  # Already expired, which removes the key
+    ], now=now)
+    assert (stored, expired) == (4, 1)
+    assert db.get("a") == 2 and db.get("stale") is None
+    assert not changes
+    assert db.used_memory() == sum(stripe.memory.used for stripe in db.stripes) > 0
+    time.sleep(0.02)
+    assert db.expire_due() == 1  # The TTL heaps were rebuilt
+    assert sorted(db.data) == ["a", "later"]
+
+
+def test_server_starts_from_a_snapshot(workdir):
+    db = InMemoryDB()
+    fill(db)
+    Snapshot().save(db.snapshot())
+    server = TCPServer(port=0, resp_port=0, metrics_port=0)
+    try:
+        assert server.last_load["source"] == "dump.imdb"
+        assert server.last_load["entries"] == len(db.data)
+        assert contents(server.db) == contents(db)
+        assert server.db.expiry("ttl") is not None
+    finally:
+        server.aof.close()
+
+
+def test_server_falls_back_to_the_legacy_json_file(workdir):
+    (workdir / "persistence.json").write_text(json.dumps({"a": 1, "b": [1, 2]}))
+    server = TCPServer(port=0, resp_port=0, metrics_port=0)
+    try:
+        assert server.last_load["source"] == "persistence.json"
+        assert server.db.get("a") == 1 and server.db.get("b") == [1, 2]
+    finally:
+        server.aof.close()
\ No newline at end of file
@@ -0,0 +1,82 @@
+#test_pubsub.py
+import json
+import threading
+from protocol import FrameReader
+from pubsub import PatternIndex, PubSub
+
+
+def test_patterns_match_like_globs():
+    index = PatternIndex()
+    for pattern in ("news.*", "news.sport", "*.weather", "h?llo", "h[ae]llo", "*", "a\\*b"):
+        index.add(pattern)
+    assert set(index.match("news.sport")) == {"news.*", "news.sport", "*"}
+    assert set(index.match("uk.weather")) == {"*.weather", "*"}
+    assert set(index.match("hello")) == {"h?llo", "h[ae]llo", "*"}
+    assert set(index.match("hxllo")) == {"h?llo", "*"}
+    assert set(index.match("a*b")) == {"a\\*b", "*"}
+    assert set(index.match("axb")) == {"*"}
+    assert set(index.match("news")) == {"*"}
+
+
+def test_removed_patterns_stop_matching():
+    index = PatternIndex()
+    index.add("news.*")
+    index.add("news.sport.*")
+    assert set(index.match("news.sport.live")) == {"news.*", "news.sport.*"}
+    index.remove("news.*")
+    index.remove("unknown")
+    assert index.match("news.sport.live") == ("news.sport.*",)
+    assert len(index) == 1
+    index.remove("news.sport.*")
+    assert index.match("news.sport.live") == ()
+    assert index.root == {}
+
+
+def test_patterns_starting_with_a_wildcard():
+    index = PatternIndex()
+    for pattern in ("*.errors", "*.warnings", "*sport*", "*[0-9]", "?x*"):
+        index.add(pattern)
+    assert set(index.match("app.errors")) == {"*.errors"}
+    assert set(index.match("live.sport.2")) == {"*sport*", "*[0-9]"}
+    assert set(index.match("axe")) == {"?x*"}
+    assert index.match("errors") == ()
+    index.remove("*.errors")
+    index.remove("*sport*")
+    assert index.match("app.errors") == ()
+    assert set(index.match("live.sport.2")) == {"*[0-9]"}
+    assert len(index) == 3
+    for pattern in ("*.warnings", "*[0-9]", "?x*"):
+        index.remove(pattern)
+    assert index.suffix_root == {} and index.unanchored_filter is None
+
+
+class Client:
+    """Stands in for a subscriber's socket and records the frames written to it."""
+
+    def __init__(self):
+        self.reader = FrameReader()
+        self.received = threading.Event()
+
+    def sendall(self, data):
+        self.reader.feed(data)
+        self.received.set()
+
+    def messages(self):
+        return [json.loads(frame) for frame in self.reader.frames()]
+
+
+def test_publish_reaches_channel_and_pattern_subscribers():
+    pubsub = PubSub()
+    channel, pattern, other = Client(), Client(), Client()
+    pubsub.subscribe("news.sport", channel)
+    pubsub.psubscribe("news.*", pattern)
+    pubsub.psubscribe("weather.*", other)
+    try:
+        assert pubsub.publish("news.sport", "goal") == 2
+        assert channel.received.wait(1) and pattern.received.wait(1)
+        assert channel.messages()[-1] == {"channel": "news.sport", "message": "goal"}
+        assert pattern.messages()[-1] == {"channel": "news.sport", "message": "goal", "pattern": "news.*"}
+        assert pubsub.publish("sport", "nothing") == 0
+    finally:
+        for client in (channel, pattern, other):
+            pubsub.drop_client(client)
\ No newline at end of file
@@ -0,0 +1,60 @@
+#test_replication.py
+import socket
+import time
+import pytest
+from client import TCPClient
+from helpers import contents
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+@pytest.fixture
+def pair(start_server, workdir, monkeypatch):
+    """A primary and a replica following it, each keeping its data files in a directory of its own."""
+    (workdir / "primary").mkdir()
+    (workdir / "replica").mkdir()
+    monkeypatch.chdir(workdir / "primary")
+    primary = start_server()
+    client = TCPClient(port=primary.port, cache_size=0)
+    client.mset({f"k{i}": i for i in range(1000)})
+    monkeypatch.chdir(workdir / "replica")
+    replica = start_server(replica_of=("127.0.0.1", primary.port))
+    yield primary, replica, client
+    client.disconnect()
+
+
+def test_replica_gets_a_full_sync_and_then_the_stream(pair):
+    primary, replica, client = pair
+    assert wait_for(lambda: replica.replica.state == "online")
+    client.set("after", "sync")
+    client.hset("h", {"f": "v"})
+    client.delete("k0")
+    assert wait_for(lambda: contents(replica.db) == contents(primary.db))
+    assert replica.replica.full_syncs == 1
+    assert replica.info()["replication"]["role"] == "replica"
+
+
+def test_replica_rejects_writes(pair):
+    _, replica, _ = pair
+    client = TCPClient(port=replica.port, cache_size=0)
+    try:
+        assert client.set("k", 1)["error"].startswith("READONLY")
+        assert wait_for(lambda: client.get("k1")["result"] == 1)
+    finally:
+        client.disconnect()
+
+
+def test_replica_continues_after_the_link_drops(pair):
+    primary, replica, client = pair
+    assert wait_for(lambda: replica.replica.state == "online")
+    replica.replica.sock.shutdown(socket.SHUT_RDWR)
+    client.set("while", "down")
+    assert wait_for(lambda: replica.db.get("while") == "down")
+    assert replica.replica.full_syncs == 1  # Resumed from the backlog
\ No newline at end of file
@@ -0,0 +1,84 @@
+#test_resp.py
+import random
+import socket
+import pytest
+from resp import RespProtocolError, RespReader, encode
+from helpers import free_port
+
+
+def command(*args):
+    args = [arg if isinstance(arg, bytes) else str(arg).encode() for arg in args]
+    return b'*%d\r\n' % len(args) + b''.join(b'$%d\r\n%b\r\n' % (len(arg), arg) for arg in args)
+
+
+def test_reader_reassembles_commands_from_any_chunking():
+    commands = [[b'SET', b'k%d' % i, random.randbytes(random.randrange(3000))] for i in range(100)]
+    stream = b''.join(command(*args) for args in commands) + b'PING\r\n'  # Ends with an inline command
+    reader = RespReader()
+    parsed = []
+    position = 0
+    while position < len(stream):
+        size = random.randrange(1, 700)
+        reader.feed(stream[position:position + size])
+        position += size
+        parsed.extend(reader.commands())
+    assert parsed == commands + [[b'PING']]
+
+
+def test_reader_rejects_malformed_input():
+    reader = RespReader()
+    reader.feed(b'*1\r\n$x\r\n')
+    with pytest.raises(RespProtocolError):
+        reader.commands()
+
+
+def test_replies_in_resp2_and_resp3():
+    assert encode({"a": 1}) == b'*2\r\n$1\r\na\r\n:1\r\n'
+    assert encode({"a": 1}, 3) == b'%1\r\n$1\r\na\r\n:1\r\n'
+    assert encode(None) == b'$-1\r\n' and encode(None, 3) == b'_\r\n'
+    assert encode(True) == b':1\r\n' and encode(True, 3) == b'#t\r\n'
+
+
+@pytest.fixture
+def conn(start_server):
+    server = start_server(resp_port=free_port())
+    sock = socket.create_connection(("127.0.0.1", server.resp_port), timeout=5)
+    yield sock, server
+    sock.close()
+
+
+def exchange(sock, request, expected):
+    """Send request and read exactly as many bytes as the expected reply has."""
+    sock.sendall(request)
+    reply = b''
+    while len(reply) < len(expected):
+        data = sock.recv(65536)
+        if not data:
+            break
+        reply += data
+    return reply
+
+
+def test_commands_over_resp(conn):
+    sock, server = conn
+    assert exchange(sock, command('PING'), b'+PONG\r\n') == b'+PONG\r\n'
+    assert exchange(sock, command('SET', 'foo', 'bar'), b'+OK\r\n') == b'+OK\r\n'
+    assert exchange(sock, command('GET', 'foo'), b'$3\r\nbar\r\n') == b'$3\r\nbar\r\n'
+    assert exchange(sock, command('GET', 'nope'), b'$-1\r\n') == b'$-1\r\n'
+    assert exchange(sock, command('SET', 't', 1, 'EX', 100), b'+OK\r\n') == b'+OK\r\n'
+    assert exchange(sock, command('TTL', 't'), b':100\r\n') == b':100\r\n'
+    assert exchange(sock, command('FOO'), b'-ERR unknown').startswith(b'-ERR unknown')
+    assert server.db.get("foo") == "bar"  # The same keyspace as the JSON protocol
+
+
+def test_pipelined_commands_over_resp(conn):
+    sock, _ = conn
+    expected = b''.join(b':%d\r\n' % i for i in range(1, 1001))
+    assert exchange(sock, command('INCR', 'n') * 1000, expected) == expected
+
+
+def test_hello_switches_to_resp3(conn):
+    sock, _ = conn
+    sock.sendall(command('HELLO', 3))
+    assert sock.recv(65536).startswith(b'%')
+    assert exchange(sock, command('GET', 'nope'), b'_\r\n') == b'_\r\n'
\ No newline at end of file
@@ -0,0 +1,60 @@
+#test_scan.py
+import pytest
+from db import InMemoryDB
+from scan import match_pattern
+
+
+def scan_all(db, match=None, count=10, between=None):
+    cursor, seen = 0, []
+    while True:
+        cursor, keys = db.scan(cursor, match, count)
+        seen.extend(keys)
+        if between:
+            between()
+        if cursor == 0:
+            return seen
+
+
+@pytest.mark.parametrize("pattern, key, matches", [
+    ("user:*", "user:42", True),
+    ("user:*", "users", False),
+    ("h?llo", "hallo", True),
+    ("h[ae]llo", "hillo", False),
+    ("h[^e]llo", "hallo", True),
+    ("h[a-c]llo", "hbllo", True),
+    ("a\\*b", "a*b", True),
+    ("a\\*b", "axb", False),
+    ("[unclosed", "[unclosed", True),
+])
+def test_glob_patterns(pattern, key, matches):
+    assert match_pattern(pattern, key) is matches
+
+
+def test_scan_returns_every_key_once_without_writes():
+    db = InMemoryDB(stripes=4)
+    db.mset([(f"k{i}", i) for i in range(1000)])
+    seen = scan_all(db, count=37)
+    assert sorted(seen) == sorted(db.data)
+
+
+def test_scan_filters_by_pattern_and_skips_expired_keys():
+    db = InMemoryDB()
+    db.mset([(f"user:{i}", i) for i in range(50)] + [(f"order:{i}", i) for i in range(50)])
+    db.set("user:expired", 1, ttl=-1)
+    assert sorted(scan_all(db, match="user:*")) == sorted(f"user:{i}" for i in range(50))
+
+
+def test_keys_present_for_the_whole_scan_are_returned_despite_writes():
+    db = InMemoryDB(stripes=4)
+    stable = [f"stable{i}" for i in range(500)]
+    db.mset([(key, 1) for key in stable] + [(f"temp{i}", 1) for i in range(500)])
+    added = iter(range(10 ** 6))
+
+    def churn():
+        for _ in range(20):
+            i = next(added)
+            db.delete(f"temp{i}")
+            db.set(f"new{i}", 1)
+
+    seen = set(scan_all(db, count=25, between=churn))
+    assert seen >= set(stable)
\ No newline at end of file
@@ -0,0 +1,72 @@
+#test_snapshot.py
+import threading
+import time
+import pytest
+from datatypes import Hash, List, Set, SortedSet
+from db import InMemoryDB
+from storage import Snapshot
+from helpers import contents, fill
+
+
+def test_snapshot_round_trips_collections_and_expiry():
+    db = InMemoryDB()
+    fill(db)
+    for i in range(300):
+        db.command("hset", "big", (f"f{i}", i))  # Past the compact encoding
+    snapshot = Snapshot("dump.imdb")
+    snapshot.save(db.snapshot())
+    items = {key: (value, expire_at) for key, value, expire_at in snapshot.iter_items()}
+    assert isinstance(items["h"][0], Hash)
+    assert isinstance(items["l"][0], List)
+    assert isinstance(items["set"][0], Set)
+    assert isinstance(items["z"][0], SortedSet)
+    assert items["ttl"][1] > time.time()
+    loaded = InMemoryDB()
+    loaded.load_items((key, value, expire_at) for key, (value, expire_at) in items.items())
+    assert contents(loaded) == contents(db)
+    assert loaded.key_type("big") == db.key_type("big")
+
+
+def test_background_save_without_fork_writes_from_a_thread():
+    db = InMemoryDB()
+    fill(db)
+    snapshot = Snapshot("dump.imdb", use_fork=False)
+    done = threading.Event()
+    results = []
+
+    def on_done(success):
+        results.append(success)
+        done.set()
+
+    assert snapshot.save_in_background(db.snapshot, on_done)
+    db.set("s", "changed after the snapshot started")
+    assert done.wait(10)
+    assert results == [True] and not snapshot.in_progress
+    items = {key: value for key, value, _ in snapshot.iter_items()}
+    assert items["s"] == "text"
+    assert set(items) == set(db.data)
+
+
+def test_forked_save_waits_for_snapshot_bookkeeping(server):
+    if not server.snapshot.use_fork:
+        pytest.skip("fork() is not available")
+    fill(server.db)
+    held = threading.Event()
+
+    def hold_snapshots_lock():
+        # What a finishing snapshot does in _forget(), on a thread of its own
+        with server.db.snapshots_lock:
+            held.set()
+            time.sleep(0.3)
+
+    holder = threading.Thread(target=hold_snapshots_lock)
+    holder.start()
+    held.wait()
+    assert server.background_save()
+    holder.join()
+    deadline = time.monotonic() + 10
+    while server.snapshot.in_progress and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not server.snapshot.in_progress
+    assert server.last_bgsave_ok
+    assert {key for key, _, _ in server.snapshot.iter_items()} == set(server.db.data)
\ No newline at end of file
@@ -0,0 +1,70 @@
+#test_spill.py
+from db import InMemoryDB
+from spill import COLD, SpillFile
+from storage import Snapshot
+from helpers import contents
+
+
+def tiered(hot_keys=100):
+    return InMemoryDB(stripes=4, hot_keys=hot_keys, spill_dir="spill")
+
+
+def test_spill_file_round_trips_values():
+    spill = SpillFile("spill", compact_min_size=0, capacity=16)
+    first = spill.write({"a": [1, 2]})
+    second = spill.write("x" * 100)  # Grows the mapping
+    assert spill.read(first) == {"a": [1, 2]}
+    assert spill.read(second) == "x" * 100
+    spill.free(first)
+    locations = {"second": second}
+    compacted = spill.compact(locations)
+    assert compacted.read(locations["second"]) == "x" * 100
+    assert compacted.size < spill.size
+
+
+def test_cold_values_are_read_back_and_made_hot():
+    db = tiered()
+    for i in range(1000):
+        db.set(f"k{i}", f"value {i}")
+    cold = [key for key, value in db.data.items() if value is COLD]
+    assert len(cold) >= 800
+    assert db.memory_stats()["cold_keys"] == len(cold)
+    assert db.get(cold[0]) == f"value {cold[0][1:]}"
+    assert db.data[cold[0]] is not COLD
+    assert db.mget(cold[1:3]) == [f"value {key[1:]}" for key in cold[1:3]]
+
+
+def test_cold_values_use_less_memory_than_hot_ones():
+    everything = InMemoryDB(stripes=4)
+    db = tiered()
+    for i in range(1000):
+        everything.set(f"k{i}", "x" * 1000)
+        db.set(f"k{i}", "x" * 1000)
+    assert db.used_memory() < everything.used_memory() / 3
+
+
+def test_snapshots_and_collections_see_cold_values():
+    db = tiered(hot_keys=8)
+    for i in range(100):
+        db.command("hset", f"h{i}", ("f", i))
+        db.set(f"s{i}", i)
+    Snapshot("dump.imdb").save(db.snapshot())
+    loaded = InMemoryDB()
+    loaded.load_items(Snapshot("dump.imdb").iter_items())
+    everything = InMemoryDB()
+    for i in range(100):
+        everything.command("hset", f"h{i}", ("f", i))
+        everything.set(f"s{i}", i)
+    assert contents(loaded) == contents(everything)
+    assert db.command("hget", "h0", ("f",)) == 0
+
+
+def test_overwritten_cold_values_are_compacted_away():
+    db = InMemoryDB(stripes=1, hot_keys=1, spill_dir="spill")
+    for stripe in db.stripes:
+        stripe.spill.compact_min_size = 0
+    for round_ in range(3):
+        for i in range(100):
+            db.set(f"k{i}", f"{round_} " + "x" * 100)
+    assert db.compact_spill() == 1
+    assert all(db.get(f"k{i}") == "2 " + "x" * 100 for i in range(100))
\ No newline at end of file
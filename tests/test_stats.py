@@ -0,0 +1,57 @@
+#test_stats.py
+import urllib.request
+from client import TCPClient
+from stats import LatencyHistogram, SlowLog
+from helpers import free_port
+
+
+def test_histogram_percentiles_are_within_the_bucket_width():
+    histogram = LatencyHistogram()
+    for ms in range(1, 1001):
+        histogram.record(ms * 1_000_000)
+    assert abs(histogram.percentile(50) - 500) / 500 < 0.02
+    assert abs(histogram.percentile(99) - 990) / 990 < 0.02
+    other = LatencyHistogram()
+    other.record(5_000_000_000)
+    histogram.merge(other)
+    assert histogram.total == 1001
+    assert histogram.percentile(100) == 5000
+
+
+def test_slowlog_keeps_the_newest_slow_commands():
+    slowlog = SlowLog(slower_than_us=1000, max_len=3)
+    assert not slowlog.is_slow(999_999)
+    assert slowlog.is_slow(1_000_000)
+    for i in range(5):
+        slowlog.add(2_000_000, ["set", f"k{i}", "x" * 1000])
+    entries = slowlog.get(10)
+    assert [entry["command"][1] for entry in entries] == ["k4", "k3", "k2"]
+    assert entries[0]["duration_us"] == 2000
+    assert entries[0]["command"][2].endswith("(872 more characters)")
+    slowlog.reset()
+    assert len(slowlog) == 0
+    assert not SlowLog(slower_than_us=-1).is_slow(10 ** 12)
+
+
+def test_info_slowlog_and_metrics_endpoint(start_server):
+    server = start_server(metrics_port=free_port())
+    server.slowlog.slower_than_ns = 0  # Log every command
+    client = TCPClient(port=server.port, cache_size=0)
+    try:
+        client.set("k", 1)
+        client.get("k")
+        info = client.info()["result"]
+        assert info["keyspace"]["keys"] == 1
+        assert info["commandstats"]["set"]["calls"] == 1
+        stats = client.info("commandstats")["result"]["commandstats"]
+        assert stats["get"]["p99_usec"] > 0
+        entries = client.slowlog("get", 10)["result"]
+        assert any(entry["command"][:2] == ["set", "k"] for entry in entries)
+        assert client.slowlog("reset")["result"] == "OK"
+        url = f"http://127.0.0.1:{server.metrics_port}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            body = response.read().decode()
+        assert "imdb_keys 1" in body
+        assert 'imdb_command_duration_seconds_count{action="set"} 1' in body
+    finally:
+        client.disconnect()
\ No newline at end of file
@@ -0,0 +1,87 @@
+#test_tracking.py
+import time
+import pytest
+from client import TCPClient
+from tracking import KeyTracker, invalidation_channel
+
+
+class Recorder:
+    """Stands in for PubSub: everyone is listening, and published messages are kept."""
+
+    def __init__(self):
+        self.messages = []
+
+    def has_subscribers(self, channel):
+        return True
+
+    def publish(self, channel, message):
+        self.messages.append((channel, message))
+        return 1
+
+
+def test_readers_are_told_once_about_changed_keys():
+    pubsub = Recorder()
+    tracker = KeyTracker(pubsub)
+    tracker.track("a", ["k1", "k2"])
+    tracker.track("b", ["k2"])
+    tracker.invalidate(["k2", "other"])
+    assert sorted(pubsub.messages) == [(invalidation_channel("a"), {"keys": ["k2"]}),
+                                       (invalidation_channel("b"), {"keys": ["k2"]})]
+    tracker.invalidate(["k2"])  # Nobody read it since
+    assert len(pubsub.messages) == 2
+    assert tracker.stats()["tracked_keys"] == 1
+
+
+def test_full_table_drops_the_oldest_keys():
+    pubsub = Recorder()
+    tracker = KeyTracker(pubsub, max_keys=2)
+    tracker.track("a", ["k1", "k2", "k3"])
+    assert pubsub.messages == [(invalidation_channel("a"), {"keys": ["k1"]})]
+    assert list(tracker.table) == ["k2", "k3"]
+
+
+def test_invalidate_all_clears_whole_caches():
+    pubsub = Recorder()
+    tracker = KeyTracker(pubsub)
+    tracker.track("a", ["k1"])
+    tracker.invalidate_all()
+    assert pubsub.messages == [(invalidation_channel("a"), {"keys": None})]
+    assert not tracker.table
+
+
+@pytest.fixture
+def server(start_server):
+    return start_server()
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_cached_reads_see_writes_from_other_clients(server):
+    reader = TCPClient(port=server.port, cache_size=100)
+    writer = TCPClient(port=server.port, cache_size=0)
+    writer.set("k", "old")
+    assert reader.get("k")["result"] == "old"
+    assert reader.get("k")["result"] == "old"
+    assert reader.cache_stats()["hits"] == 1
+    writer.set("k", "new")
+    wait_until(lambda: reader.cache_stats()["invalidations"] == 1)
+    assert reader.get("k")["result"] == "new"
+    writer.flushall()
+    wait_until(lambda: reader.cache_stats()["size"] == 0)
+    assert reader.get("k")["result"] is None
+    reader.disconnect()
+    writer.disconnect()
+
+
+def test_own_writes_update_the_cache(server):
+    client = TCPClient(port=server.port, cache_size=100)
+    client.set("k", 1)
+    assert client.get("k")["result"] == 1
+    client.incr("k")
+    assert client.get("k")["result"] == 2
+    client.disconnect()
\ No newline at end of file
@@ -0,0 +1,53 @@
+#test_ttl.py
+import time
+from db import InMemoryDB
+from ttl import TTL
+
+
+def test_pop_expired_returns_due_keys_in_expiry_order():
+    ttl = TTL()
+    for i, key in enumerate(["c", "a", "b", "later"]):
+        ttl.set_expiry(key, 100 + i if key != "later" else 1000)
+    assert ttl.pop_expired(now=200, limit=2) == ["c", "a"]
+    assert ttl.pop_expired(now=200) == ["b"]
+    assert ttl.pop_expired(now=200) == []
+    assert ttl.next_expiry() == 1000
+
+
+def test_changed_and_removed_ttls_leave_no_live_entries():
+    ttl = TTL()
+    ttl.set_expiry("moved", 100)
+    ttl.set_expiry("moved", 500)
+    ttl.set_expiry("gone", 100)
+    ttl.delete_ttl("gone")
+    assert ttl.earliest() == (500, "moved")
+    assert ttl.pop_expired(now=200) == []
+    assert ttl.pop_expired(now=600) == ["moved"]
+
+
+def test_stale_entries_are_compacted_away():
+    ttl = TTL()
+    for i in range(5000):
+        ttl.set_expiry("k", i)
+    assert len(ttl.heap) <= 2 * len(ttl.ttl_data) + 1024
+    assert ttl.pop_expired(now=10 ** 6) == ["k"]
+
+
+def test_expired_keys_are_gone():
+    db = InMemoryDB()
+    db.set("k", 1, ttl=0.01)
+    time.sleep(0.02)
+    assert db.get("k") is None
+
+
+def test_expire_due_stops_at_its_time_budget_and_resumes():
+    db = InMemoryDB(stripes=4)
+    for i in range(2000):
+        db.set(f"k{i}", i, ttl=0.01)
+    db.set("keep", 1, ttl=100)
+    time.sleep(0.02)
+    expired = db.expire_due(time_budget=0)
+    assert 0 < expired < 2000
+    while expired < 2000:
+        expired += db.expire_due(time_budget=0)
+    assert list(db.data) == ["keep"]
\ No newline at end of file
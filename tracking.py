@@ -0,0 +1,90 @@
+#tracking.py
+import threading
+from config import TRACKING_TABLE_MAX_KEYS
+
+INVALIDATE_PREFIX = '__invalidate__:'
+
+def invalidation_channel(token):
+    """The channel a caching client listens on for the invalidations of its token."""
+    return INVALIDATE_PREFIX + token
+
+
+class KeyTracker:
+    """Remembers which caching clients have read which keys, to tell them when the keys change.
+
+    A client reads with a token, and subscribes to its token's invalidation
+    channel. Once a tracked key is written, deleted, expires or is evicted,
+    every token that read it is sent {"keys": [...]} on its channel and
+    forgotten for that key, until it reads the key again. Keys are tracked
+    before they are read, so a write that lands between the read and the
+    reply is still reported. The table holds at most max_keys keys; the
+    oldest are dropped beyond that, and their readers told to drop them too.
+    """
+
+    def __init__(self, pubsub, max_keys=TRACKING_TABLE_MAX_KEYS):
+        self.pubsub = pubsub
+        self.max_keys = max_keys
+        self.table = {}  # key -> set of tokens, in the order keys were first tracked
+        self.lock = threading.Lock()
+        self.invalidated_keys = 0  # Keys sent to clients in invalidation messages
+        self.messages = 0  # Invalidation messages published
+
+    def track(self, token, keys):
+        """Note that the client with token is about to read keys.
+
+        Returns False, and tracks nothing, if nobody listens on the token's channel.
+        """
+        if not self.pubsub.has_subscribers(invalidation_channel(token)):
+            return False
+        evicted = {}
+        with self.lock:
+            for key in keys:
+                tokens = self.table.get(key)
+                if tokens is None:
+                    tokens = self.table[key] = set()
+                tokens.add(token)
+            while len(self.table) > self.max_keys:
+                oldest = next(iter(self.table))
+                evicted[oldest] = self.table.pop(oldest)
+        if evicted:
+            self._publish(evicted)
+        return True
+
+    def invalidate(self, keys):
+        """Tell the clients that read any of keys that their copies are stale."""
+        if not self.table:
+            return
+        with self.lock:
+            popped = {}
+            for key in keys:
+                tokens = self.table.pop(key, None)
+                if tokens:
+                    popped[key] = tokens
+        if popped:
+            self._publish(popped)
+
+    def invalidate_all(self):
+        """Tell every client that read anything to drop its whole cache, as {"keys": null}."""
+        with self.lock:
+            tokens = set().union(*self.table.values())
+            self.table = {}
+        for token in tokens:
+            if self.pubsub.publish(invalidation_channel(token), {"keys": None}):
+                self.messages += 1
+
+    def _publish(self, popped):
+        by_token = {}
+        for key, tokens in popped.items():
+            for token in tokens:
+                by_token.setdefault(token, []).append(key)
+        for token, keys in by_token.items():
+            if self.pubsub.publish(invalidation_channel(token), {"keys": keys}):
+                self.messages += 1
+                self.invalidated_keys += len(keys)
+
+    def stats(self):
+        return {
+            "tracked_keys": len(self.table),
+            "invalidation_messages": self.messages,
+            "invalidated_keys": self.invalidated_keys,
+        }
\ No newline at end of file
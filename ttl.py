@@ -1,19 +1,92 @@
 #ttl.py
+import heapq
+import itertools
 import time
 from config import DEFAULT_TTL
 
 class TTL:
+    """Expiry times for volatile keys, indexed by a min-heap.
+
+    ttl_data maps each key to its absolute expiry time and is the source of
+    truth. The heap holds (expire_at, seq, key) entries ordered by expiry, so the
+    keys that are due can be found without scanning every volatile key.
+    Changing or removing a TTL leaves the old heap entry behind; stale
+    entries are skipped when popped and the heap is rebuilt once they
+    outnumber the live ones.
+    """
+
     def __init__(self):
         self.ttl_data = {}
+        self.heap = []
+        self.sequence = itertools.count()  # Tie-breaker, so keys are never compared
 
     def set_ttl(self, key, ttl=DEFAULT_TTL):
-        self.ttl_data[key] = time.time() + ttl
+        self.set_expiry(key, time.time() + ttl)
+
+    def set_expiry(self, key, expire_at):
+        """Expire key at the absolute time expire_at."""
+        self.ttl_data[key] = expire_at
+        heapq.heappush(self.heap, (expire_at, next(self.sequence), key))
+        if len(self.heap) > 2 * len(self.ttl_data) + 1024:
+            self.compact()
 
-    def is_expired(self, key):
-        if key in self.ttl_data:
-            return time.time() > self.ttl_data[key]
-        return False
+    def load_expiry(self, key, expire_at):
+        """Set key's expiry without indexing it, for bulk loads. Call compact() after the batch."""
+        self.ttl_data[key] = expire_at
+
+    def get(self, key):
+        """Return the absolute expiry time of key, or None."""
+        return self.ttl_data.get(key)
+
+    def is_expired(self, key, now=None):
+        expire_at = self.ttl_data.get(key)
+        if expire_at is None:
+            return False
+        return (time.time() if now is None else now) > expire_at
 
     def delete_ttl(self, key):
-        if key in self.ttl_data:
-            del self.ttl_data[key]
\ No newline at end of file
+        self.ttl_data.pop(key, None)
+
+    def clear(self):
+        self.ttl_data.clear()
+        self.heap = []
+
+    def compact(self):
+        """Rebuild the heap from the live expiry times."""
+        self.heap = [(expire_at, next(self.sequence), key) for key, expire_at in self.ttl_data.items()]
+        heapq.heapify(self.heap)
+
+    def earliest(self):
+        """Return (expire_at, key) for the key that expires first, or None."""
+        heap = self.heap
+        while heap:
+            expire_at, _, key = heap[0]
+            if self.ttl_data.get(key) == expire_at:
+                return expire_at, key
+            heapq.heappop(heap)
+        return None
+
+    def next_expiry(self):
+        """Return the earliest live expiry time, or None."""
+        earliest = self.earliest()
+        return earliest[0] if earliest else None
+
+    def pop_expired(self, now=None, limit=None):
+        """Remove and return up to limit keys whose expiry time has passed.
+
+        The cost is proportional to the number of keys returned (plus any
+        stale heap entries skipped), not to the number of volatile keys.
+        """
+        now = time.time() if now is None else now
+        heap = self.heap
+        ttl_data = self.ttl_data
+        expired = []
+        while heap and heap[0][0] < now:
+            expire_at, _, key = heapq.heappop(heap)
+            if ttl_data.get(key) != expire_at:
+                continue  # TTL was changed or removed since this entry was pushed
+            del ttl_data[key]
+            expired.append(key)
+            if limit is not None and len(expired) >= limit:
+                break
+        return expired
\ No newline at end of file